@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LocalBlast 性能基准测试
+根据species_db.json合成测序读段（可配置长度和突变率），连同inputexample中的示例文件，
+分别测试序列解析、BLAST比对、HTML生成、PNG渲染和完整批量处理的耗时，
+输出吞吐量、p50/p95延迟和峰值内存（JSON格式），便于不同版本之间对比。
+未安装BLAST+或Chrome时自动跳过对应阶段，可完全离线运行。
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import blast_app
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，无法统计峰值内存
+    resource = None
+
+BASES = 'ACGT'
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+def percentile(values, pct):
+    """最近秩法计算百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def peak_rss_mb():
+    """当前进程运行至今的峰值常驻内存（MB），只能反映整个进程而非单个阶段"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS单位为字节
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 2)
+    return round(peak / 1024, 2)
+
+def git_revision():
+    """当前代码的git版本（用于跨版本对比），获取失败时返回None"""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, timeout=5,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode == 0:
+            return result.stdout.strip()
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+    return None
+
+def mutate_sequence(sequence, mutation_rate, rng):
+    """按突变率引入替换和单碱基插入/缺失"""
+    mutated = []
+    for base in sequence:
+        if rng.random() >= mutation_rate:
+            mutated.append(base)
+            continue
+        kind = rng.random()
+        if kind < 0.8:
+            mutated.append(rng.choice(BASES.replace(base, '')))
+        elif kind < 0.9:
+            mutated.append(base)
+            mutated.append(rng.choice(BASES))
+        # 其余情况为缺失
+    return ''.join(mutated)
+
+def synthesize_reads(species_db, count, read_length, mutation_rate, rng, reverse_fraction=0.5):
+    """从参比序列中随机截取片段并加入突变，返回[(文件名, 序列, 来源物种)]"""
+    reads = []
+    for i in range(count):
+        species = rng.choice(species_db)
+        reference = species['sequence']
+        length = min(read_length, len(reference))
+        start = rng.randint(0, len(reference) - length)
+        read = mutate_sequence(reference[start:start + length], mutation_rate, rng)
+        if rng.random() < reverse_fraction:
+            read = read.translate(COMPLEMENT)[::-1]
+        reads.append((f"synthetic_{i:05d}_{species.get('code') or species['id']}.seq", read, species))
+    return reads
+
+def format_seq_file(sequence, width=80):
+    """按.seq文件格式每行输出固定长度"""
+    return '\n'.join(sequence[i:i + width] for i in range(0, len(sequence), width)) + '\n'
+
+def load_example_files():
+    """读取inputexample目录中的示例.seq文件"""
+    example_dir = os.path.join(blast_app.BASE_PATH, 'inputexample')
+    examples = []
+    for path in sorted(glob.glob(os.path.join(example_dir, '*.seq'))):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            examples.append((os.path.basename(path), f.read()))
+    return examples
+
+def summarize(latencies, items, elapsed):
+    """汇总一个阶段的耗时统计"""
+    return {
+        'items': items,
+        'total_seconds': round(elapsed, 4),
+        'throughput_per_second': round(items / elapsed, 3) if elapsed > 0 else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None
+    }
+
+def time_each(func, inputs):
+    """依次执行func(input)并记录每次耗时"""
+    latencies = []
+    outputs = []
+    started = time.perf_counter()
+    for item in inputs:
+        t0 = time.perf_counter()
+        outputs.append(func(item))
+        latencies.append(time.perf_counter() - t0)
+    return outputs, summarize(latencies, len(inputs), time.perf_counter() - started)
+
+def bench_parse(file_contents):
+    """序列解析（parse_seq_file）"""
+    _, stats = time_each(blast_app.parse_seq_file, file_contents)
+    return stats
+
+def bench_alignment(sequences):
+    """全物种比对（run_blastn_against_all_species）"""
+    outputs, stats = time_each(blast_app.run_blastn_against_all_species, sequences)
+    stats['queries_with_hits'] = sum(1 for hits in outputs if hits)
+    return stats, outputs
+
+def bench_html(sequences, hits_list):
+    """HTML结果生成（generate_html_result）"""
+    inputs = []
+    for sequence, hits in zip(sequences, hits_list):
+        if hits:
+            best = max(hits, key=lambda hit: hit['bitscore'])
+            inputs.append((sequence, best['species_info'], [best]))
+        else:
+            inputs.append((sequence, blast_app.SPECIES_DB[0], []))
+    outputs, stats = time_each(lambda args: blast_app.generate_html_result(*args, is_best_match=True), inputs)
+    return stats, outputs
+
+def bench_png(html_pages, work_dir):
+    """PNG渲染（html_to_image，复用同一个ChromeDriver）"""
+    driver = blast_app.start_shared_chromedriver()
+    if not driver:
+        return {'skipped': 'ChromeDriver不可用'}
+    try:
+        counter = iter(range(len(html_pages)))
+        _, stats = time_each(
+            lambda html: blast_app.html_to_image(html, os.path.join(work_dir, f"bench_{next(counter)}.png"), driver=driver),
+            html_pages
+        )
+        return stats
+    finally:
+        blast_app.close_chromedriver()
+
+def bench_batch(reads, sizes, work_dir, render_png):
+    """完整批量处理（/api/batch-blast），按不同批次大小分别测试"""
+    results = {}
+    client = blast_app.app.test_client()
+    original_folders = (blast_app.RESULTS_FOLDER, blast_app.UPLOAD_FOLDER)
+    original_png_mode = blast_app.PNG_RENDER_MODE
+    blast_app.RESULTS_FOLDER = os.path.join(work_dir, 'results')
+    blast_app.UPLOAD_FOLDER = os.path.join(work_dir, 'uploads')
+    # 默认的deferred模式在请求返回后才生成PNG，计时不包含渲染；这里显式选择eager或off
+    blast_app.PNG_RENDER_MODE = 'eager' if render_png else 'off'
+    try:
+        for size in sizes:
+            batch_reads = [reads[i % len(reads)] for i in range(size)]
+            data = {'files': [(io.BytesIO(format_seq_file(seq).encode('utf-8')), f"{i:05d}_{name}")
+                              for i, (name, seq, _) in enumerate(batch_reads)]}
+            started = time.perf_counter()
+            response = client.post('/api/batch-blast', data=data, content_type='multipart/form-data')
+            elapsed = time.perf_counter() - started
+            stats = summarize([elapsed], size, elapsed)
+            stats['status_code'] = response.status_code
+            payload = response.get_json(silent=True) or {}
+            stats['processed'] = payload.get('processed')
+            stats['seconds_per_file'] = round(elapsed / size, 4)
+            results[str(size)] = stats
+            print(f"  批量 {size} 个文件: {elapsed:.2f}s（{size / elapsed:.2f} 文件/秒）", file=sys.stderr)
+    finally:
+        # 确保work_dir被删除前没有后台渲染仍在写入
+        blast_app.PNG_RENDERER.cancel(work_dir)
+        blast_app.RESULTS_FOLDER, blast_app.UPLOAD_FOLDER = original_folders
+        blast_app.PNG_RENDER_MODE = original_png_mode
+    return results
+
+def run_benchmark(args):
+    """执行全部基准测试，返回结果字典"""
+    rng = random.Random(args.seed)
+    blast_app.load_species_db()
+    if not blast_app.SPECIES_DB:
+        raise SystemExit("错误: 物种数据库为空，无法合成测试序列")
+
+    blast_available = blast_app.check_blast_installed()
+    png_available = blast_app.SELENIUM_AVAILABLE and blast_app.PIL_AVAILABLE and not args.no_png
+
+    reads = synthesize_reads(blast_app.SPECIES_DB, args.reads, args.read_length, args.mutation_rate, rng)
+    examples = load_example_files()
+    file_contents = [format_seq_file(seq) for _, seq, _ in reads] + [content for _, content in examples]
+    sequences = [seq for _, seq, _ in reads] + [blast_app.parse_seq_file(content) for _, content in examples]
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'reads': args.reads,
+            'read_length': args.read_length,
+            'mutation_rate': args.mutation_rate,
+            'batch_sizes': args.batch_sizes,
+            'seed': args.seed,
+            'example_files': len(examples),
+            'species': len(blast_app.SPECIES_DB)
+        },
+        'environment': {
+            'blast': blast_available,
+            'png': png_available
+        },
+        'stages': {}
+    }
+    stages = report['stages']
+    work_dir = tempfile.mkdtemp(prefix='localblast_bench_')
+
+    try:
+        print("阶段: 序列解析", file=sys.stderr)
+        stages['parse'] = bench_parse(file_contents)
+
+        hits_list = [[] for _ in sequences]
+        if blast_available:
+            print("阶段: BLAST比对", file=sys.stderr)
+            stages['alignment'], hits_list = bench_alignment(sequences)
+        else:
+            stages['alignment'] = {'skipped': 'BLAST+未安装'}
+
+        print("阶段: HTML生成", file=sys.stderr)
+        stages['html'], html_pages = bench_html(sequences, hits_list)
+
+        if png_available:
+            print("阶段: PNG渲染", file=sys.stderr)
+            stages['png'] = bench_png(html_pages[:args.png_pages], work_dir)
+        else:
+            stages['png'] = {'skipped': 'selenium/Pillow未安装或已禁用'}
+
+        if blast_available:
+            print("阶段: 完整批量处理", file=sys.stderr)
+            stages['batch'] = bench_batch(reads, args.batch_sizes, work_dir, png_available)
+        else:
+            stages['batch'] = {'skipped': 'BLAST+未安装'}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # ru_maxrss是进程生命周期内的峰值，只在报告顶层给出一次
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+def compare_reports(baseline, current):
+    """打印与基线结果的吞吐量和p95对比（输出到标准错误，标准输出只保留JSON结果）"""
+    print(f"\n与基线对比（{baseline.get('git_revision')} -> {current.get('git_revision')}）:", file=sys.stderr)
+
+    def flatten(stages):
+        for stage, stats in stages.items():
+            if 'items' in stats or 'skipped' in stats:
+                yield stage, stats
+            else:
+                for size, size_stats in stats.items():
+                    yield f"{stage}[{size}]", size_stats
+
+    baseline_stages = dict(flatten(baseline.get('stages', {})))
+    for name, stats in flatten(current.get('stages', {})):
+        old = baseline_stages.get(name)
+        if not old or 'skipped' in stats or 'skipped' in old:
+            continue
+        old_tp, new_tp = old.get('throughput_per_second'), stats.get('throughput_per_second')
+        old_p95, new_p95 = old.get('p95_ms'), stats.get('p95_ms')
+        line = f"  {name:<16}"
+        if old_tp and new_tp:
+            line += f" 吞吐量 {old_tp:>10.2f} -> {new_tp:>10.2f} ({(new_tp / old_tp - 1) * 100:+.1f}%)"
+        if old_p95 and new_p95:
+            line += f"  p95 {old_p95:>9.2f}ms -> {new_p95:>9.2f}ms ({(new_p95 / old_p95 - 1) * 100:+.1f}%)"
+        print(line, file=sys.stderr)
+
+def parse_sizes(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='LocalBlast 性能基准测试')
+    parser.add_argument('--reads', type=int, default=50, help='合成读段数量（默认50）')
+    parser.add_argument('--read-length', type=int, default=250, help='合成读段长度（默认250）')
+    parser.add_argument('--mutation-rate', type=float, default=0.02, help='每个碱基的突变概率（默认0.02）')
+    parser.add_argument('--batch-sizes', type=parse_sizes, default=[1, 10, 50],
+                        help='完整批量处理测试的批次大小，逗号分隔（默认1,10,50）')
+    parser.add_argument('--png-pages', type=int, default=10, help='PNG渲染测试的页面数（默认10）')
+    parser.add_argument('--no-png', action='store_true', help='跳过PNG渲染测试')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子（默认42）')
+    parser.add_argument('-o', '--output', help='结果JSON输出路径（默认输出到标准输出）')
+    parser.add_argument('--compare', help='基线结果JSON，用于对比')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"结果已保存到: {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_reports(json.load(f), report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,18 +9,147 @@ LocalBlast - 本地化BLAST程序
 import os
 import sys
 import json
+import asyncio
 import subprocess
 import tempfile
 import shutil
 import zipfile
+import tarfile
 import uuid
 import csv
+import functools
+import heapq
+import hmac
+import itertools
+import math
 import random
+from bisect import bisect_left
+import threading
+import logging
+import logging.handlers
+import queue
+import atexit
+from contextlib import contextmanager
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, Response, g, render_template, request, jsonify, send_file
 from flask_cors import CORS
 import re
+import urllib.error
+import urllib.request
+from html import escape as html_escape
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+import species_ref
+from species_ref import iter_canonical_kmers, reverse_complement
+
+# 日志：JSON（默认）或文本格式，经队列由后台线程输出，记录日志不会阻塞请求处理
+LOG_LEVEL = os.environ.get('LOCALBLAST_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOCALBLAST_LOG_FORMAT', 'json')
+
+logger = logging.getLogger('localblast')
+
+# 当前线程的日志上下文（request_id、batch_id、file），自动附加到每条日志
+_log_context = threading.local()
+
+# LogRecord自带的属性，其余属性（上下文和extra字段）都输出到日志中
+_STANDARD_LOG_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def get_log_context():
+    """返回当前线程日志上下文的副本（用于传递给工作线程）"""
+    return dict(getattr(_log_context, 'values', {}))
+
+def set_log_context(values):
+    """替换当前线程的日志上下文"""
+    _log_context.values = dict(values)
+
+def bind_log_context(**values):
+    """向当前线程的日志上下文中添加字段"""
+    set_log_context({**get_log_context(), **values})
+
+@contextmanager
+def log_context(**values):
+    """在代码块内临时绑定日志上下文字段"""
+    previous = get_log_context()
+    set_log_context({**previous, **{k: v for k, v in values.items() if v is not None}})
+    try:
+        yield
+    finally:
+        set_log_context(previous)
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """在调用线程中附加日志上下文并预先格式化消息，再放入队列"""
+    
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        for key, value in getattr(_log_context, 'values', {}).items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonLogFormatter(logging.Formatter):
+    """每条日志输出一行JSON"""
+    
+    def format(self, record):
+        payload = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_LOG_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_text:
+            payload['exception'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """便于阅读的文本格式（命令行使用），上下文字段附加在行尾"""
+    
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(message)s', datefmt='%H:%M:%S')
+    
+    def format(self, record):
+        line = super().format(record)
+        extras = [f"{key}={value}" for key, value in record.__dict__.items()
+                  if key not in _STANDARD_LOG_ATTRS and not key.startswith('_')]
+        if extras:
+            line = line.split('\n', 1)
+            line[0] += f" [{' '.join(extras)}]"
+            line = '\n'.join(line)
+        return line
+
+_log_listener = None
+
+def setup_logging(log_format=None, level=None):
+    """配置localblast日志：QueueHandler入队，QueueListener后台线程写stderr"""
+    global _log_listener
+    stop_logging()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    log_format = log_format or LOG_FORMAT
+    stream_handler.setFormatter(JsonLogFormatter() if log_format == 'json' else TextLogFormatter())
+    log_queue = queue.SimpleQueue()
+    logger.handlers = [ContextQueueHandler(log_queue)]
+    logger.setLevel(level or LOG_LEVEL)
+    logger.propagate = False
+    _log_listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _log_listener.start()
+
+def stop_logging():
+    """退出前输出队列中剩余的日志"""
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener = None
+
+setup_logging()
+atexit.register(stop_logging)
 
 # 可选依赖：用于HTML转PNG功能
 try:
@@ -32,7 +161,7 @@ try:
     SELENIUM_AVAILABLE = True
 except ImportError:
     SELENIUM_AVAILABLE = False
-    print("警告: selenium未安装，PNG图片生成功能将不可用")
+    logger.warning("selenium未安装，PNG图片生成功能将不可用")
 
 try:
     from PIL import Image
@@ -40,7 +169,14 @@ try:
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
-    print("警告: Pillow未安装，PNG图片生成功能将不可用")
+    logger.warning("Pillow未安装，PNG图片生成功能将不可用")
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    # numpy仅用于大批量HSP覆盖度的向量化计算，未安装时使用纯Python实现
+    NUMPY_AVAILABLE = False
 
 import time
 
@@ -70,25 +206,665 @@ CORS(app)
 UPLOAD_FOLDER = os.path.join(BASE_PATH, 'uploads')
 RESULTS_FOLDER = os.path.join(BASE_PATH, 'results')
 ALLOWED_EXTENSIONS = {'seq'}
+# 批量上传支持的压缩包格式（包内的.seq文件逐个解出）
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# 上传限制（可通过环境变量调整）
+MAX_UPLOAD_SIZE = int(os.environ.get('LOCALBLAST_MAX_UPLOAD_MB', 1024)) * 1024 * 1024
+MAX_BATCH_FILES = int(os.environ.get('LOCALBLAST_MAX_BATCH_FILES', 10000))
+MAX_SEQ_FILE_SIZE = int(os.environ.get('LOCALBLAST_MAX_SEQ_FILE_KB', 1024)) * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
+class LocalBlastRequest(Request):
+    """放宽表单字段数量限制（默认1000个），以支持多文件批量上传"""
+    max_form_parts = MAX_BATCH_FILES + 100
+
+app.request_class = LocalBlastRequest
 
 # 确保文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
+# 性能指标（/metrics，Prometheus文本格式）
+# 各阶段耗时直方图的分桶（秒）
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    'localblast_stage_seconds': ('histogram', '各处理阶段耗时（秒）'),
+    'localblast_http_request_seconds': ('histogram', 'HTTP请求耗时（秒）'),
+    'localblast_http_requests_total': ('counter', 'HTTP请求数'),
+    'localblast_subprocesses_total': ('counter', '启动的外部进程数（makeblastdb/blastn等）'),
+    'localblast_subprocesses_running': ('gauge', '正在运行的外部进程数'),
+    'localblast_subprocesses_waiting': ('gauge', '等待并发名额的外部进程数（job_class=interactive/batch）'),
+    'localblast_subprocesses_killed_total': ('counter', '因超时或取消被终止的外部进程数（reason=timeout/cancelled）'),
+    'localblast_cache_requests_total': ('counter', '缓存访问次数（result=hit/miss）'),
+    'localblast_batch_queue_depth': ('gauge', '批量处理中等待比对的文件数'),
+    'localblast_batches_running': ('gauge', '正在运行的批次数'),
+    'localblast_batch_files_total': ('counter', '批量处理完成的文件数（status=done/error/cancelled）'),
+    'localblast_png_pending': ('gauge', '等待后台生成的PNG图片数'),
+    'localblast_prefilter_total': ('counter', '比对前预筛选结果（outcome=exact/restricted/full/fallback）'),
+    'localblast_targeted_total': ('counter', '按文件名编号定向确认的结果（outcome=confirmed/fallback）'),
+    'localblast_batch_dedup_total': ('counter', '批次内与其他记录序列相同、复用比对结果的记录数'),
+    'localblast_admission_rejected_total': ('counter', '因队列已满或超出单客户端并发上限返回429的请求数（queue=interactive/batch/worker, reason=full/client）'),
+    'localblast_worker_healthy': ('gauge', '工作节点是否可用（worker=节点URL，1为可用）'),
+    'localblast_worker_chunks_total': ('counter', '分发给工作节点的比对分组数（outcome=done/failed/busy）'),
+}
+
+class MetricsRegistry:
+    """线程安全的进程内指标注册表：计数器、仪表和直方图"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+    
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+    
+    def inc(self, name, value=1, **labels):
+        """计数器/仪表加value"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+    
+    def dec(self, name, value=1, **labels):
+        self.inc(name, -value, **labels)
+    
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+    
+    def observe(self, name, value, **labels):
+        """直方图记录一次观测值"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(STAGE_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(STAGE_BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def get(self, name, **labels):
+        with self._lock:
+            return self._values.get(self._key(name, labels), 0)
+    
+    def render(self):
+        """导出为Prometheus文本格式"""
+        def format_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+        
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+        
+        lines = []
+        names = sorted({name for name, _ in values} | {name for name, _ in histograms})
+        for name in names:
+            metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for (metric_name, labels), value in sorted(values.items()):
+                if metric_name == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+            for (metric_name, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+                for bound, bucket_count in zip(STAGE_BUCKETS, buckets):
+                    lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {bucket_count}')
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total:.6f}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+
+class StageTimings:
+    """单个请求/批次的各阶段耗时汇总（可在多个工作线程间共享）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+    
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+    
+    def as_dict(self):
+        with self._lock:
+            return {stage: {'count': entry['count'], 'seconds': round(entry['seconds'], 4)}
+                    for stage, entry in self.stages.items()}
+
+# 当前线程正在记录的StageTimings（未记录时为None）
+_timing_context = threading.local()
+
+def get_stage_timings():
+    return getattr(_timing_context, 'timings', None)
+
+def set_stage_timings(timings):
+    """为当前线程设置（或清除）阶段耗时记录对象，返回之前的对象"""
+    previous = get_stage_timings()
+    _timing_context.timings = timings
+    return previous
+
+@contextmanager
+def timed_stage(stage):
+    """记录一个处理阶段的耗时：写入全局直方图，并计入当前请求的耗时明细"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        METRICS.observe('localblast_stage_seconds', elapsed, stage=stage)
+        timings = get_stage_timings()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+# 同时运行的外部工具进程（makeblastdb/blastn）数上限，默认为CPU核数
+MAX_TOOL_PROCESSES = int(os.environ.get('LOCALBLAST_MAX_TOOL_PROCESSES', os.cpu_count() or 1))
+
+class ToolCancelled(Exception):
+    """外部工具进程因调用方取消而被终止"""
+
+# 交互式请求与批量任务分配外部进程名额的权重（两类都在排队时按权重轮流分配）
+INTERACTIVE_WEIGHT = max(1, int(os.environ.get('LOCALBLAST_INTERACTIVE_WEIGHT', 4)))
+BATCH_WEIGHT = max(1, int(os.environ.get('LOCALBLAST_BATCH_WEIGHT', 1)))
+# 为交互式请求保留的进程名额（批量任务最多占用其余名额），默认在多于一个名额时保留1个
+INTERACTIVE_RESERVED = int(os.environ.get('LOCALBLAST_INTERACTIVE_RESERVED', 1 if MAX_TOOL_PROCESSES > 1 else 0))
+
+# 当前线程提交的外部工具进程所属的队列（批量处理的工作线程为batch，其余为interactive）
+_job_context = threading.local()
+
+def get_job_class():
+    return getattr(_job_context, 'job_class', 'interactive')
+
+def set_job_class(job_class):
+    """为当前线程设置队列类别（None恢复为interactive），返回之前的类别"""
+    previous = get_job_class()
+    _job_context.job_class = job_class or 'interactive'
+    return previous
+
+# 当前线程的取消事件（置位时该线程启动的外部工具进程会被终止，未设置时为None）
+_cancel_context = threading.local()
+
+def get_cancel_event():
+    return getattr(_cancel_context, 'event', None)
+
+def set_cancel_event(event):
+    """为当前线程设置（或清除）取消事件，返回之前的对象"""
+    previous = get_cancel_event()
+    _cancel_context.event = event
+    return previous
+
+class ToolProcess:
+    """由ToolRunner启动的外部工具进程：迭代时逐行返回stdout，迭代结束后可读取returncode和stderr
+    
+    提前停止迭代（break或解析出错）会终止进程；超时抛出subprocess.TimeoutExpired，取消抛出ToolCancelled。
+    """
+    
+    def __init__(self, future, lines, abort):
+        self._future = future
+        self._lines = lines
+        self._abort = abort
+        self.returncode = None
+        self.stderr = ''
+    
+    def __iter__(self):
+        try:
+            while True:
+                line = self._lines.get()
+                if line is None:
+                    break
+                yield line
+            self.returncode, self.stderr = self._future.result()
+        finally:
+            self._abort.set()
+
+class ToolScheduler:
+    """外部工具进程并发名额的分配（只在ToolRunner的事件循环线程中使用）
+    
+    交互式请求和批量任务分别排队，有空闲名额时按权重在有等待者的队列间平滑轮转分配；
+    批量任务最多同时占用limits['batch']个名额，剩余名额留给交互式请求。
+    同一队列内任务量（查询序列总长度）小的先分配，相同时按提交顺序。
+    """
+    
+    def __init__(self, max_processes, weights, reserved=0):
+        self.max_processes = max_processes
+        self.weights = weights
+        self.limits = {job_class: max_processes for job_class in weights}
+        self.limits['batch'] = max(1, max_processes - reserved)
+        self._queues = {job_class: [] for job_class in weights}
+        self._current = {job_class: 0 for job_class in weights}
+        self._running = {job_class: 0 for job_class in weights}
+        self._sequence = itertools.count()
+    
+    async def acquire(self, job_class, cost=0):
+        """排队等待一个名额"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues[job_class], (cost, next(self._sequence), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 名额已分配但等待方被取消时归还名额
+            if future.done() and not future.cancelled():
+                self.release(job_class)
+            raise
+    
+    def release(self, job_class):
+        self._running[job_class] -= 1
+        self._dispatch()
+    
+    def _dispatch(self):
+        while sum(self._running.values()) < self.max_processes:
+            ready = []
+            for job_class, waiting in self._queues.items():
+                while waiting and waiting[0][2].cancelled():
+                    heapq.heappop(waiting)
+                if waiting and self._running[job_class] < self.limits[job_class]:
+                    ready.append(job_class)
+            if not ready:
+                return
+            # 平滑加权轮转：每轮各队列累加权重，选累计值最大的队列，再减去本轮权重总和
+            for job_class in ready:
+                self._current[job_class] += self.weights[job_class]
+            chosen = max(ready, key=self._current.get)
+            self._current[chosen] -= sum(self.weights[job_class] for job_class in ready)
+            _, _, future = heapq.heappop(self._queues[chosen])
+            self._running[chosen] += 1
+            future.set_result(None)
+
+class ToolRunner:
+    """在独立线程的asyncio事件循环中运行外部工具进程
+    
+    进程通过asyncio.create_subprocess_exec启动，ToolScheduler限制同时运行的进程数，
+    超出上限的调用按交互式/批量队列排队等待而不会同时启动；stdout按行流式交给调用线程解析。
+    等待进程期间定期检查超时和取消事件，需要时终止进程。
+    """
+    
+    POLL_SECONDS = 0.2
+    # 单行输出上限（qseq/sseq列可能很长）
+    LINE_LIMIT = 64 * 1024 * 1024
+    
+    def __init__(self, max_processes, weights, reserved=0):
+        self.max_processes = max(1, max_processes)
+        self._scheduler = ToolScheduler(self.max_processes, weights, reserved)
+        self._loop = None
+        self._lock = threading.Lock()
+    
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                
+                def run_loop():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+                
+                threading.Thread(target=run_loop, name='tool-runner', daemon=True).start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+    
+    def start(self, cmd, timeout=None, cancel_event=None, job_class='interactive', cost=0):
+        """提交cmd，返回ToolProcess（进程在job_class队列中获得并发名额后启动）"""
+        lines = queue.Queue()
+        abort = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._execute(cmd, timeout, cancel_event, lines, abort, job_class, cost), self._get_loop())
+        return ToolProcess(future, lines, abort)
+    
+    async def _execute(self, cmd, timeout, cancel_event, lines, abort, job_class, cost):
+        try:
+            METRICS.inc('localblast_subprocesses_waiting', job_class=job_class)
+            try:
+                await self._scheduler.acquire(job_class, cost)
+            finally:
+                METRICS.dec('localblast_subprocesses_waiting', job_class=job_class)
+            try:
+                if abort.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                    raise ToolCancelled(f"{os.path.basename(cmd[0])} 已取消")
+                return await self._run_process(cmd, timeout, cancel_event, lines, abort)
+            finally:
+                self._scheduler.release(job_class)
+        finally:
+            lines.put(None)
+    
+    async def _run_process(self, cmd, timeout, cancel_event, lines, abort):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, limit=self.LINE_LIMIT)
+        METRICS.inc('localblast_subprocesses_running')
+        stderr_task = asyncio.ensure_future(process.stderr.read())
+        stdout_task = asyncio.ensure_future(self._pump(process.stdout, lines))
+        try:
+            while True:
+                done, _ = await asyncio.wait({stdout_task}, timeout=self.POLL_SECONDS)
+                if done:
+                    break
+                if abort.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                    METRICS.inc('localblast_subprocesses_killed_total', reason='cancelled')
+                    raise ToolCancelled(f"{os.path.basename(cmd[0])} 已取消")
+                if deadline is not None and loop.time() > deadline:
+                    METRICS.inc('localblast_subprocesses_killed_total', reason='timeout')
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+            stdout_task.result()
+            returncode = await process.wait()
+            stderr = await stderr_task
+            return returncode, stderr.decode('utf-8', errors='replace')
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            stdout_task.cancel()
+            stderr_task.cancel()
+            METRICS.dec('localblast_subprocesses_running')
+    
+    @staticmethod
+    async def _pump(stream, lines):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            lines.put(line.decode('utf-8', errors='replace'))
+
+TOOL_RUNNER = ToolRunner(MAX_TOOL_PROCESSES, {'interactive': INTERACTIVE_WEIGHT, 'batch': BATCH_WEIGHT},
+                         reserved=INTERACTIVE_RESERVED)
+
+def start_tool(cmd, timeout=None, cost=0):
+    """启动外部工具（makeblastdb/blastn等），返回逐行产生stdout的ToolProcess
+    
+    受全局并发上限约束，在当前线程所属的队列中按cost（任务量）排队；
+    当前线程设置了取消事件时，事件置位会终止进程。
+    """
+    METRICS.inc('localblast_subprocesses_total', tool=os.path.basename(cmd[0]))
+    return TOOL_RUNNER.start(cmd, timeout=timeout, cancel_event=get_cancel_event(),
+                             job_class=get_job_class(), cost=cost)
+
+def run_tool(cmd, stage, check=False, timeout=None, **kwargs):
+    """运行外部工具并等待结束，统计进程数和耗时，返回subprocess.CompletedProcess
+    
+    调用方式与subprocess.run兼容；输出始终被收集（capture_output/text参数被忽略，stdout/stderr为str）。
+    """
+    with timed_stage(stage):
+        process = start_tool(cmd, timeout=timeout)
+        stdout = ''.join(process)
+    result = subprocess.CompletedProcess(cmd, process.returncode, stdout, process.stderr)
+    if check:
+        result.check_returncode()
+    return result
+
+def record_cache_access(cache, hit):
+    """记录一次缓存命中/未命中"""
+    METRICS.inc('localblast_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+def timings_requested():
+    """请求是否要求在响应中返回各阶段耗时明细（?timings=1 或表单/JSON字段timings）"""
+    value = request.args.get('timings') or request.form.get('timings')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('timings')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def with_timings(payload):
+    """按请求要求在API响应中附加各阶段耗时明细"""
+    timings = get_stage_timings()
+    if timings is not None and timings_requested():
+        payload['timings'] = timings.as_dict()
+    return payload
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.stage_timings = StageTimings()
+    set_stage_timings(g.stage_timings)
+    # 请求ID：沿用上游传入的X-Request-ID，否则新生成
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    set_log_context({'request_id': g.request_id})
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unknown'
+        METRICS.observe('localblast_http_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+        METRICS.inc('localblast_http_requests_total', endpoint=endpoint, status=response.status_code)
+    request_id = getattr(g, 'request_id', None)
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.teardown_request
+def clear_request_timings(exc=None):
+    set_stage_timings(None)
+    set_log_context({})
+
 # 加载物种数据库
 SPECIES_DB_FILE = os.path.join(BASE_PATH, 'species_db.json')
+# 由species_db.json编译的二进制参比库（见species_ref.py），以内存映射方式加载；
+# 该文件只记录当前带版本号的参比库文件名
+SPECIES_REF_FILE = os.path.join(BASE_PATH, 'species_db.ref')
 SPECIES_DB = []
+# 当前使用的编译参比库（CompiledReference），使用JSON数据时为None
+SPECIES_REFERENCE = None
+# 参比库版本哈希（由ID、名称、编号和序列决定）
+REFERENCE_HASH = ''
+# 物种ID -> 物种信息
+SPECIES_BY_ID = {}
+# 不含序列的物种元数据列表（用于页面渲染和/api/species）
+SPECIES_METADATA = []
+# 全部参比序列总长度（限定候选物种比对时作为-dbsize，保持E值与全库比对一致）
+REFERENCE_TOTAL_LENGTH = 0
 
-def load_species_db():
-    """加载物种数据库"""
-    global SPECIES_DB
+def species_metadata(species):
+    """物种元数据（不含序列）"""
+    return {
+        'id': species['id'],
+        'name': species.get('name', ''),
+        'code': species.get('code', ''),
+        'length': species.get('length') or len(species['sequence'])
+    }
+
+def open_compiled_reference():
+    """打开与species_db.json一致的编译参比库，不存在或已过期时重新编译
+    
+    Returns:
+        CompiledReference，无法使用编译参比库时返回None
+    """
+    source_sha256 = file_sha256(SPECIES_DB_FILE) if os.path.exists(SPECIES_DB_FILE) else None
+    try:
+        reference = species_ref.open_reference(SPECIES_REF_FILE, source_sha256)
+        if reference is not None or source_sha256 is None:
+            return reference
+    except (OSError, ValueError) as e:
+        logger.warning(f"无法加载编译参比库 {SPECIES_REF_FILE}: {str(e)}")
+    
+    # 编译结果缺失或与JSON不一致（例如手动编辑了species_db.json）
     try:
-        with open(SPECIES_DB_FILE, 'r', encoding='utf-8') as f:
-            SPECIES_DB = json.load(f)
-        print(f"已加载 {len(SPECIES_DB)} 个物种")
-    except FileNotFoundError:
-        print(f"警告: 未找到 {SPECIES_DB_FILE}")
-        SPECIES_DB = []
+        with timed_stage('reference_compile'):
+            species_ref.compile_species_db(SPECIES_DB_FILE, SPECIES_REF_FILE, PREFILTER_K)
+        logger.info(f"已重新编译参比库: {SPECIES_REF_FILE}")
+        return species_ref.open_reference(SPECIES_REF_FILE, source_sha256)
+    except (OSError, ValueError) as e:
+        logger.warning(f"编译参比库失败，使用JSON数据: {str(e)}")
+        return None
+
+def load_species_db():
+    """加载物种数据库，并建立预筛选k-mer索引
+    
+    优先以只读内存映射方式加载编译参比库，多个进程共享页面缓存，序列在使用时才解码；
+    无法使用编译参比库时读取species_db.json。
+    """
+    global SPECIES_DB, SPECIES_REFERENCE, REFERENCE_HASH, SPECIES_BY_ID, SPECIES_METADATA
+    global REFERENCE_TOTAL_LENGTH, PREFILTER_INDEX
+    reference = open_compiled_reference()
+    if reference is not None:
+        SPECIES_DB = reference.species
+        REFERENCE_HASH = reference.reference_hash
+        logger.info(f"已加载 {len(SPECIES_DB)} 个物种（编译参比库）")
+    else:
+        try:
+            with open(SPECIES_DB_FILE, 'r', encoding='utf-8') as f:
+                SPECIES_DB = json.load(f)
+            logger.info(f"已加载 {len(SPECIES_DB)} 个物种")
+        except FileNotFoundError:
+            logger.warning(f"未找到 {SPECIES_DB_FILE}")
+            SPECIES_DB = []
+        REFERENCE_HASH = species_ref.reference_hash(SPECIES_DB)
+    # 旧的参比库不主动关闭，正在进行的比对可能仍在读取
+    SPECIES_REFERENCE = reference
+    
+    SPECIES_BY_ID = {species['id']: species for species in SPECIES_DB}
+    SPECIES_METADATA = [species_metadata(species) for species in SPECIES_DB]
+    REFERENCE_TOTAL_LENGTH = sum(species['length'] for species in SPECIES_METADATA)
+    PREFILTER_INDEX = None
+    if PREFILTER_MODE != 'off' and SPECIES_DB:
+        species_ids = [species['id'] for species in SPECIES_DB]
+        if reference is not None and reference.k == PREFILTER_K:
+            # 直接使用编译参比库中内存映射的k-mer索引
+            PREFILTER_INDEX = KmerIndex(reference.k, reference.postings, species_ids)
+        else:
+            with timed_stage('prefilter_build'):
+                PREFILTER_INDEX = KmerIndex(PREFILTER_K, species_ref.build_kmer_postings(
+                    [species['sequence'] for species in SPECIES_DB], PREFILTER_K), species_ids)
+        logger.info(f"预筛选索引: {len(PREFILTER_INDEX.postings)} 条k-mer记录（k={PREFILTER_K}）")
+
+# 比对前的快速预筛选（精确子串 + k-mer包含度），可通过环境变量配置：
+#   off      关闭预筛选，始终与全部参比序列比对（默认）
+#   restrict 包含度足够高时只与前K个候选物种比对
+#   answer   查询序列是某参比序列的精确子串时直接给出结果，否则同restrict
+PREFILTER_MODE = os.environ.get('LOCALBLAST_PREFILTER', 'off').lower()
+PREFILTER_K = int(os.environ.get('LOCALBLAST_PREFILTER_K', 16))
+PREFILTER_TOP_K = int(os.environ.get('LOCALBLAST_PREFILTER_TOP_K', 8))
+# 最佳候选的k-mer包含度（查询k-mer中出现在该参比序列中的比例）低于此值时不限定候选
+PREFILTER_MIN_CONTAINMENT = float(os.environ.get('LOCALBLAST_PREFILTER_MIN_CONTAINMENT', 0.8))
+# 出现在过多参比序列中的k-mer（低复杂度区域）不参与计分
+PREFILTER_MAX_OCCURRENCES = 64
+PREFILTER_INDEX = None
+
+class KmerIndex:
+    """参比序列的规范k-mer倒排索引
+    
+    postings为有序的64位整数数组（见species_ref.build_kmer_postings），每个元素为 (规范k-mer编码 << 32) | (参比序列下标 << 1) | 方向位，
+    查询时对每个k-mer二分查找，无需为每个k-mer创建Python对象。查询序列无论正向还是反向
+    都只需查找一次，并可根据方向位是否一致判断查询序列相对参比序列的方向。
+    """
+    
+    def __init__(self, k, postings, species_ids):
+        self.k = k
+        self.postings = postings
+        self.species_ids = species_ids
+    
+    def containment(self, sequence):
+        """返回(查询k-mer数, {物种ID: 共有k-mer数}, {物种ID: 反向k-mer数})
+        
+        反向k-mer数为以反向互补形式出现在参比序列中的共有k-mer数，
+        超过共有k-mer数一半时查询序列为反向（minus链）。
+        """
+        query_codes = dict(iter_canonical_kmers(sequence, self.k))
+        postings = self.postings
+        total = len(postings)
+        shared = {}
+        reverse = {}
+        for code, orientation in query_codes.items():
+            position = bisect_left(postings, code << 32)
+            end = position
+            while end < total and postings[end] >> 32 == code:
+                end += 1
+            if end - position > PREFILTER_MAX_OCCURRENCES:
+                continue
+            for i in range(position, end):
+                index = (postings[i] & 0xFFFFFFFF) >> 1
+                if (postings[i] & 1) != orientation:
+                    reverse[index] = reverse.get(index, 0) + 1
+                # 同一k-mer在参比序列中正反两个方向都出现时只计一次
+                if i == position or (postings[i - 1] & 0xFFFFFFFF) >> 1 != index:
+                    shared[index] = shared.get(index, 0) + 1
+        species_ids = self.species_ids
+        return (len(query_codes),
+                {species_ids[index]: count for index, count in shared.items()},
+                {species_ids[index]: count for index, count in reverse.items()})
+
+def exact_match_hits(query_sequence, species_list, strand='plus'):
+    """查询序列（strand为minus时为其反向互补）作为精确子串出现在参比序列中时，
+    构造与blastn输出格式一致的命中结果
+    
+    bitscore和E值按megablast默认打分（reward 1/penalty -2，λ=1.28，K=0.46）估算，
+    与blastn报告值可能有±1的差异。
+    """
+    length = len(query_sequence)
+    bitscore = (1.28 * length - math.log(0.46)) / math.log(2)
+    evalue = length * max(REFERENCE_TOTAL_LENGTH, 1) * 2 ** (-bitscore)
+    target = reverse_complement(query_sequence) if strand == 'minus' else query_sequence
+    hits = []
+    for species in species_list:
+        position = species['sequence'].find(target)
+        if position < 0:
+            continue
+        # minus链命中时subject坐标与blastn一致，按降序给出
+        if strand == 'minus':
+            subject_start, subject_end = position + length, position + 1
+        else:
+            subject_start, subject_end = position + 1, position + length
+        hits.append({
+            'query_id': 'Query',
+            'subject_id': f"{species['id']}|{species['name']}",
+            'identity': 100.0,
+            'alignment_length': length,
+            'mismatches': 0,
+            'gap_opens': 0,
+            'query_start': 1,
+            'query_end': length,
+            'subject_start': subject_start,
+            'subject_end': subject_end,
+            'evalue': evalue,
+            'bitscore': round(bitscore, 1),
+            'strand': strand,
+            'query_seq': query_sequence,
+            'subject_seq': query_sequence,
+            'species_info': species
+        })
+    return hits
+
+def prefilter_query(query_sequence):
+    """预筛选：返回(结果类型, 候选物种列表, 精确匹配命中, 查询序列方向)
+    
+    结果类型：exact（精确子串，可直接作答）、restricted（限定前K个候选）、full（全库比对）；
+    查询序列方向（plus/minus）由最佳候选的共有k-mer方向判断，无法判断时为None。
+    """
+    if PREFILTER_INDEX is None or len(query_sequence) < PREFILTER_INDEX.k:
+        return 'full', None, None, None
+    
+    with timed_stage('prefilter'):
+        query_kmers, shared, reverse = PREFILTER_INDEX.containment(query_sequence)
+        if not query_kmers or not shared:
+            return 'full', None, None, None
+        
+        ranked = sorted(shared.items(), key=lambda item: item[1], reverse=True)
+        best_id, best_count = ranked[0]
+        if best_count / query_kmers < PREFILTER_MIN_CONTAINMENT:
+            return 'full', None, None, None
+        
+        strand = 'minus' if reverse.get(best_id, 0) * 2 > best_count else 'plus'
+        candidates = [SPECIES_BY_ID[species_id] for species_id, _ in ranked[:PREFILTER_TOP_K]]
+        if PREFILTER_MODE == 'answer' and best_count == query_kmers:
+            # 所有k-mer都命中的候选才可能包含完整的查询序列
+            full_matches = [SPECIES_BY_ID[species_id] for species_id, count in ranked if count == query_kmers]
+            hits = exact_match_hits(query_sequence, full_matches, strand)
+            if hits:
+                return 'exact', candidates, hits, strand
+        return 'restricted', candidates, None, strand
 
 def check_blast_installed():
     """检查BLAST+是否已安装"""
@@ -114,88 +890,448 @@ def check_blast_installed():
     except Exception:
         return False
 
+# blastn表格输出字段（sstrand为参比序列方向，查询序列始终为plus）
+BLAST_OUTFMT = '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore sstrand qseq sseq'
+
+def parse_blast_line(line):
+    """解析BLAST表格输出的一行，注释行、空行或列数不足时返回None"""
+    if line.startswith('#') or not line.strip():
+        return None
+    
+    # 解析BLAST表格输出格式
+    # qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore [sstrand qseq sseq]
+    parts = line.rstrip('\r\n').split('\t')
+    if len(parts) < 12:
+        return None
+    result = {
+        'query_id': parts[0],
+        'subject_id': parts[1],
+        'identity': float(parts[2]),
+        'alignment_length': int(parts[3]),
+        'mismatches': int(parts[4]),
+        'gap_opens': int(parts[5]),
+        'query_start': int(parts[6]),
+        'query_end': int(parts[7]),
+        'subject_start': int(parts[8]),
+        'subject_end': int(parts[9]),
+        'evalue': float(parts[10]),
+        'bitscore': float(parts[11])
+    }
+    if len(parts) >= 13:
+        result['strand'] = parts[12].strip()
+    else:
+        result['strand'] = 'minus' if result['subject_start'] > result['subject_end'] else 'plus'
+    if len(parts) >= 15:
+        # 比对后的查询/参比序列（含gap），用于结果页面的Alignments等标签页
+        result['query_seq'] = parts[13].strip()
+        result['subject_seq'] = parts[14].strip()
+    return result
+
 def parse_blast_output(blast_output):
     """解析BLAST输出结果"""
     results = []
-    lines = blast_output.strip().split('\n')
+    for line in blast_output.strip().split('\n'):
+        result = parse_blast_line(line)
+        if result is not None:
+            results.append(result)
+    return results
+
+def stream_blastn(cmd, timeout, cost=0):
+    """运行blastn（不指定-out，结果写到stdout），边输出边解析，返回命中列表"""
+    results = []
+    with timed_stage('blastn'):
+        process = start_tool(cmd, timeout=timeout, cost=cost)
+        for line in process:
+            result = parse_blast_line(line)
+            if result is not None:
+                results.append(result)
+    if process.returncode != 0:
+        raise Exception(f"BLAST执行失败: {process.stderr}")
+    return results
+
+def default_scratch_root():
+    """默认临时目录：/dev/shm（内存文件系统）存在且可写时使用，否则使用系统临时目录"""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+# 比对临时文件（查询FASTA、临时BLAST库、截图用HTML）所在目录
+SCRATCH_ROOT = os.path.join(os.environ.get('LOCALBLAST_SCRATCH_DIR') or default_scratch_root(), 'localblast-scratch')
+# 是否将全库BLAST数据库复制到临时目录中使用（临时目录位于内存文件系统时可减少磁盘读取）
+SCRATCH_REFERENCE = os.environ.get('LOCALBLAST_SCRATCH_REFERENCE', '1') == '1'
+# 超过此时间未修改的临时目录视为残留（无法判断所属进程是否存活时使用）
+SCRATCH_STALE_SECONDS = 24 * 3600
+
+def process_alive(pid):
+    """进程是否仍在运行（Windows上无法安全探测，返回None）"""
+    if os.name == 'nt':
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class ScratchManager:
+    """比对临时目录管理
     
-    for line in lines:
-        if line.startswith('#') or not line.strip():
-            continue
+    每个进程使用 <root>/p<pid>，其中的工作目录放入空闲池循环复用，比对时写入固定文件名，
+    用完清空内容但保留目录，避免每次比对都创建和删除目录。全库BLAST数据库可复制到 <root>/reference 下，
+    所有进程共享。启动时清理已退出进程留下的目录和旧版本参比库副本。
+    """
+    
+    def __init__(self, root):
+        self.root = root
+        self.process_dir = os.path.join(root, f"p{os.getpid()}")
+        self._lock = threading.Lock()
+        self._free = []
+        self._count = 0
+    
+    @contextmanager
+    def directory(self):
+        """借用一个空闲的工作目录，退出时清空内容并归还"""
+        with self._lock:
+            if self._free:
+                path = self._free.pop()
+            else:
+                self._count += 1
+                path = os.path.join(self.process_dir, f"w{self._count}")
+        os.makedirs(path, exist_ok=True)
+        try:
+            yield path
+        finally:
+            for entry in os.scandir(path):
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+            with self._lock:
+                self._free.append(path)
+    
+    def temp_path(self, suffix=''):
+        """进程临时目录下的唯一文件路径（由调用方删除）"""
+        os.makedirs(self.process_dir, exist_ok=True)
+        return os.path.join(self.process_dir, f"{uuid.uuid4().hex}{suffix}")
+    
+    def _owner_alive(self, pid, path, now):
+        """pid对应的进程是否仍在使用path（无法探测进程时按path的修改时间判断）"""
+        if pid == os.getpid():
+            return True
+        alive = process_alive(pid)
+        if alive is None:
+            try:
+                alive = now - os.stat(path).st_mtime <= SCRATCH_STALE_SECONDS
+            except OSError:
+                alive = False
+        return alive
+    
+    def cleanup_stale(self, keep_reference=None):
+        """删除已退出进程的临时目录，以及没有存活进程使用的参比库副本
         
-        # 解析BLAST默认输出格式
-        # qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore
-        parts = line.split('\t')
-        if len(parts) >= 12:
-            result = {
-                'query_id': parts[0],
-                'subject_id': parts[1],
-                'identity': float(parts[2]),
-                'alignment_length': int(parts[3]),
-                'mismatches': int(parts[4]),
-                'gap_opens': int(parts[5]),
-                'query_start': int(parts[6]),
-                'query_end': int(parts[7]),
-                'subject_start': int(parts[8]),
-                'subject_end': int(parts[9]),
-                'evalue': float(parts[10]),
-                'bitscore': float(parts[11])
-            }
-            results.append(result)
+        每个进程在自己的目录中登记正在使用的参比库副本版本（见stage_blast_db），
+        其他进程正在使用或正在复制的副本不会被删除；keep_reference为本进程即将使用的版本。
+        """
+        if not os.path.isdir(self.root):
+            return
+        now = time.time()
+        in_use = {keep_reference}
+        for entry in os.scandir(self.root):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if not (entry.name.startswith('p') and entry.name[1:].isdigit()):
+                continue
+            if self._owner_alive(int(entry.name[1:]), entry.path, now):
+                try:
+                    with open(os.path.join(entry.path, 'reference'), 'r') as f:
+                        in_use.add(f.read().strip())
+                except OSError:
+                    pass
+            else:
+                logger.info(f"清理残留的临时目录: {entry.path}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+        reference_dir = os.path.join(self.root, 'reference')
+        if os.path.isdir(reference_dir):
+            for entry in os.scandir(reference_dir):
+                version, _, pid = entry.name.partition('.tmp')
+                if pid:
+                    # 复制中的副本：只删除复制进程已退出的
+                    stale = pid.isdigit() and not self._owner_alive(int(pid), entry.path, now)
+                else:
+                    stale = version not in in_use
+                if stale:
+                    shutil.rmtree(entry.path, ignore_errors=True)
     
-    return results
+    def remove_process_dir(self):
+        """进程退出时删除本进程的临时目录"""
+        shutil.rmtree(self.process_dir, ignore_errors=True)
+    
+    def stage_blast_db(self, alias_path, version):
+        """将别名数据库及其引用的分片复制到 <root>/reference/<version>，返回副本的别名路径
+        
+        副本先写入临时目录再整体改名，多个进程同时复制时只保留先完成的一份。
+        """
+        target = os.path.join(self.root, 'reference', version)
+        alias_name = os.path.basename(alias_path)
+        # 先登记本进程使用的版本，其他进程清理时保留该副本
+        os.makedirs(self.process_dir, exist_ok=True)
+        with open(os.path.join(self.process_dir, 'reference'), 'w') as f:
+            f.write(version)
+        if os.path.exists(os.path.join(target, f"{alias_name}.nal")):
+            return os.path.join(target, alias_name)
+        
+        source_dir = os.path.dirname(alias_path)
+        with open(f"{alias_path}.nal", 'r') as f:
+            dblist = next((line for line in f if line.startswith('DBLIST')), '')
+        temp_dir = f"{target}.tmp{os.getpid()}"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        try:
+            for db in re.findall(r'"([^"]+)"', dblist):
+                shutil.copytree(os.path.join(source_dir, os.path.dirname(db)),
+                                os.path.join(temp_dir, os.path.dirname(db)))
+            shutil.copyfile(f"{alias_path}.nal", os.path.join(temp_dir, f"{alias_name}.nal"))
+            try:
+                os.rename(temp_dir, target)
+            except OSError:
+                # 其他进程已完成复制
+                if not os.path.isdir(target):
+                    raise
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return os.path.join(target, alias_name)
+
+SCRATCH = ScratchManager(SCRATCH_ROOT)
+atexit.register(SCRATCH.remove_process_dir)
 
-def run_blastn_against_all_species(query_sequence):
-    """使用统一数据库与所有物种比对（优化版本）"""
-    # 创建临时目录
-    temp_dir = tempfile.mkdtemp()
+# 全库比对使用的BLAST数据库缓存目录（按内容哈希分片，参比库更新时只重建变化的分片）
+BLAST_DB_DIR = os.environ.get('LOCALBLAST_BLAST_DB_DIR', os.path.join(BASE_PATH, 'blast_db'))
+_blast_db_lock = threading.Lock()
+_blast_db_state = {'reference_hash': None, 'path': None}
+
+def get_reference_blast_db():
+    """返回与当前参比库一致的缓存BLAST数据库路径（首次使用或参比库更新时增量同步）
     
-    try:
+    无法建立缓存（例如目录不可写）时返回None，由调用方临时建库。
+    """
+    with _blast_db_lock:
+        hit = _blast_db_state['reference_hash'] == REFERENCE_HASH
+        record_cache_access('blast_db', hit)
+        if hit:
+            return _blast_db_state['path']
+        
+        path = None
+        try:
+            with timed_stage('blast_db_sync'):
+                path, built, reused = species_ref.sync_blast_db(
+                    SPECIES_DB, BLAST_DB_DIR,
+                    runner=lambda cmd, **kwargs: run_tool(cmd, 'makeblastdb', **kwargs))
+            logger.info(f"BLAST数据库缓存已同步: {path}（新建 {built} 个分片，复用 {reused} 个）")
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"无法建立BLAST数据库缓存，改为每次临时建库: {str(e)}")
+        if path and SCRATCH_REFERENCE:
+            try:
+                with timed_stage('blast_db_stage'):
+                    path = SCRATCH.stage_blast_db(path, REFERENCE_HASH[:20])
+                logger.info(f"BLAST数据库已复制到临时目录: {path}")
+            except OSError as e:
+                # 内存文件系统空间不足等情况下直接使用磁盘上的数据库
+                logger.warning(f"无法将BLAST数据库复制到临时目录: {str(e)}")
+        _blast_db_state.update(reference_hash=REFERENCE_HASH, path=path)
+        return path
+
+def run_blastn_against_all_species(query_sequence, species_subset=None, strand=None):
+    """使用统一数据库与所有物种比对（优化版本）
+    
+    未指定species_subset时先经过预筛选（默认关闭）：精确子串可直接作答，
+    候选明确时只与前K个候选物种双链比对，候选比对无结果时再回退到全库比对。
+    """
+    if species_subset is None:
+        outcome, candidates, hits, _ = prefilter_query(query_sequence)
+        METRICS.inc('localblast_prefilter_total', outcome=outcome)
+        if outcome == 'exact':
+            return hits
+        if outcome == 'restricted':
+            results = run_blastn_against_all_species(query_sequence, candidates)
+            if results:
+                return results
+            METRICS.inc('localblast_prefilter_total', outcome='fallback')
+        species_subset = SPECIES_DB
+    
+    return blastn_species_db([('Query', query_sequence)], species_subset, strand).get('Query', [])
+
+# 定向确认：从文件名中解析预期的参比序列编号，先只与该参比序列比对，未通过阈值时再全库比对（默认关闭）
+TARGETED_SEARCH = os.environ.get('LOCALBLAST_TARGETED', 'off').lower() == 'on'
+# 从文件名中提取编号的正则（有分组时取第一个分组），如 B0037J_S241220-001-DF01E10.seq -> DF01
+TARGETED_CODE_PATTERN = re.compile(os.environ.get('LOCALBLAST_TARGETED_CODE_PATTERN', r'DF\d+(?:-\d+)?'))
+# 定向比对通过确认的阈值：最佳命中一致性（%）和合并后的查询覆盖度（%）
+TARGETED_MIN_IDENTITY = float(os.environ.get('LOCALBLAST_TARGETED_MIN_IDENTITY', 90))
+TARGETED_MIN_COVER = float(os.environ.get('LOCALBLAST_TARGETED_MIN_COVER', 80))
+
+def targeted_species(filename):
+    """根据文件名中的编号返回预期的参比序列列表，未启用定向确认或无法解析编号时返回None
+    
+    编号与某个参比序列的code完全一致时只取该序列；否则取该编号下的所有亚型（如DF02匹配DF02-1、DF02-2）。
+    """
+    if not TARGETED_SEARCH or not filename:
+        return None
+    match = TARGETED_CODE_PATTERN.search(os.path.basename(filename))
+    if not match:
+        return None
+    code = (match.group(1) if TARGETED_CODE_PATTERN.groups else match.group(0)).upper()
+    species_list = [species for species in SPECIES_DB if (species.get('code') or '').upper() == code]
+    if not species_list:
+        species_list = [species for species in SPECIES_DB
+                        if (species.get('code') or '').upper().startswith(f"{code}-")]
+    return species_list or None
+
+def targeted_hits_confirmed(hits, query_length):
+    """定向比对的最佳命中是否达到确认阈值"""
+    if not hits:
+        return False
+    best = classify_hits(hits, query_length)['best']
+    return (best['best_hit']['identity'] >= TARGETED_MIN_IDENTITY
+            and best['query_cover'] >= TARGETED_MIN_COVER)
+
+def run_blastn_queries(sequences, targets=None):
+    """在一次blastn调用中将多条查询序列与所有物种比对（批量处理使用）
+    
+    给定targets时，有预期参比序列的查询先按预期参比序列分组、只与这些序列比对确认，
+    达到阈值的直接作为结果，未达到的与其余查询一起进入全库比对。
+    全库比对前每条序列先经过预筛选，能精确作答的直接返回，限定候选的按候选集合分组比对；
+    其余序列写入同一个多序列FASTA，与全库只比对一次，避免每条记录都启动一次blastn并重新加载数据库。
+    
+    Args:
+        sequences: 查询序列列表
+        targets: 与sequences对应的预期参比序列列表（targeted_species的结果，None表示无预期）
+    
+    Returns:
+        list: 与sequences一一对应的(命中列表, 比对路径)；比对路径为
+        targeted（定向确认通过）、fallback（定向未通过，已全库比对）或full（全库比对）
+    """
+    results = [None] * len(sequences)
+    search_paths = ['full'] * len(sequences)
+    
+    # 定向确认：同一组预期参比序列的查询合并为一次比对
+    groups = {}
+    for i, target in enumerate(targets or []):
+        if target:
+            groups.setdefault(tuple(species['id'] for species in target), (target, []))[1].append(i)
+    for target, indexes in groups.values():
+        with timed_stage('targeted'):
+            hits_by_query = blastn_species_db([(f"Q{i}", sequences[i]) for i in indexes], target,
+                                              timeout=60 + 2 * len(indexes))
+        for i in indexes:
+            hits = hits_by_query.get(f"Q{i}", [])
+            if targeted_hits_confirmed(hits, len(sequences[i])):
+                METRICS.inc('localblast_targeted_total', outcome='confirmed')
+                results[i] = hits
+                search_paths[i] = 'targeted'
+            else:
+                METRICS.inc('localblast_targeted_total', outcome='fallback')
+                search_paths[i] = 'fallback'
+    
+    queries = []
+    # 预筛选限定候选的查询按候选物种集合分组，每组一次blastn
+    restricted = {}
+    for i, sequence in enumerate(sequences):
+        if results[i] is not None:
+            continue
+        outcome, candidates, hits, _ = prefilter_query(sequence)
+        METRICS.inc('localblast_prefilter_total', outcome=outcome)
+        if outcome == 'exact':
+            results[i] = hits
+        elif outcome == 'restricted':
+            restricted.setdefault(tuple(species['id'] for species in candidates), (candidates, []))[1].append(i)
+        else:
+            queries.append((f"Q{i}", sequence))
+    
+    for candidates, indexes in restricted.values():
+        hits_by_query = blastn_species_db([(f"Q{i}", sequences[i]) for i in indexes], candidates,
+                                          timeout=60 + 2 * len(indexes))
+        for i in indexes:
+            if hits_by_query.get(f"Q{i}"):
+                results[i] = hits_by_query[f"Q{i}"]
+            else:
+                # 候选比对无结果时回退到全库比对
+                METRICS.inc('localblast_prefilter_total', outcome='fallback')
+                queries.append((f"Q{i}", sequences[i]))
+    
+    if queries:
+        # 超时时间随查询条数增长
+        hits_by_query = blastn_species_db(queries, SPECIES_DB, timeout=60 + 2 * len(queries))
+        for query_id, sequence in queries:
+            results[int(query_id[1:])] = hits_by_query.get(query_id, [])
+    return list(zip(results, search_paths))
+
+def blastn_species_db(queries, species_subset, strand=None, timeout=60):
+    """执行一次blastn，将一条或多条查询序列与species_subset中的物种比对
+    
+    Args:
+        queries: [(查询ID, 序列)]，查询ID不能包含空白字符
+        species_subset: 物种列表，为SPECIES_DB时使用缓存的全库BLAST数据库，
+            其他物种列表（预筛选候选、定向确认）直接作为-subject比对，不再临时建库
+        strand: 'plus'/'minus'时只搜索一条链
+        timeout: blastn超时时间（秒）
+    
+    Returns:
+        dict: 查询ID -> 带species_info的命中列表（没有命中的查询不出现）
+    """
+    # 全库比对使用缓存的BLAST数据库
+    db_file = get_reference_blast_db() if species_subset is SPECIES_DB else None
+    subject_file = None
+    
+    # 使用可复用的临时目录（默认位于内存文件系统）
+    with SCRATCH.directory() as temp_dir:
         # 写入查询序列
         query_file = os.path.join(temp_dir, 'query.fasta')
         with open(query_file, 'w') as f:
-            f.write(f">Query\n{query_sequence}\n")
-        
-        # 创建包含所有物种序列的统一FASTA文件
-        # 序列ID格式：species_id|species_name，这样可以从结果中识别物种
-        all_species_file = os.path.join(temp_dir, 'all_species.fasta')
-        with open(all_species_file, 'w') as f:
-            for species in SPECIES_DB:
-                # 序列ID格式：species_id|species_name
-                seq_id = f"{species['id']}|{species['name']}"
-                f.write(f">{seq_id}\n{species['sequence']}\n")
+            for query_id, query_sequence in queries:
+                f.write(f">{query_id}\n{query_sequence}\n")
         
-        # 创建统一的BLAST数据库（只创建一次）
-        db_file = os.path.join(temp_dir, 'all_species_db')
-        subprocess.run(['makeblastdb', '-in', all_species_file, 
-                      '-dbtype', 'nucl', '-out', db_file],
-                     check=True, capture_output=True)
+        if db_file is None:
+            # 写入包含所需物种序列的FASTA文件
+            # 序列ID格式：species_id|species_name，这样可以从结果中识别物种
+            all_species_file = os.path.join(temp_dir, 'all_species.fasta')
+            with open(all_species_file, 'w') as f:
+                for species in species_subset:
+                    f.write(f">{species_ref.blast_subject_id(species)}\n{species['sequence']}\n")
+            
+            if species_subset is SPECIES_DB:
+                # 无法使用缓存数据库时为全库临时建库
+                db_file = os.path.join(temp_dir, 'all_species_db')
+                run_tool(['makeblastdb', '-in', all_species_file,
+                          '-dbtype', 'nucl', '-out', db_file],
+                         'makeblastdb', check=True, capture_output=True)
+            else:
+                # 少量物种直接作为subject比对，省去makeblastdb
+                subject_file = all_species_file
         
-        # 执行blastn比对（只执行一次）
-        output_file = os.path.join(temp_dir, 'blast_output.txt')
+        # 执行blastn比对（只执行一次），结果从stdout流式解析
         cmd = [
             'blastn',
             '-query', query_file,
-            '-db', db_file,
-            '-outfmt', '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore',
-            '-out', output_file,
+            '-outfmt', BLAST_OUTFMT,
             '-max_target_seqs', '100'  # 限制结果数量以提高速度
         ]
+        if subject_file:
+            cmd.extend(['-subject', subject_file])
+        else:
+            cmd.extend(['-db', db_file])
+        if species_subset is not SPECIES_DB and REFERENCE_TOTAL_LENGTH:
+            # 只写入部分物种时按全库大小计算E值，保证结果与全库比对可比
+            cmd.extend(['-dbsize', str(REFERENCE_TOTAL_LENGTH)])
+        if strand:
+            # 方向已知时只搜索一条链
+            cmd.extend(['-strand', strand])
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        
-        if result.returncode != 0:
-            raise Exception(f"BLAST执行失败: {result.stderr}")
-        
-        # 读取结果
-        with open(output_file, 'r') as f:
-            output = f.read()
-        
-        # 解析结果
-        blast_results = parse_blast_output(output)
+        blast_results = stream_blastn(cmd, timeout, cost=sum(len(sequence) for _, sequence in queries))
         
-        # 为每个结果添加物种信息
-        all_results = []
+        # 为每个结果添加物种信息，并按查询序列分组
+        hits_by_query = {}
         for result in blast_results:
             # 从subject_id中解析物种ID和名称
             # 格式：species_id|species_name
@@ -204,27 +1340,20 @@ def run_blastn_against_all_species(query_sequence):
                 species_id_str, species_name = subject_id.split('|', 1)
                 try:
                     species_id = int(species_id_str)
-                    # 查找对应的物种信息
-                    for species in SPECIES_DB:
-                        if species['id'] == species_id:
-                            result['species_info'] = species
-                            all_results.append(result)
-                            break
                 except ValueError:
                     continue
+                # 查找对应的物种信息
+                species = SPECIES_BY_ID.get(species_id)
+                if species is not None:
+                    result['species_info'] = species
+                    hits_by_query.setdefault(result['query_id'], []).append(result)
         
-        return all_results
-    
-    finally:
-        # 清理临时文件
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        return hits_by_query
 
 def run_blastn(query_sequence, subject_sequence, subject_name):
     """执行blastn比对"""
-    # 创建临时目录
-    temp_dir = tempfile.mkdtemp()
-    
-    try:
+    # 使用可复用的临时目录（默认位于内存文件系统）
+    with SCRATCH.directory() as temp_dir:
         # 写入查询序列
         query_file = os.path.join(temp_dir, 'query.fasta')
         with open(query_file, 'w') as f:
@@ -237,42 +1366,183 @@ def run_blastn(query_sequence, subject_sequence, subject_name):
         
         # 创建BLAST数据库
         db_file = os.path.join(temp_dir, 'subject_db')
-        subprocess.run(['makeblastdb', '-in', subject_file, 
-                      '-dbtype', 'nucl', '-out', db_file],
-                     check=True, capture_output=True)
+        run_tool(['makeblastdb', '-in', subject_file,
+                  '-dbtype', 'nucl', '-out', db_file],
+                 'makeblastdb', check=True, capture_output=True)
         
-        # 执行blastn
-        output_file = os.path.join(temp_dir, 'blast_output.txt')
+        # 执行blastn，结果从stdout流式解析
         cmd = [
             'blastn',
             '-query', query_file,
             '-db', db_file,
-            '-outfmt', '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore',
-            '-out', output_file
+            '-outfmt', BLAST_OUTFMT
         ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode != 0:
-            raise Exception(f"BLAST执行失败: {result.stderr}")
-        
-        # 读取结果
-        with open(output_file, 'r') as f:
-            output = f.read()
-        
-        return parse_blast_output(output)
-    
-    finally:
-        # 清理临时文件
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        return stream_blastn(cmd, timeout=30, cost=len(query_sequence))
 
-def generate_html_result(query_sequence, subject_info, blast_results, is_best_match=False):
-    """生成HTML结果页面"""
-    query_length = len(query_sequence)
-    subject_length = subject_info.get('length', 0)
+# 多物种分类：报告得分最高的前N个物种，最高分与次高分的相对差距低于阈值时标记为结果不明确
+CLASSIFY_TOP_N = int(os.environ.get('LOCALBLAST_CLASSIFY_TOP_N', 5))
+AMBIGUOUS_SCORE_GAP = float(os.environ.get('LOCALBLAST_AMBIGUOUS_SCORE_GAP', 0.05))
+
+# 单组区间数达到此值且numpy可用时，使用向量化的区间合并
+# （区间较少时构造数组的开销超过排序本身，纯Python实现更快）
+VECTORIZE_MIN_INTERVALS = 2048
+
+def merged_interval_length(intervals):
+    """返回区间并集的长度（区间为闭区间 (start, end)）"""
+    covered = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end + 1:
+            if current_end is not None:
+                covered += current_end - current_start + 1
+            current_start, current_end = start, end
+        elif end > current_end:
+            current_end = end
+    if current_end is not None:
+        covered += current_end - current_start + 1
+    return covered
+
+def merged_interval_lengths_vectorized(interval_groups):
+    """merged_interval_length的numpy版本，一次计算多组区间的并集长度"""
+    sizes = [len(intervals) for intervals in interval_groups]
+    total = sum(sizes)
+    if not total:
+        return [0] * len(interval_groups)
     
-    # 生成随机7位数Query ID（1-5开头）
-    query_id_first_digit = random.randint(1, 5)
+    groups = np.repeat(np.arange(len(interval_groups), dtype=np.int64), sizes)
+    bounds = np.fromiter((value for intervals in interval_groups for interval in intervals for value in interval),
+                         dtype=np.int64, count=2 * total).reshape(total, 2)
+    order = np.lexsort((bounds[:, 0], groups))
+    groups = groups[order]
+    starts = bounds[order, 0]
+    ends = bounds[order, 1]
+    
+    # 组号作为偏移量，使累计最大值不会跨组传递
+    offset = int(ends.max()) + 2
+    running_end = np.maximum.accumulate(groups * offset + ends) - groups * offset
+    
+    new_segment = np.ones(total, dtype=bool)
+    new_segment[1:] = (groups[1:] != groups[:-1]) | (starts[1:] > running_end[:-1] + 1)
+    segment_starts = np.flatnonzero(new_segment)
+    segment_ends = np.append(segment_starts[1:], total) - 1
+    lengths = running_end[segment_ends] - starts[segment_starts] + 1
+    covered = np.bincount(groups[segment_starts], weights=lengths, minlength=len(interval_groups))
+    return [int(value) for value in covered]
+
+def merged_interval_lengths(interval_groups):
+    """计算多组区间各自的并集长度，单组区间较多时使用向量化实现"""
+    if NUMPY_AVAILABLE and max(map(len, interval_groups), default=0) >= VECTORIZE_MIN_INTERVALS:
+        return merged_interval_lengths_vectorized(interval_groups)
+    return [merged_interval_length(intervals) for intervals in interval_groups]
+
+def aggregate_hsps(blast_hits, key):
+    """单次遍历按key分组汇总HSP：最高分HSP、最高分、总分、HSP数及查询区间"""
+    groups = {}
+    for hit in blast_hits:
+        group_key = key(hit)
+        entry = groups.get(group_key)
+        if entry is None:
+            entry = groups[group_key] = {
+                'species_info': hit.get('species_info'),
+                'best_hit': hit,
+                'max_score': hit['bitscore'],
+                'total_score': 0.0,
+                'hsp_count': 0,
+                'intervals': []
+            }
+        elif hit['bitscore'] > entry['max_score']:
+            entry['best_hit'] = hit
+            entry['max_score'] = hit['bitscore']
+        entry['total_score'] += hit['bitscore']
+        entry['hsp_count'] += 1
+        entry['intervals'].append((min(hit['query_start'], hit['query_end']),
+                                   max(hit['query_start'], hit['query_end'])))
+    return groups
+
+def finalize_hsp_groups(entries, query_length):
+    """计算各组的查询覆盖度（各HSP查询区间并集占查询长度的百分比）"""
+    covered_lengths = merged_interval_lengths([entry.pop('intervals') for entry in entries])
+    for entry, covered in zip(entries, covered_lengths):
+        entry['query_cover'] = (covered / query_length) * 100 if query_length else 0.0
+    return entries
+
+def summarize_subject_hits(blast_hits, query_length):
+    """按参比序列汇总HSP（与NCBI结果表一致：每条参比序列一行），按最高分降序"""
+    entries = sorted(aggregate_hsps(blast_hits, key=lambda hit: hit['subject_id']).values(),
+                     key=lambda entry: (entry['max_score'], entry['total_score']), reverse=True)
+    return finalize_hsp_groups(entries, query_length)
+
+def classify_hits(blast_hits, query_length, top_n=None):
+    """按物种汇总HSP并给出多物种分类结果（对命中结果只遍历一次，无需整体排序）
+    
+    Returns:
+        字典：best（最佳物种）、top（前N个物种，按最高分降序）、species_count、
+        score_gap（最佳与次佳物种最高分之差）、ambiguous（是否结果不明确）。
+        每个物种条目包含species_info、best_hit、max_score、total_score、hsp_count、
+        query_cover（各HSP查询区间并集覆盖度，0-100）和score_gap（与最佳物种的分差）。
+    """
+    top_n = top_n or CLASSIFY_TOP_N
+    species_hits = aggregate_hsps(blast_hits, key=lambda hit: hit['species_info']['id'])
+    top = heapq.nlargest(top_n, species_hits.values(),
+                         key=lambda entry: (entry['max_score'], entry['total_score']))
+    finalize_hsp_groups(top, query_length)
+    for entry in top:
+        entry['score_gap'] = top[0]['max_score'] - entry['max_score']
+    
+    best = top[0] if top else None
+    score_gap = None
+    ambiguous = False
+    if len(top) > 1:
+        score_gap = top[1]['score_gap']
+        ambiguous = score_gap < AMBIGUOUS_SCORE_GAP * best['max_score']
+    
+    return {
+        'best': best,
+        'top': top,
+        'species_count': len(species_hits),
+        'score_gap': score_gap,
+        'ambiguous': ambiguous
+    }
+
+def subject_hsps(hits, subject_id):
+    """同一参比序列的全部HSP"""
+    return [hit for hit in hits if hit['subject_id'] == subject_id]
+
+def classification_payload(classification):
+    """分类结果的JSON表示（用于API响应）"""
+    return {
+        'species_count': classification['species_count'],
+        'score_gap': classification['score_gap'],
+        'ambiguous': classification['ambiguous'],
+        'candidates': [{
+            'species_id': entry['species_info']['id'],
+            'species_name': entry['species_info']['name'],
+            'max_score': entry['max_score'],
+            'total_score': entry['total_score'],
+            'hsp_count': entry['hsp_count'],
+            'query_cover': entry['query_cover'],
+            'identity': entry['best_hit']['identity'],
+            'evalue': entry['best_hit']['evalue'],
+            'strand': entry['best_hit'].get('strand'),
+            'score_gap': entry['score_gap']
+        } for entry in classification['top']]
+    }
+
+def generate_html_result(query_sequence, subject_info, blast_results, is_best_match=False, classification=None):
+    """生成HTML结果页面
+    
+    结果表每条参比序列一行：Max Score为最高分HSP的得分，Total Score为全部HSP得分之和，
+    Query Cover为各HSP查询区间并集的覆盖度。传入classification（classify_hits的结果）时，
+    最佳匹配及其汇总值直接取自分类结果，并在结果表下方列出其他候选物种及得分差。
+    
+    Graphic Summary、Alignments和Dot Plot标签页使用blast_results中的HSP（含blastn输出的qseq/sseq），
+    数据以JSON嵌入页面，打开标签页时才在浏览器中绘制，生成PNG（只截取Descriptions）时不做额外计算。
+    """
+    query_length = len(query_sequence)
+    subject_length = subject_info.get('length', 0)
+    
+    # 生成随机7位数Query ID（1-5开头）
+    query_id_first_digit = random.randint(1, 5)
     query_id_remaining = ''.join([str(random.randint(0, 9)) for _ in range(6)])
     query_id = f"{query_id_first_digit}{query_id_remaining}"
     
@@ -285,22 +1555,28 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
     subject_description = 'None'
     
     # 计算最佳匹配结果
+    if classification and classification['best']:
+        subject_summaries = [classification['best']]
+    else:
+        subject_summaries = summarize_subject_hits(blast_results, query_length)
+    
     best_result = None
-    if blast_results:
-        best_result = max(blast_results, key=lambda x: x['bitscore'])
-        max_score = int(best_result['bitscore'])
-        total_score = max_score
-        query_cover = int((best_result['alignment_length'] / query_length) * 100)
+    if subject_summaries:
+        best_summary = subject_summaries[0]
+        best_result = best_summary['best_hit']
+        total_score = int(best_summary['total_score'])
+        query_cover = int(best_summary['query_cover'])
         evalue = best_result['evalue']
         per_ident = best_result['identity']
         acc_len = subject_length
+        strand = f"Plus/{best_result.get('strand', 'plus').capitalize()}"
     else:
-        max_score = 0
         total_score = 0
         query_cover = 0
         evalue = 1.0
         per_ident = 0.0
         acc_len = subject_length
+        strand = 'N/A'
     
     # 格式化E值
     if evalue < 0.001:
@@ -590,6 +1866,47 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
       color: #004a99;
       font-weight: bold;
     }}
+    .classification {{
+      margin-top: 16px;
+    }}
+    .classification-table {{
+      width: 100%;
+      border-collapse: collapse;
+    }}
+    .classification-table th,
+    .classification-table td {{
+      padding: 4px 6px;
+      border-bottom: 1px solid #e4e4e4;
+      text-align: left;
+    }}
+    .classification-note {{
+      margin: 6px 0;
+      color: #555;
+    }}
+    .classification-note.ambiguous {{
+      color: #c53030;
+      font-weight: bold;
+    }}
+    .report-panel {{
+      border: 1px solid #3a7ba5;
+      border-top: 3px solid #0272BD;
+      padding: 10px;
+      overflow-x: auto;
+    }}
+    .report-panel pre {{
+      font-family: "Courier New", Courier, monospace;
+      font-size: 12px;
+      margin: 0 0 18px;
+    }}
+    .report-panel .hsp-title {{
+      font-weight: bold;
+      margin-top: 8px;
+    }}
+    .report-panel .empty {{
+      color: #666;
+      text-align: center;
+      padding: 20px;
+    }}
   </style>
 </head>
 <body>
@@ -615,6 +1932,10 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
       <td class="label">Subject Length</td>
       <td class="value">{subject_length}</td>
     </tr>
+    <tr>
+      <td class="label">Strand</td>
+      <td class="value">{strand}</td>
+    </tr>
     <tr>
       <td class="label">Other reports</td>
       <td class="value">
@@ -627,13 +1948,13 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
   </table>
 
   <div class="tabs">
-    <div class="tab active">Descriptions</div>
-    <div class="tab">Graphic Summary</div>
-    <div class="tab">Alignments</div>
-    <div class="tab">Dot Plot</div>
+    <div class="tab active" data-tab="descriptions">Descriptions</div>
+    <div class="tab" data-tab="graphic">Graphic Summary</div>
+    <div class="tab" data-tab="alignments">Alignments</div>
+    <div class="tab" data-tab="dotplot">Dot Plot</div>
   </div>
 
-  <div class="main-panel">
+  <div class="main-panel" data-panel="descriptions">
     <div class="section-header">
       <div class="section-header-left">
         Sequences producing significant alignments
@@ -657,7 +1978,7 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
       <div>
         <input type="checkbox" checked>
         <span>select all</span>
-        <span class="count">{len(blast_results)} sequences selected</span>
+        <span class="count">{len(subject_summaries)} sequences selected</span>
       </div>
       <div class="select-all-row-right">
         <a href="#">Graphics</a>
@@ -684,9 +2005,10 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
         <tbody>
 """
     
-    if blast_results:
-        for result in blast_results:
-            query_cover = int((result['alignment_length'] / query_length) * 100)
+    if subject_summaries:
+        for summary in subject_summaries:
+            result = summary['best_hit']
+            query_cover = int(summary['query_cover'])
             evalue = result['evalue']
             if evalue < 0.001:
                 evalue_str = f"{evalue:.2e}"
@@ -700,8 +2022,8 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
             <a href="#" class="link-blue">None provided</a>
           </td>
           <td class="col-scientific"></td>
-          <td class="col-small">{int(result['bitscore'])}</td>
-          <td class="col-small">{int(result['bitscore'])}</td>
+          <td class="col-small">{int(summary['max_score'])}</td>
+          <td class="col-small">{int(summary['total_score'])}</td>
           <td class="col-small">{query_cover}%</td>
           <td class="col-evalue">{evalue_str}</td>
           <td class="col-small value-highlight">{result['identity']:.2f}%</td>
@@ -723,13 +2045,257 @@ def generate_html_result(query_sequence, subject_info, blast_results, is_best_ma
       </table>
     </div>
   </div>
+"""
+    
+    if classification and len(classification['top']) > 1:
+        html_template += generate_classification_html(classification)
+    
+    html_template += f"""
+  <div class="report-panel" data-panel="graphic" id="panel-graphic" style="display: none"></div>
+  <div class="report-panel" data-panel="alignments" id="panel-alignments" style="display: none"></div>
+  <div class="report-panel" data-panel="dotplot" id="panel-dotplot" style="display: none"></div>
 </div>
+<script type="application/json" id="alignment-data">{alignment_report_data(blast_results, query_length, subject_length)}</script>
+{REPORT_TABS_SCRIPT}
 </body>
 </html>
 """
     
     return html_template
 
+# 结果页面Graphic Summary/Alignments/Dot Plot标签页最多嵌入的HSP数（按得分排序），控制页面大小
+REPORT_MAX_HSPS = int(os.environ.get('LOCALBLAST_REPORT_MAX_HSPS', 50))
+
+def alignment_report_data(blast_results, query_length, subject_length):
+    """结果页面标签页使用的HSP数据（JSON字符串，可直接嵌入<script>）"""
+    hsps = sorted(blast_results or [], key=lambda hit: hit['bitscore'], reverse=True)[:REPORT_MAX_HSPS]
+    data = {
+        'query_length': query_length,
+        'subject_length': subject_length,
+        'hsps': [{
+            'subject': hit.get('species_info', {}).get('name') or hit['subject_id'],
+            'bitscore': hit['bitscore'],
+            'evalue': hit['evalue'],
+            'identity': hit['identity'],
+            'length': hit['alignment_length'],
+            'query_start': hit['query_start'],
+            'query_end': hit['query_end'],
+            'subject_start': hit['subject_start'],
+            'subject_end': hit['subject_end'],
+            'strand': hit.get('strand', 'plus'),
+            'query_seq': hit.get('query_seq'),
+            'subject_seq': hit.get('subject_seq'),
+        } for hit in hsps]
+    }
+    # 避免序列名称中的"</"提前结束<script>标签
+    return json.dumps(data, ensure_ascii=False).replace('</', '<\\/')
+
+# 结果页面标签页切换及按需绘制（首次打开标签页时才根据嵌入的HSP数据生成内容）
+REPORT_TABS_SCRIPT = """<script>
+(function () {
+  var dataNode = document.getElementById('alignment-data');
+  var data = dataNode ? JSON.parse(dataNode.textContent) : {query_length: 0, subject_length: 0, hsps: []};
+  var SVG_NS = 'http://www.w3.org/2000/svg';
+  var LINE_WIDTH = 60;
+  var rendered = {};
+
+  function el(tag, attrs, parent, text) {
+    var node = tag.indexOf('svg:') === 0 ? document.createElementNS(SVG_NS, tag.slice(4)) : document.createElement(tag);
+    for (var name in attrs || {}) node.setAttribute(name, attrs[name]);
+    if (text !== undefined) node.textContent = text;
+    if (parent) parent.appendChild(node);
+    return node;
+  }
+
+  function scoreColor(score) {
+    if (score < 40) return '#000000';
+    if (score < 50) return '#0047c8';
+    if (score < 80) return '#77de75';
+    if (score < 200) return '#e967f5';
+    return '#e83a2d';
+  }
+
+  function formatEvalue(evalue) {
+    return evalue < 0.001 ? evalue.toExponential(2) : evalue.toFixed(2);
+  }
+
+  function strandLabel(hsp) {
+    return 'Plus/' + (hsp.strand === 'minus' ? 'Minus' : 'Plus');
+  }
+
+  function renderGraphic(panel) {
+    var width = 800, left = 60, right = 20, barHeight = 8, rowHeight = 14, top = 50;
+    var scale = (width - left - right) / Math.max(data.query_length, 1);
+    var svg = el('svg:svg', {width: width, height: top + data.hsps.length * rowHeight + 40}, panel);
+    el('svg:text', {x: left, y: 14, 'font-size': 12}, svg, 'Distribution of the top ' + data.hsps.length + ' hits on the query sequence');
+    var legend = [['<40', 0], ['40-50', 40], ['50-80', 50], ['80-200', 80], ['>=200', 200]];
+    legend.forEach(function (item, i) {
+      el('svg:rect', {x: left + i * 120, y: 22, width: 110, height: 10, fill: scoreColor(item[1])}, svg);
+      el('svg:text', {x: left + i * 120 + 55, y: 42, 'font-size': 10, 'text-anchor': 'middle'}, svg, item[0]);
+    });
+    el('svg:line', {x1: left, x2: left + data.query_length * scale, y1: top, y2: top, stroke: '#333'}, svg);
+    var step = Math.max(1, Math.pow(10, Math.floor(Math.log10(Math.max(data.query_length, 1)))) / 2);
+    for (var pos = 0; pos <= data.query_length; pos += step) {
+      el('svg:line', {x1: left + pos * scale, x2: left + pos * scale, y1: top - 4, y2: top, stroke: '#333'}, svg);
+    }
+    el('svg:text', {x: left - 6, y: top + 4, 'font-size': 10, 'text-anchor': 'end'}, svg, 'Query');
+    data.hsps.forEach(function (hsp, i) {
+      var start = Math.min(hsp.query_start, hsp.query_end), end = Math.max(hsp.query_start, hsp.query_end);
+      var bar = el('svg:rect', {
+        x: left + (start - 1) * scale, y: top + 8 + i * rowHeight,
+        width: Math.max(1, (end - start + 1) * scale), height: barHeight, fill: scoreColor(hsp.bitscore)
+      }, svg);
+      el('svg:title', {}, bar, hsp.subject + ' ' + start + '-' + end + ' score ' + hsp.bitscore);
+    });
+  }
+
+  function countResidues(segment) {
+    return segment.replace(/-/g, '').length;
+  }
+
+  function alignmentText(hsp) {
+    var qseq = hsp.query_seq, sseq = hsp.subject_seq;
+    var identities = 0, gaps = 0;
+    for (var i = 0; i < qseq.length; i++) {
+      if (qseq[i] === '-' || sseq[i] === '-') gaps++;
+      else if (qseq[i] === sseq[i]) identities++;
+    }
+    var lines = [
+      'Score = ' + hsp.bitscore + ' bits,  Expect = ' + formatEvalue(hsp.evalue),
+      'Identities = ' + identities + '/' + qseq.length + ' (' + Math.round(identities * 100 / qseq.length) + '%),  Gaps = '
+        + gaps + '/' + qseq.length + ' (' + Math.round(gaps * 100 / qseq.length) + '%)',
+      'Strand = ' + strandLabel(hsp),
+      ''
+    ];
+    var width = String(Math.max(hsp.query_end, hsp.subject_start, hsp.subject_end)).length;
+    var pad = function (value) { value = String(value); while (value.length < width) value += ' '; return value; };
+    var blank = new Array(width + 9).join(' ');
+    var step = hsp.subject_end >= hsp.subject_start ? 1 : -1;
+    var queryPos = hsp.query_start, subjectPos = hsp.subject_start;
+    for (var offset = 0; offset < qseq.length; offset += LINE_WIDTH) {
+      var q = qseq.substr(offset, LINE_WIDTH), s = sseq.substr(offset, LINE_WIDTH), mid = '';
+      for (var j = 0; j < q.length; j++) mid += (q[j] === s[j] && q[j] !== '-') ? '|' : ' ';
+      var queryEnd = queryPos + countResidues(q) - 1;
+      var subjectEnd = subjectPos + step * (countResidues(s) - 1);
+      lines.push('Query  ' + pad(queryPos) + ' ' + q + '  ' + queryEnd);
+      lines.push(blank + mid);
+      lines.push('Sbjct  ' + pad(subjectPos) + ' ' + s + '  ' + subjectEnd);
+      lines.push('');
+      queryPos = queryEnd + 1;
+      subjectPos = subjectEnd + step;
+    }
+    return lines.join('\\n');
+  }
+
+  function renderAlignments(panel) {
+    data.hsps.forEach(function (hsp, i) {
+      el('div', {'class': 'hsp-title'}, panel, (i + 1) + '. ' + hsp.subject
+        + '  (Query ' + hsp.query_start + '-' + hsp.query_end + ', Sbjct ' + hsp.subject_start + '-' + hsp.subject_end + ')');
+      if (hsp.query_seq && hsp.subject_seq) {
+        el('pre', {}, panel, alignmentText(hsp));
+      } else {
+        el('pre', {}, panel, 'Score = ' + hsp.bitscore + ' bits,  Expect = ' + formatEvalue(hsp.evalue)
+          + '\\nIdentities = ' + hsp.identity.toFixed(2) + '%,  Strand = ' + strandLabel(hsp));
+      }
+    });
+  }
+
+  function renderDotPlot(panel) {
+    var size = 400, margin = 50;
+    var subjectLength = data.subject_length || 1;
+    data.hsps.forEach(function (hsp) {
+      subjectLength = Math.max(subjectLength, hsp.subject_start, hsp.subject_end);
+    });
+    var xScale = size / Math.max(data.query_length, 1), yScale = size / subjectLength;
+    var svg = el('svg:svg', {width: size + margin * 2, height: size + margin * 2}, panel);
+    el('svg:rect', {x: margin, y: margin, width: size, height: size, fill: 'none', stroke: '#333'}, svg);
+    el('svg:text', {x: margin + size / 2, y: margin + size + 30, 'font-size': 12, 'text-anchor': 'middle'}, svg,
+       'Query (1-' + data.query_length + ')');
+    el('svg:text', {x: 14, y: margin + size / 2, 'font-size': 12, 'text-anchor': 'middle',
+       transform: 'rotate(-90 14 ' + (margin + size / 2) + ')'}, svg, 'Subject (1-' + subjectLength + ')');
+    data.hsps.forEach(function (hsp) {
+      var line = el('svg:line', {
+        x1: margin + (hsp.query_start - 1) * xScale, y1: margin + (hsp.subject_start - 1) * yScale,
+        x2: margin + hsp.query_end * xScale, y2: margin + hsp.subject_end * yScale,
+        stroke: scoreColor(hsp.bitscore), 'stroke-width': 2
+      }, svg);
+      el('svg:title', {}, line, hsp.subject + ' ' + strandLabel(hsp) + ' score ' + hsp.bitscore);
+    });
+  }
+
+  var renderers = {graphic: renderGraphic, alignments: renderAlignments, dotplot: renderDotPlot};
+  var tabs = document.querySelectorAll('.tabs .tab');
+
+  function showTab(name) {
+    Array.prototype.forEach.call(tabs, function (tab) {
+      tab.classList.toggle('active', tab.getAttribute('data-tab') === name);
+    });
+    Array.prototype.forEach.call(document.querySelectorAll('[data-panel]'), function (panel) {
+      panel.style.display = panel.getAttribute('data-panel') === name ? '' : 'none';
+    });
+    if (renderers[name] && !rendered[name]) {
+      rendered[name] = true;
+      var panel = document.getElementById('panel-' + name);
+      if (data.hsps.length) renderers[name](panel);
+      else el('div', {'class': 'empty'}, panel, 'No significant alignments found.');
+    }
+  }
+
+  Array.prototype.forEach.call(tabs, function (tab) {
+    tab.addEventListener('click', function () { showTab(tab.getAttribute('data-tab')); });
+  });
+})();
+</script>"""
+
+def generate_classification_html(classification):
+    """生成候选物种列表（多物种分类结果）的HTML片段"""
+    if classification['ambiguous']:
+        note = '<div class="classification-note ambiguous">最佳与次佳候选得分接近，结果不明确，请人工复核</div>'
+    else:
+        note = f'<div class="classification-note">共 {classification["species_count"]} 个物种有显著比对</div>'
+    
+    rows = []
+    for rank, entry in enumerate(classification['top'], 1):
+        species = entry['species_info']
+        rows.append(f"""
+        <tr>
+          <td>{rank}</td>
+          <td>{html_escape(species.get('name', ''))}</td>
+          <td>{html_escape(species.get('code', ''))}</td>
+          <td>{int(entry['max_score'])}</td>
+          <td>{int(entry['total_score'])}</td>
+          <td>{int(entry['query_cover'])}%</td>
+          <td>{entry['best_hit']['identity']:.2f}%</td>
+          <td>{entry['best_hit'].get('strand', 'plus').capitalize()}</td>
+          <td>{int(entry['score_gap'])}</td>
+        </tr>""")
+    
+    return f"""
+  <div class="classification" data-panel="descriptions">
+    <div class="section-header">
+      <div class="section-header-left">Candidate species</div>
+    </div>
+    {note}
+    <table class="classification-table">
+      <thead>
+      <tr>
+        <th>#</th>
+        <th>Species</th>
+        <th>Code</th>
+        <th>Max Score</th>
+        <th>Total Score</th>
+        <th>Query Cover</th>
+        <th>Per. Ident</th>
+        <th>Strand</th>
+        <th>Score Gap</th>
+      </tr>
+      </thead>
+      <tbody>{''.join(rows)}
+      </tbody>
+    </table>
+  </div>
+"""
+
 def parse_seq_file(file_content):
     """解析.seq文件内容，返回序列字符串"""
     # 移除所有空白字符和换行，只保留序列字符
@@ -758,6 +2324,35 @@ def parse_seq_file(file_content):
     sequence = re.sub(r'[^ATCG]', '', sequence.upper())
     return sequence
 
+def parse_seq_records(file_content):
+    """解析.seq/FASTA文件中的所有记录
+    
+    以'>'开头的行作为记录标题，标题第一个词作为记录ID；没有标题行时整个文件作为一条记录，记录ID为None。
+    
+    Returns:
+        list: [(记录ID, 序列字符串)]，按文件中的顺序
+    """
+    records = []
+    record_id = None
+    chunk = []
+    for line in file_content.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('>'):
+            if record_id is not None or any(l.strip() for l in chunk):
+                records.append((record_id, parse_seq_file('\n'.join(chunk))))
+            words = stripped[1:].split()
+            record_id = words[0] if words else str(len(records) + 1)
+            chunk = []
+        else:
+            chunk.append(line)
+    if record_id is not None or any(l.strip() for l in chunk):
+        records.append((record_id, parse_seq_file('\n'.join(chunk))))
+    
+    # 只有一条记录时不区分记录ID，输出文件名与单序列文件保持一致
+    if len(records) == 1:
+        records = [(None, records[0][1])]
+    return records
+
 # 全局变量：缓存ChromeDriver实例（用于批量处理时复用）
 _cached_driver = None
 _cached_driver_path = None
@@ -768,7 +2363,9 @@ def get_chromedriver_path():
     
     # 如果已经缓存，直接返回
     if _cached_driver_path and os.path.exists(_cached_driver_path):
+        record_cache_access('chromedriver_path', True)
         return _cached_driver_path
+    record_cache_access('chromedriver_path', False)
     
     driver_path = None
     
@@ -789,7 +2386,7 @@ def get_chromedriver_path():
     for local_path in local_driver_paths:
         if os.path.exists(local_path) and os.path.isfile(local_path):
             driver_path = local_path
-            print(f"使用本地ChromeDriver: {driver_path}")
+            logger.info(f"使用本地ChromeDriver: {driver_path}")
             break
     
     # 如果程序目录没有，查找~/.wdm目录中的缓存（优先于网络下载）
@@ -807,12 +2404,12 @@ def get_chromedriver_path():
             if chromedrivers:
                 chromedrivers.sort(key=os.path.getmtime, reverse=True)
                 driver_path = chromedrivers[0]
-                print(f"使用本地缓存的ChromeDriver: {driver_path}")
+                logger.info(f"使用本地缓存的ChromeDriver: {driver_path}")
     
     # 如果本地和缓存都没有，才尝试从网络下载（带超时）
     if not driver_path:
         try:
-            print("本地未找到ChromeDriver，尝试从网络下载（最多等待10秒）...")
+            logger.info("本地未找到ChromeDriver，尝试从网络下载（最多等待10秒）...")
             
             # Windows不支持signal，使用threading实现超时
             if sys.platform == 'win32':
@@ -837,7 +2434,7 @@ def get_chromedriver_path():
                     raise download_result['error']
                 
                 driver_path = download_result['driver_path']
-                print(f"从网络下载ChromeDriver: {driver_path}")
+                logger.info(f"从网络下载ChromeDriver: {driver_path}")
             else:
                 # macOS/Linux使用signal实现超时
                 import signal
@@ -850,12 +2447,12 @@ def get_chromedriver_path():
                 
                 try:
                     driver_path = ChromeDriverManager().install()
-                    print(f"从网络下载ChromeDriver: {driver_path}")
+                    logger.info(f"从网络下载ChromeDriver: {driver_path}")
                 finally:
                     signal.alarm(0)  # 取消超时
                     
         except (ConnectionError, TimeoutError, Exception) as e:
-            print(f"网络下载失败或超时: {str(e)}")
+            logger.warning(f"网络下载失败或超时: {str(e)}")
             raise Exception("无法获取ChromeDriver：本地未找到且网络下载失败")
     
     # 修复webdriver-manager的bug：如果返回的是THIRD_PARTY_NOTICES文件，查找实际的chromedriver
@@ -911,12 +2508,14 @@ def get_chromedriver_instance():
         try:
             # 测试driver是否仍然可用
             _cached_driver.current_url
+            record_cache_access('chromedriver_instance', True)
             return _cached_driver
         except:
             # driver已失效，重置
             _cached_driver = None
     
     # 创建新的driver实例
+    record_cache_access('chromedriver_instance', False)
     try:
         driver_path = get_chromedriver_path()
         
@@ -931,12 +2530,12 @@ def get_chromedriver_instance():
         chrome_options.add_argument('--disable-software-rasterizer')
         
         service = Service(driver_path)
-        _cached_driver = webdriver.Chrome(service=service, options=chrome_options)
-        print("ChromeDriver已启动（将复用此实例）")
+        with timed_stage('chromedriver_start'):
+            _cached_driver = webdriver.Chrome(service=service, options=chrome_options)
+        logger.info("ChromeDriver已启动（将复用此实例）")
         return _cached_driver
     except Exception as e:
-        print(f"无法启动Chrome WebDriver: {str(e)}")
-        print("提示: PNG生成功能将不可用，但HTML文件仍会正常生成")
+        logger.warning(f"无法启动Chrome WebDriver: {str(e)}，PNG生成功能将不可用，但HTML文件仍会正常生成")
         return None
 
 def close_chromedriver():
@@ -959,18 +2558,18 @@ def html_to_image(html_content, output_path, driver=None):
     """
     # 检查依赖是否可用
     if not SELENIUM_AVAILABLE:
-        print("selenium未安装，跳过PNG生成")
+        logger.debug("selenium未安装，跳过PNG生成")
         return None
     if not PIL_AVAILABLE:
-        print("Pillow未安装，跳过PNG生成")
+        logger.debug("Pillow未安装，跳过PNG生成")
         return None
     
     temp_html = None
     use_external_driver = driver is not None
     
     try:
-        # 创建临时HTML文件
-        temp_html = output_path.replace('.png', '_temp.html')
+        # 创建临时HTML文件（放在临时目录中，不写入结果目录）
+        temp_html = SCRATCH.temp_path('.html')
         with open(temp_html, 'w', encoding='utf-8') as f:
             f.write(html_content)
         
@@ -981,60 +2580,64 @@ def html_to_image(html_content, output_path, driver=None):
                 return None
         
         try:
-            # 加载HTML文件
-            file_url = f"file://{os.path.abspath(temp_html)}"
-            driver.get(file_url)
-            
-            # 使用显式等待替代固定sleep（最多等待2秒）
-            try:
-                from selenium.webdriver.support.ui import WebDriverWait
-                from selenium.webdriver.support import expected_conditions as EC
-                WebDriverWait(driver, 2).until(
-                    EC.presence_of_element_located((By.TAG_NAME, "body"))
-                )
-            except:
-                # 如果显式等待失败，使用固定等待
-                time.sleep(0.5)
-            
-            # 获取页面元素（blast-container）
-            try:
-                element = driver.find_element(By.CLASS_NAME, "blast-container")
-            except:
-                # 如果找不到blast-container，使用body
-                element = driver.find_element(By.TAG_NAME, "body")
-            
-            # 截图
-            screenshot = element.screenshot_as_png
-            
-            # 使用PIL处理图片，裁剪空白部分
-            img = Image.open(io.BytesIO(screenshot))
+            with timed_stage('chrome_load'):
+                # 加载HTML文件
+                file_url = f"file://{os.path.abspath(temp_html)}"
+                driver.get(file_url)
+                
+                # 使用显式等待替代固定sleep（最多等待2秒）
+                try:
+                    from selenium.webdriver.support.ui import WebDriverWait
+                    from selenium.webdriver.support import expected_conditions as EC
+                    WebDriverWait(driver, 2).until(
+                        EC.presence_of_element_located((By.TAG_NAME, "body"))
+                    )
+                except:
+                    # 如果显式等待失败，使用固定等待
+                    time.sleep(0.5)
             
-            # 转换为RGB（如果是RGBA）
-            if img.mode == 'RGBA':
-                # 创建白色背景
-                rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                rgb_img.paste(img, mask=img.split()[3] if len(img.split()) == 4 else None)
-                img = rgb_img
+            with timed_stage('screenshot'):
+                # 获取页面元素（blast-container）
+                try:
+                    element = driver.find_element(By.CLASS_NAME, "blast-container")
+                except:
+                    # 如果找不到blast-container，使用body
+                    element = driver.find_element(By.TAG_NAME, "body")
+                
+                # 截图
+                screenshot = element.screenshot_as_png
             
-            # 裁剪空白部分
-            # 获取图片的边界框（去除白色边缘）
-            bbox = img.getbbox()
-            if bbox:
-                # 添加一些边距（10像素）
-                left, top, right, bottom = bbox
-                margin = 10
-                left = max(0, left - margin)
-                top = max(0, top - margin)
-                right = min(img.width, right + margin)
-                bottom = min(img.height, bottom + margin)
+            with timed_stage('pil_crop'):
+                # 使用PIL处理图片，裁剪空白部分
+                img = Image.open(io.BytesIO(screenshot))
                 
-                # 裁剪图片
-                cropped_img = img.crop((left, top, right, bottom))
-            else:
-                cropped_img = img
+                # 转换为RGB（如果是RGBA）
+                if img.mode == 'RGBA':
+                    # 创建白色背景
+                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+                    rgb_img.paste(img, mask=img.split()[3] if len(img.split()) == 4 else None)
+                    img = rgb_img
+                
+                # 裁剪空白部分
+                # 获取图片的边界框（去除白色边缘）
+                bbox = img.getbbox()
+                if bbox:
+                    # 添加一些边距（10像素）
+                    left, top, right, bottom = bbox
+                    margin = 10
+                    left = max(0, left - margin)
+                    top = max(0, top - margin)
+                    right = min(img.width, right + margin)
+                    bottom = min(img.height, bottom + margin)
+                
+                    # 裁剪图片
+                    cropped_img = img.crop((left, top, right, bottom))
+                else:
+                    cropped_img = img
             
-            # 保存PNG文件
-            cropped_img.save(output_path, 'PNG', optimize=True)
+            with timed_stage('png_save'):
+                # 保存PNG文件
+                cropped_img.save(output_path, 'PNG', optimize=True)
             
             return output_path
             
@@ -1044,9 +2647,7 @@ def html_to_image(html_content, output_path, driver=None):
                 close_chromedriver()
                 
     except Exception as e:
-        print(f"HTML转PNG失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"HTML转PNG失败: {str(e)}")
         # 如果转换失败，返回None，但不影响主流程
         return None
     finally:
@@ -1060,7 +2661,7 @@ def html_to_image(html_content, output_path, driver=None):
 @app.route('/')
 def index():
     """主页面"""
-    return render_template('blast_input.html', species_list=SPECIES_DB)
+    return render_template('blast_input.html', species_list=SPECIES_METADATA)
 
 @app.route('/batch')
 def batch_page():
@@ -1072,12 +2673,149 @@ def user_manual():
     """用户手册页面"""
     return render_template('user_manual.html')
 
+# /api/species分页大小
+SPECIES_PAGE_SIZE = 100
+SPECIES_MAX_PAGE_SIZE = 1000
+
+def conditional_json(etag, build_payload):
+    """带强ETag的JSON响应；客户端缓存的版本未变化时返回304，不再生成响应体"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    # 允许缓存，但每次使用前需向服务器确认版本
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/species', methods=['GET'])
 def get_species():
-    """获取所有物种列表"""
-    return jsonify(SPECIES_DB)
+    """获取物种列表（仅元数据，不含序列）
+    
+    查询参数：q（按名称或编号搜索，不区分大小写）、page（从1开始）、page_size
+    """
+    keyword = request.args.get('q', '').strip().lower()
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', SPECIES_PAGE_SIZE)), 1), SPECIES_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'page和page_size必须为整数'}), 400
+    
+    def build_payload():
+        if keyword:
+            matches = [species for species in SPECIES_METADATA
+                       if keyword in species['name'].lower() or keyword in str(species['code']).lower()]
+        else:
+            matches = SPECIES_METADATA
+        start = (page - 1) * page_size
+        return {
+            'reference_hash': REFERENCE_HASH,
+            'total': len(matches),
+            'page': page,
+            'page_size': page_size,
+            'species': matches[start:start + page_size]
+        }
+    
+    # 列表内容只取决于参比库版本和查询参数（已包含在URL中）
+    return conditional_json(REFERENCE_HASH, build_payload)
+
+@app.route('/api/species/<int:species_id>', methods=['GET'])
+def get_species_sequence(species_id):
+    """获取单个物种的元数据和参比序列"""
+    species = SPECIES_BY_ID.get(species_id)
+    if species is None:
+        return jsonify({'error': '未找到指定的物种'}), 404
+    
+    return conditional_json(f"{REFERENCE_HASH}-{species_id}",
+                            lambda: dict(species_metadata(species), sequence=species['sequence']))
+
+# 同时处理中的交互式比对请求上限（包括等待进程名额的请求），超出时返回429
+INTERACTIVE_QUEUE_LIMIT = int(os.environ.get('LOCALBLAST_INTERACTIVE_QUEUE', MAX_TOOL_PROCESSES * 4))
+# 单个客户端同时处理中的交互式比对请求上限
+CLIENT_INTERACTIVE_LIMIT = int(os.environ.get('LOCALBLAST_CLIENT_MAX_INTERACTIVE', 4))
+# 同时运行的Web批次上限
+BATCH_QUEUE_LIMIT = int(os.environ.get('LOCALBLAST_MAX_RUNNING_BATCHES', 2))
+# 单个客户端同时运行的批次上限
+CLIENT_BATCH_LIMIT = int(os.environ.get('LOCALBLAST_CLIENT_MAX_BATCHES', 1))
+
+class AdmissionRejected(Exception):
+    """请求超出并发上限，应稍后重试"""
+    
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    """按总数和客户端限制同时处理中的请求数
+    
+    Retry-After根据最近完成请求的平均耗时估计。
+    """
+    
+    def __init__(self, name, max_active, max_per_client, initial_seconds):
+        self.name = name
+        self.max_active = max_active
+        self.max_per_client = max_per_client
+        self.average_seconds = initial_seconds
+        self._lock = threading.Lock()
+        self._active = 0
+        self._clients = {}
+    
+    def retry_after(self):
+        return max(1, min(3600, math.ceil(self.average_seconds)))
+    
+    @contextmanager
+    def admit(self, client):
+        with self._lock:
+            if self._clients.get(client, 0) >= self.max_per_client:
+                reason, message = 'client', '同时进行的任务过多，请等待已提交的任务完成后重试'
+            elif self._active >= self.max_active:
+                reason, message = 'full', '服务器繁忙，请稍后重试'
+            else:
+                reason = None
+                self._active += 1
+                self._clients[client] = self._clients.get(client, 0) + 1
+        if reason:
+            METRICS.inc('localblast_admission_rejected_total', queue=self.name, reason=reason)
+            raise AdmissionRejected(message, self.retry_after())
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._active -= 1
+                self._clients[client] -= 1
+                if not self._clients[client]:
+                    del self._clients[client]
+                self.average_seconds = 0.8 * self.average_seconds + 0.2 * elapsed
+
+INTERACTIVE_GATE = AdmissionGate('interactive', INTERACTIVE_QUEUE_LIMIT, CLIENT_INTERACTIVE_LIMIT, 2)
+BATCH_GATE = AdmissionGate('batch', BATCH_QUEUE_LIMIT, CLIENT_BATCH_LIMIT, 60)
+
+def client_id():
+    """请求方标识（用于单客户端并发上限）"""
+    return request.remote_addr or 'unknown'
+
+def admitted(gate):
+    """视图装饰器：请求须先通过gate的并发限制"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with gate.admit(client_id()):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.errorhandler(AdmissionRejected)
+def handle_admission_rejected(e):
+    """超出并发上限：返回429，Retry-After给出建议的重试等待秒数"""
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
 @app.route('/api/blast', methods=['POST'])
+@admitted(INTERACTIVE_GATE)
 def run_blast():
     """执行BLAST比对"""
     data = request.json
@@ -1094,11 +2832,7 @@ def run_blast():
     try:
         if species_id:
             # 单个物种比对
-            subject_info = None
-            for species in SPECIES_DB:
-                if species['id'] == species_id:
-                    subject_info = species
-                    break
+            subject_info = SPECIES_BY_ID.get(species_id)
             
             if not subject_info:
                 return jsonify({'error': '未找到指定的物种'}), 404
@@ -1111,13 +2845,14 @@ def run_blast():
             )
             
             # 生成HTML结果
-            html_result = generate_html_result(query_sequence, subject_info, blast_results)
+            with timed_stage('html'):
+                html_result = generate_html_result(query_sequence, subject_info, blast_results)
             
-            return jsonify({
+            return jsonify(with_timings({
                 'success': True,
                 'html': html_result,
                 'results_count': len(blast_results)
-            })
+            }))
         else:
             # 与所有物种比对，使用统一数据库（优化版本）
             try:
@@ -1127,18 +2862,21 @@ def run_blast():
                 if not all_results:
                     return jsonify({'error': '未找到任何匹配结果'}), 404
                 
-                # 按bitscore排序，选择得分最高的
-                all_results.sort(key=lambda x: x['bitscore'], reverse=True)
-                best_result = all_results[0]
+                # 按物种汇总，得分最高的物种作为最佳匹配，其余作为候选列出
+                with timed_stage('classify'):
+                    classification = classify_hits(all_results, len(query_sequence))
+                best_result = classification['best']['best_hit']
                 best_species = best_result['species_info']
                 
-                # 只返回最佳匹配结果
-                best_blast_results = [best_result]
+                # 结果表只列出最佳匹配，Alignments等标签页显示该参比序列的全部HSP
+                best_blast_results = subject_hsps(all_results, best_result['subject_id'])
                 
                 # 生成HTML结果（标记为最佳匹配）
-                html_result = generate_html_result(query_sequence, best_species, best_blast_results, is_best_match=True)
+                with timed_stage('html'):
+                    html_result = generate_html_result(query_sequence, best_species, best_blast_results,
+                                                       is_best_match=True, classification=classification)
                 
-                return jsonify({
+                return jsonify(with_timings({
                     'success': True,
                     'html': html_result,
                     'results_count': 1,
@@ -1146,200 +2884,1924 @@ def run_blast():
                         'species_name': best_species['name'],
                         'bitscore': best_result['bitscore'],
                         'identity': best_result['identity'],
-                        'evalue': best_result['evalue']
-                    }
-                })
+                        'evalue': best_result['evalue'],
+                        'strand': best_result.get('strand')
+                    },
+                    'classification': classification_payload(classification)
+                }))
             except Exception as e:
+                logger.exception(f"统一数据库比对失败: {str(e)}")
                 return jsonify({'error': f'统一数据库比对失败: {str(e)}'}), 500
     
     except Exception as e:
+        logger.exception(f"BLAST执行失败: {str(e)}")
         return jsonify({'error': f'BLAST执行失败: {str(e)}'}), 500
 
-@app.route('/api/batch-blast', methods=['POST'])
-def batch_blast():
-    """批量处理序列文件"""
-    if 'files' not in request.files:
-        return jsonify({'error': '没有上传文件'}), 400
+# 批量结果汇总表（batch_summary.csv）表头
+BATCH_SUMMARY_HEADER = [
+    'SEQ文件名',
+    '对应参比序列靶点名称',
+    '对应参比序列编号',
+    'Query Length',
+    'Subject Length',
+    'Query Cover',
+    'Per. Ident',
+    '阳性概率值',
+    '结果',
+    '次优参比序列靶点名称',
+    '得分差',
+    '结果是否明确',
+    '序列方向',
+    '记录ID',
+    '比对路径',
+    '结果文件'
+]
+
+# 批量结果的类型化字段（batch_summary.jsonl/.xlsx/.parquet），数值保留原始精度不做格式化
+# 百分比字段取值范围为0-100
+SUMMARY_FIELDS = [
+    ('file', 'string'),
+    ('record_id', 'string'),
+    ('species_id', 'int64'),
+    ('species_name', 'string'),
+    ('species_code', 'string'),
+    ('query_length', 'int64'),
+    ('subject_length', 'int64'),
+    ('query_cover', 'float64'),
+    ('identity', 'float64'),
+    ('positive_probability', 'float64'),
+    ('result', 'string'),
+    ('bitscore', 'float64'),
+    ('evalue', 'float64'),
+    ('alignment_length', 'int64'),
+    ('mismatches', 'int64'),
+    ('gap_opens', 'int64'),
+    ('query_start', 'int64'),
+    ('query_end', 'int64'),
+    ('subject_start', 'int64'),
+    ('subject_end', 'int64'),
+    ('strand', 'string'),
+    ('total_score', 'float64'),
+    ('hsp_count', 'int64'),
+    ('candidate_count', 'int64'),
+    ('second_species_name', 'string'),
+    ('second_bitscore', 'float64'),
+    ('score_gap', 'float64'),
+    ('ambiguous', 'bool_'),
+    ('search_path', 'string'),
+    ('report', 'string'),
+]
+
+def build_summary_record(filename, sequence, classification, record_id=None, search_path='full', report=None):
+    """根据分类结果生成批量汇总的类型化记录（包含最佳匹配的原始比对统计值和次佳候选）
     
-    files = request.files.getlist('files')
+    多记录文件中的每条记录各生成一条，record_id为记录标题中的ID（单记录文件为None）；
+    search_path为run_blastn_queries返回的比对路径；report为该记录结果文件名（不含扩展名）。
+    """
+    best = classification['best']
+    best_species = best['species_info']
+    best_result = best['best_hit']
+    second = classification['top'][1] if len(classification['top']) > 1 else None
+    query_length = len(sequence)
+    query_cover_value = best['query_cover']
+    per_ident_value = best_result['identity']
+    positive_probability = (per_ident_value * query_cover_value) / 100
     
-    if not files or files[0].filename == '':
-        return jsonify({'error': '请至少选择一个文件'}), 400
+    return {
+        'file': filename,
+        'record_id': record_id,
+        'species_id': best_species.get('id'),
+        'species_name': best_species.get('name', ''),
+        'species_code': best_species.get('code', ''),
+        'query_length': query_length,
+        'subject_length': best_species.get('length', 0),
+        'query_cover': query_cover_value,
+        'identity': per_ident_value,
+        'positive_probability': positive_probability,
+        'result': "阳性" if per_ident_value >= 90 else "阴性",
+        'bitscore': best_result['bitscore'],
+        'evalue': best_result['evalue'],
+        'alignment_length': best_result['alignment_length'],
+        'mismatches': best_result['mismatches'],
+        'gap_opens': best_result['gap_opens'],
+        'query_start': best_result['query_start'],
+        'query_end': best_result['query_end'],
+        'subject_start': best_result['subject_start'],
+        'subject_end': best_result['subject_end'],
+        'strand': best_result.get('strand', 'plus'),
+        'total_score': best['total_score'],
+        'hsp_count': best['hsp_count'],
+        'candidate_count': classification['species_count'],
+        'second_species_name': second['species_info'].get('name', '') if second else None,
+        'second_bitscore': second['max_score'] if second else None,
+        'score_gap': classification['score_gap'],
+        'ambiguous': classification['ambiguous'],
+        'search_path': search_path,
+        'report': report,
+    }
+
+# batch_summary.csv中比对路径的显示名称
+SEARCH_PATH_LABELS = {'targeted': '定向确认', 'fallback': '定向未确认-全库', 'full': '全库'}
+
+def summary_row_from_record(record):
+    """将类型化记录格式化为batch_summary.csv中的一行"""
+    return [
+        record['file'],
+        record['species_name'],
+        record['species_code'],
+        record['query_length'],
+        record['subject_length'],
+        f"{record['query_cover']:.2f}%",
+        f"{record['identity']:.2f}%",
+        f"{record['positive_probability']:.2f}%",
+        record['result'],
+        record.get('second_species_name') or '',
+        f"{record['score_gap']:.1f}" if record.get('score_gap') is not None else '',
+        '不明确' if record.get('ambiguous') else '明确',
+        {'plus': '正向', 'minus': '反向'}.get(record.get('strand'), ''),
+        record.get('record_id') or '',
+        SEARCH_PATH_LABELS.get(record.get('search_path'), ''),
+        f"{record['report']}.html" if record.get('report') else ''
+    ]
+
+def append_summary_jsonl(output_dir, record):
+    """文件完成时立即追加类型化记录，批次运行期间即可读取已完成部分"""
+    with open(os.path.join(output_dir, 'batch_summary.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def write_summary_xlsx(xlsx_file, records):
+    """写入XLSX汇总表（数值列保持数值类型）"""
+    try:
+        import openpyxl
+    except ImportError:
+        logger.info("openpyxl未安装，跳过XLSX汇总表")
+        return None
     
-    # 检查BLAST是否安装
-    if not check_blast_installed():
-        return jsonify({'error': 'BLAST+未安装，请先安装BLAST+工具'}), 500
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('batch_summary')
+    ws.append([name for name, _ in SUMMARY_FIELDS])
+    for record in records:
+        ws.append([record.get(name) for name, _ in SUMMARY_FIELDS])
+    wb.save(xlsx_file)
+    return xlsx_file
+
+def write_summary_parquet(parquet_file, records):
+    """写入Parquet汇总表（需要pyarrow，未安装时跳过）"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        logger.debug("pyarrow未安装，跳过Parquet汇总表")
+        return None
+    
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in SUMMARY_FIELDS])
+    columns = {name: [record.get(name) for record in records] for name, _ in SUMMARY_FIELDS}
+    pq.write_table(pa.Table.from_pydict(columns, schema=schema), parquet_file)
+    return parquet_file
+
+def write_batch_summary(output_dir, records):
+    """根据全部已完成记录重建批量汇总表：CSV（格式化）及JSON Lines/XLSX/Parquet（类型化）"""
+    summary_file = os.path.join(output_dir, 'batch_summary.csv')
+    with open(summary_file, 'w', encoding='utf-8-sig', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(BATCH_SUMMARY_HEADER)
+        writer.writerows(summary_row_from_record(record) for record in records)
+    
+    # 重建JSON Lines，去掉续跑时重复追加的记录
+    jsonl_file = os.path.join(output_dir, 'batch_summary.jsonl')
+    with open(f"{jsonl_file}.tmp", 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(f"{jsonl_file}.tmp", jsonl_file)
+    
+    for writer_func, extension in ((write_summary_xlsx, 'xlsx'), (write_summary_parquet, 'parquet')):
+        try:
+            writer_func(os.path.join(output_dir, f'batch_summary.{extension}'), records)
+        except Exception as e:
+            logger.exception(f"写入batch_summary.{extension}失败: {str(e)}")
+
+def record_output_stem(filename, record_id, used_stems):
+    """结果文件名（不含扩展名）：单记录文件沿用文件名，多记录文件追加记录ID，重名时追加序号"""
+    stem = os.path.splitext(secure_filename(filename))[0]
+    if record_id is not None:
+        stem = f"{stem}_{secure_filename(record_id) or 'record'}"
+    candidate = stem
+    suffix = 2
+    while candidate in used_stems:
+        candidate = f"{stem}_{suffix}"
+        suffix += 1
+    used_stems.add(candidate)
+    return candidate
+
+class OutputStems:
+    """整个批次已使用的结果文件名（多个工作线程共享），保证不同分组的记录不会写入同一个结果文件"""
+    
+    def __init__(self):
+        self._used = set()
+        self._lock = threading.Lock()
+    
+    def add(self, stem):
+        """登记已有结果占用的文件名（续跑时已完成的文件）"""
+        with self._lock:
+            self._used.add(stem)
     
-    # 创建批次ID
-    batch_id = str(uuid.uuid4())
-    batch_folder = os.path.join(RESULTS_FOLDER, batch_id)
-    os.makedirs(batch_folder, exist_ok=True)
+    def reserve(self, filename, record_id):
+        """为一条记录分配未被占用的文件名"""
+        with self._lock:
+            return record_output_stem(filename, record_id, self._used)
+
+def query_dedup_key(sequence, target=None):
+    """批次内去重的键：清洗后序列的SHA-256，定向确认时加上预期参比序列ID（比对路径不同结果也不同）"""
+    import hashlib
+    key = hashlib.sha256(sequence.encode('ascii')).hexdigest()
+    if target:
+        key += ':' + ','.join(str(species['id']) for species in target)
+    return key
+
+def seq_content_queries(filename, file_content):
+    """解析文件内容中的有效记录
+    
+    Returns:
+        (queries, errors)：queries为[(记录ID, 序列, 预期参比序列, 去重键)]，errors为无效记录的错误信息
+    """
+    with timed_stage('parse_seq'):
+        records = parse_seq_records(file_content)
+    if not records:
+        return [], ["序列太短或无效"]
     
-    processed = 0
+    queries = []
     errors = []
-    summary_rows = []
+    target = targeted_species(filename)
+    for record_id, sequence in records:
+        if not sequence or len(sequence) < 10:
+            errors.append(record_error_message(record_id, "序列太短或无效"))
+            continue
+        queries.append((record_id, sequence, target, query_dedup_key(sequence, target)))
+    return queries, errors
+
+class BatchResultCache:
+    """批次内相同查询序列的比对结果缓存（多个工作线程共享）
     
-    # 批量处理时，复用同一个ChromeDriver实例（提升性能）
-    shared_driver = None
-    try:
-        # 尝试启动ChromeDriver（如果PNG功能可用）
-        if SELENIUM_AVAILABLE and PIL_AVAILABLE:
-            try:
-                shared_driver = get_chromedriver_instance()
-                if shared_driver:
-                    print("已启动共享ChromeDriver，将用于所有文件的PNG生成")
-            except Exception as e:
-                print(f"无法启动ChromeDriver，PNG功能将不可用: {str(e)}")
-                shared_driver = None
-        
-        for file in files:
-            if not file.filename.endswith('.seq'):
-                errors.append(f"{file.filename}: 不是.seq格式文件")
-                continue
-            
-            try:
-                # 读取文件内容
-                file_content = file.read().decode('utf-8', errors='ignore')
-                
-                # 解析序列
-                sequence = parse_seq_file(file_content)
-                
-                if not sequence or len(sequence) < 10:
-                    errors.append(f"{file.filename}: 序列太短或无效")
-                    continue
-                
-                # 与所有物种比对（使用统一数据库）
-                all_results = run_blastn_against_all_species(sequence)
-                
-                if not all_results:
-                    errors.append(f"{file.filename}: 未找到匹配结果")
-                    continue
-                
-                # 选择最佳匹配
-                all_results.sort(key=lambda x: x['bitscore'], reverse=True)
-                best_result = all_results[0]
-                best_species = best_result['species_info']
-                best_blast_results = [best_result]
+    counts为预扫描得到的每个去重键的记录数，只缓存批次中出现多次的序列，
+    最后一条使用该结果的记录完成后即释放，内存占用与重复序列数相关而与批次大小无关。
+    """
+    
+    def __init__(self, counts=None):
+        self._counts = {key: count for key, count in (counts or {}).items() if count > 1}
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """已缓存的结果，没有时返回None"""
+        with self._lock:
+            return self._entries.get(key)
+    
+    def done(self, key, entry, uses):
+        """uses条记录已使用该结果；仍有记录未处理时保留结果供后续分组复用"""
+        with self._lock:
+            remaining = self._counts.get(key, 0) - uses
+            if remaining > 0:
+                self._counts[key] = remaining
+                self._entries[key] = entry
+            else:
+                self._counts.pop(key, None)
+                self._entries.pop(key, None)
+    
+    def release(self, key, uses):
+        """uses条记录已在其他地方（工作节点）完成，只扣减计数，不改变已缓存的结果"""
+        with self._lock:
+            remaining = self._counts.get(key, 0) - uses
+            if remaining > 0:
+                self._counts[key] = remaining
+            else:
+                self._counts.pop(key, None)
+                self._entries.pop(key, None)
+
+def process_seq_contents(files, batch_folder, result_cache=None, output_stems=None):
+    """比对一组.seq/FASTA文件内容并保存HTML结果（Web批量与命令行批量共用）
+    
+    每个文件可以包含多条记录；所有文件的所有有效记录合并为一次比对调用，
+    结果按记录拆分，每条记录各生成一个HTML页面和一条汇总记录。
+    清洗后序列相同的记录只比对一次，并复用同一份分类结果和HTML内容。
+    
+    Args:
+        files: [(原始文件名, 文件文本内容)]
+        batch_folder: 结果输出目录
+        result_cache: BatchResultCache，跨分组复用批次内重复序列的结果
+        output_stems: OutputStems，批次内共享的结果文件名登记（未指定时只在本次调用内去重）
+    
+    Returns:
+        list: 与files一一对应的(results, errors)；results为[(summary_record, html_result, png_path)]，
+        errors为该文件中无效或未匹配记录的错误信息。无法解析的文件results为空。
+    """
+    outcomes = [([], []) for _ in files]
+    queries = []
+    for file_index, (filename, file_content) in enumerate(files):
+        file_queries, errors = seq_content_queries(filename, file_content)
+        outcomes[file_index][1].extend(errors)
+        queries.extend((file_index,) + query for query in file_queries)
+    
+    # 去重：每个去重键只比对一次，已在其他分组完成的直接复用
+    entries = {}
+    uses = {}
+    unique = []
+    for _, _, sequence, target, key in queries:
+        uses[key] = uses.get(key, 0) + 1
+        if key in entries:
+            METRICS.inc('localblast_batch_dedup_total')
+            continue
+        cached = result_cache.get(key) if result_cache is not None else None
+        if cached is not None:
+            METRICS.inc('localblast_batch_dedup_total')
+        else:
+            unique.append((key, sequence, target))
+        entries[key] = cached
+    
+    # 所有记录一次比对（使用统一数据库），启用定向确认时先与文件名中编号对应的参比序列比对
+    if unique:
+        all_hits = run_blastn_queries([sequence for _, sequence, _ in unique],
+                                      [target for _, _, target in unique])
+        for (key, sequence, _), (hits, search_path) in zip(unique, all_hits):
+            classification = html_result = None
+            if hits:
+                # 按物种汇总，选择最佳匹配
+                with timed_stage('classify'):
+                    classification = classify_hits(hits, len(sequence))
+                best_result = classification['best']['best_hit']
                 
                 # 生成HTML结果
-                html_result = generate_html_result(sequence, best_species, best_blast_results, is_best_match=True)
-                
-                # 保存HTML文件
-                safe_filename = secure_filename(file.filename)
-                html_filename = safe_filename.replace('.seq', '.html')
-                html_path = os.path.join(batch_folder, html_filename)
-                with open(html_path, 'w', encoding='utf-8') as f:
-                    f.write(html_result)
-                
-                # 生成PNG图片文件（使用共享的driver实例）
-                png_filename = safe_filename.replace('.seq', '.png')
-                png_path = os.path.join(batch_folder, png_filename)
-                try:
-                    html_to_image(html_result, png_path, driver=shared_driver)
-                    if os.path.exists(png_path):
-                        print(f"已生成PNG图片: {png_filename}")
-                except Exception as e:
-                    print(f"生成PNG图片失败 {png_filename}: {str(e)}")
-                    # PNG生成失败不影响主流程
-                
-                query_length = len(sequence)
-                subject_length = best_species.get('length', 0)
-                query_cover_value = 0.0
-                if query_length > 0:
-                    query_cover_value = (best_result['alignment_length'] / query_length) * 100
-                per_ident_value = best_result['identity']
-                positive_probability = (per_ident_value * query_cover_value) / 100
-                result_label = "阳性" if per_ident_value >= 90 else "阴性"
-
-                summary_rows.append([
-                    file.filename,
-                    best_species.get('name', ''),
-                    best_species.get('code', ''),
-                    query_length,
-                    subject_length,
-                    f"{query_cover_value:.2f}%",
-                    f"{per_ident_value:.2f}%",
-                    f"{positive_probability:.2f}%",
-                    result_label
-                ])
-                
-                processed += 1
-                
-            except Exception as e:
-                errors.append(f"{file.filename}: {str(e)}")
-                continue
-        
-        if processed == 0:
-            return jsonify({'error': '没有成功处理任何文件', 'errors': errors}), 400
+                with timed_stage('html'):
+                    html_result = generate_html_result(sequence, best_result['species_info'],
+                                                       subject_hsps(hits, best_result['subject_id']),
+                                                       is_best_match=True, classification=classification)
+            entries[key] = (search_path, classification, html_result)
+    
+    output_stems = output_stems or OutputStems()
+    for file_index, record_id, sequence, _, key in queries:
+        filename = files[file_index][0]
+        results, errors = outcomes[file_index]
+        search_path, classification, html_result = entries[key]
+        if classification is None:
+            errors.append(record_error_message(record_id, "未找到匹配结果"))
+            continue
         
-        summary_file = os.path.join(batch_folder, 'batch_summary.csv')
-        with open(summary_file, 'w', encoding='utf-8-sig', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow([
-                'SEQ文件名',
-                '对应参比序列靶点名称',
-                '对应参比序列编号',
-                'Query Length',
-                'Subject Length',
-                'Query Cover',
-                'Per. Ident',
-                '阳性概率值',
-                '结果'
-            ])
-            writer.writerows(summary_rows)
+        # 保存HTML文件
+        stem = output_stems.reserve(filename, record_id)
+        html_path = os.path.join(batch_folder, f"{stem}.html")
+        with log_context(file=filename), timed_stage('write_html'):
+            with open(html_path, 'w', encoding='utf-8') as f:
+                f.write(html_result)
         
-        return jsonify({
-            'success': True,
-            'batch_id': batch_id,
-            'processed': processed,
-            'total': len(files),
-            'errors': errors
-        })
+        png_path = os.path.join(batch_folder, f"{stem}.png")
+        summary_record = build_summary_record(filename, sequence, classification, record_id, search_path, stem)
+        results.append((summary_record, html_result, png_path))
+    
+    if result_cache is not None:
+        for key, count in uses.items():
+            result_cache.done(key, entries[key], count)
+    return outcomes
+
+def record_error_message(record_id, message):
+    """多记录文件的错误信息带上记录ID"""
+    return f"{record_id}: {message}" if record_id is not None else message
+
+def render_result_png(html_result, png_path, driver, rendered=None):
+    """生成PNG图片文件（失败不影响主流程）
     
+    rendered为{HTML内容摘要: PNG路径}，内容相同的结果已生成过图片时直接复制，不再启动浏览器渲染。
+    """
+    png_filename = os.path.basename(png_path)
+    digest = None
+    if rendered is not None:
+        import hashlib
+        digest = hashlib.sha256(html_result.encode('utf-8')).hexdigest()
+        source = rendered.get(digest)
+        if source and os.path.exists(source):
+            try:
+                shutil.copyfile(source, png_path)
+                return
+            except OSError as e:
+                logger.debug(f"复制PNG图片失败 {png_filename}: {str(e)}")
+    try:
+        with timed_stage('png'):
+            html_to_image(html_result, png_path, driver=driver)
+        if os.path.exists(png_path):
+            logger.debug(f"已生成PNG图片: {png_filename}")
+            if digest is not None:
+                rendered[digest] = png_path
     except Exception as e:
-        return jsonify({'error': f'批量处理失败: {str(e)}'}), 500
-    finally:
-        # 关闭共享的ChromeDriver实例
+        logger.warning(f"生成PNG图片失败 {png_filename}: {str(e)}")
+
+def start_shared_chromedriver():
+    """批量处理时启动共享的ChromeDriver实例（PNG功能不可用时返回None）"""
+    if not (SELENIUM_AVAILABLE and PIL_AVAILABLE):
+        return None
+    try:
+        shared_driver = get_chromedriver_instance()
         if shared_driver:
-            try:
-                close_chromedriver()
-                print("已关闭共享ChromeDriver")
-            except Exception as e:
-                print(f"关闭ChromeDriver时出错: {str(e)}")
+            logger.info("已启动共享ChromeDriver，将用于所有文件的PNG生成")
+        return shared_driver
+    except Exception as e:
+        logger.warning(f"无法启动ChromeDriver，PNG功能将不可用: {str(e)}")
+        return None
 
-@app.route('/api/download-results', methods=['GET'])
-def download_results():
-    """下载批量处理结果"""
-    batch_id = request.args.get('batch_id')
+# Web批量的PNG生成方式：eager（比对时逐个生成）、deferred（后台低优先级生成，下载或访问时优先生成）、off（不生成）
+PNG_RENDER_MODE = os.environ.get('LOCALBLAST_PNG_MODE', 'deferred').lower()
+# 下载结果或访问图片时等待未生成PNG的最长时间（秒）
+PNG_WAIT_SECONDS = float(os.environ.get('LOCALBLAST_PNG_WAIT_SECONDS', 300))
+
+def png_rendering_available():
+    """PNG生成所需的依赖是否可用"""
+    return SELENIUM_AVAILABLE and PIL_AVAILABLE
+
+class DeferredPngRenderer:
+    """后台PNG渲染线程：按优先级依次将结果HTML（与PNG同名的.html文件）渲染为PNG
     
-    if not batch_id:
-        return jsonify({'error': '缺少batch_id参数'}), 400
+    下载或访问时等待的图片使用PRIORITY_ON_DEMAND插到队列前面，批次比对过程中提交的使用PRIORITY_BACKGROUND。
+    渲染线程独占共享的ChromeDriver，以较低的调度优先级运行（Chrome子进程继承），
+    队列空闲IDLE_SECONDS后关闭ChromeDriver并退出，有新任务时再启动。
+    渲染失败的图片在RETRY_SECONDS内不再重试；批次被删除时通过forget清除相关记录。
+    """
     
-    batch_folder = os.path.join(RESULTS_FOLDER, batch_id)
+    PRIORITY_ON_DEMAND = 0
+    PRIORITY_BACKGROUND = 1
+    IDLE_SECONDS = 60
+    RETRY_SECONDS = 300
+    # 内容摘要 -> PNG路径的记录上限，超出时丢弃最早的记录
+    RENDERED_LIMIT = 10000
     
-    if not os.path.exists(batch_folder):
-        return jsonify({'error': '结果文件不存在'}), 404
+    def __init__(self):
+        self._queue = queue.PriorityQueue()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        # PNG路径 -> 渲染完成（或失败）时置位的Event
+        self._events = {}
+        # PNG路径 -> 渲染失败的时间（time.monotonic）
+        self._failed = {}
+        # HTML内容摘要 -> 已生成的PNG路径（内容相同时直接复制）
+        self._rendered = {}
+        self._thread = None
     
-    # 创建ZIP文件
-    zip_filename = f'blast_results_{batch_id}.zip'
-    zip_path = os.path.join(RESULTS_FOLDER, zip_filename)
+    def submit(self, png_path, priority=PRIORITY_BACKGROUND):
+        """排队渲染png_path，返回完成时置位的Event（PNG已存在或此前渲染失败时立即置位）"""
+        with self._lock:
+            event = self._events.get(png_path)
+            if event is None:
+                event = threading.Event()
+                failed_at = self._failed.get(png_path)
+                if os.path.exists(png_path):
+                    self._failed.pop(png_path, None)
+                    event.set()
+                    return event
+                if failed_at is not None and time.monotonic() - failed_at < self.RETRY_SECONDS:
+                    event.set()
+                    return event
+                self._failed.pop(png_path, None)
+                self._events[png_path] = event
+                METRICS.inc('localblast_png_pending')
+            elif priority == self.PRIORITY_BACKGROUND:
+                return event
+            # 已在队列中时以更高优先级再放入一次，渲染线程跳过已完成的重复项
+            self._queue.put((priority, next(self._counter), png_path))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='png-renderer', daemon=True)
+                self._thread.start()
+            return event
     
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(batch_folder):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, batch_folder)
-                zipf.write(file_path, arcname)
+    def cancel(self, folder):
+        """放弃folder下所有尚未开始渲染的PNG（之后访问或下载时会重新提交）"""
+        prefix = os.path.join(folder, '')
+        with self._lock:
+            cancelled = [(png_path, event) for png_path, event in self._events.items()
+                         if png_path.startswith(prefix)]
+            for png_path, event in cancelled:
+                del self._events[png_path]
+        for _, event in cancelled:
+            METRICS.dec('localblast_png_pending')
+            event.set()
+        return len(cancelled)
     
-    return send_file(zip_path, as_attachment=True, download_name=zip_filename)
-
-@app.route('/api/download-template', methods=['GET'])
-def download_template():
-    """下载序列文件模板"""
-    if getattr(sys, 'frozen', False):
-        # PyInstaller打包后，模板在exe同目录
-        template_path = os.path.join(BASE_PATH, 'templates', 'sequence_template.seq')
-    else:
+    def forget(self, folder):
+        """清除folder下图片的失败记录和内容摘要记录（批次被删除时调用）"""
+        prefix = os.path.join(folder, '')
+        with self._lock:
+            for png_path in [png_path for png_path in self._failed if png_path.startswith(prefix)]:
+                del self._failed[png_path]
+            for digest, png_path in list(self._rendered.items()):
+                if png_path.startswith(prefix):
+                    del self._rendered[digest]
+    
+    def is_pending(self, png_path):
+        """png_path是否仍在等待渲染"""
+        with self._lock:
+            return png_path in self._events
+    
+    def wait(self, png_paths, timeout):
+        """优先渲染png_paths并等待完成，超时返回False"""
+        deadline = time.monotonic() + timeout
+        events = [self.submit(png_path, self.PRIORITY_ON_DEMAND) for png_path in png_paths]
+        for event in events:
+            if not event.wait(max(0, deadline - time.monotonic())):
+                return False
+        return True
+    
+    def _run(self):
+        try:
+            # 降低渲染线程（及其启动的Chrome进程）的调度优先级，不与比对争抢CPU
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        driver = None
+        while True:
+            try:
+                _, _, png_path = self._queue.get(timeout=self.IDLE_SECONDS)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        break
+                continue
+            with self._lock:
+                event = self._events.get(png_path)
+            if event is None:
+                continue
+            
+            try:
+                if driver is None:
+                    driver = get_chromedriver_instance()
+                if driver is not None:
+                    with open(f"{os.path.splitext(png_path)[0]}.html", 'r', encoding='utf-8') as f:
+                        html_result = f.read()
+                    # _rendered只由渲染线程写入；forget在锁内整体复制后再删除
+                    render_result_png(html_result, png_path, driver, self._rendered)
+                    with self._lock:
+                        while len(self._rendered) > self.RENDERED_LIMIT:
+                            del self._rendered[next(iter(self._rendered))]
+            except Exception as e:
+                logger.warning(f"后台生成PNG图片失败 {os.path.basename(png_path)}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._events.pop(png_path, None)
+                    if not os.path.exists(png_path):
+                        self._failed[png_path] = time.monotonic()
+                METRICS.dec('localblast_png_pending')
+                event.set()
+        
+        if driver is not None:
+            close_chromedriver()
+
+PNG_RENDERER = DeferredPngRenderer()
+
+def png_needs_rendering(png_path):
+    """该PNG是否应生成但尚未生成（同名HTML结果存在）"""
+    return (PNG_RENDER_MODE != 'off' and png_rendering_available() and not os.path.exists(png_path)
+            and os.path.exists(f"{os.path.splitext(png_path)[0]}.html"))
+
+def pending_batch_pngs(batch_folder):
+    """批次中有HTML结果但尚未生成PNG的图片路径"""
+    if PNG_RENDER_MODE == 'off' or not png_rendering_available():
+        return []
+    pending = []
+    for entry in os.scandir(batch_folder):
+        stem, extension = os.path.splitext(entry.name)
+        if extension != '.html' or stem.endswith('_temp'):
+            continue
+        png_path = os.path.join(batch_folder, f"{stem}.png")
+        if not os.path.exists(png_path):
+            pending.append(png_path)
+    return pending
+
+# 批量处理进度文件（每完成一个文件追加一行JSON，用于断点续跑）
+BATCH_PROGRESS_FILE = 'batch_progress.jsonl'
+# 批次清单文件（记录输入文件及其哈希，用于重新提交或服务重启后续跑）
+BATCH_MANIFEST_FILE = 'batch_manifest.json'
+# 不打包进结果ZIP的内部文件
+BATCH_INTERNAL_FILES = {BATCH_PROGRESS_FILE, BATCH_MANIFEST_FILE}
+
+# Web批量处理的并行比对线程数
+BATCH_WORKERS = int(os.environ.get('LOCALBLAST_BATCH_WORKERS', os.cpu_count() or 1))
+# 每次比对调用最多合并的文件数（文件中的所有记录合并为一个多序列查询）
+BATCH_CHUNK_SIZE = int(os.environ.get('LOCALBLAST_BATCH_CHUNK_SIZE', 32))
+
+# 分布式批量处理：其他主机上作为工作节点的LocalBlast实例（逗号分隔的URL，如 http://10.0.0.2:5001），为空时只在本机处理
+WORKER_URLS = [url.strip().rstrip('/') for url in os.environ.get('LOCALBLAST_WORKERS', '').split(',') if url.strip()]
+# 每个工作节点同时处理的比对分组数
+WORKER_SLOTS = int(os.environ.get('LOCALBLAST_WORKER_SLOTS', 2))
+# 分组在工作节点上失败后换其他节点重试的次数（都失败时在本机处理）
+WORKER_RETRIES = int(os.environ.get('LOCALBLAST_WORKER_RETRIES', 2))
+# 单个分组请求的超时时间（秒）
+WORKER_TIMEOUT = float(os.environ.get('LOCALBLAST_WORKER_TIMEOUT', 600))
+# 不可用的工作节点间隔多久重新检查（秒）
+WORKER_HEALTH_INTERVAL = float(os.environ.get('LOCALBLAST_WORKER_HEALTH_INTERVAL', 30))
+# 协调节点与工作节点之间的共享令牌（设置后工作节点只接受携带相同令牌的请求；
+# 未设置时工作节点接口只接受本机请求）
+WORKER_TOKEN = os.environ.get('LOCALBLAST_WORKER_TOKEN', '')
+# 作为工作节点时同时处理的分组上限，超出时返回429
+WORKER_MAX_CHUNKS = int(os.environ.get('LOCALBLAST_WORKER_MAX_CHUNKS', BATCH_WORKERS))
+
+def is_valid_batch_id(batch_id):
+    """检查batch_id是否为合法的UUID（防止路径穿越）"""
+    try:
+        return str(uuid.UUID(batch_id)) == batch_id
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+def batch_shard(batch_id):
+    """批次所在的分片目录名（batch_id前两位），避免单个目录下堆积成千上万个批次"""
+    return batch_id[:2]
+
+def get_batch_folder(batch_id, root=None):
+    """批次目录 <root>/<分片>/<batch_id>（root默认为RESULTS_FOLDER），兼容旧版未分片的目录"""
+    root = root or RESULTS_FOLDER
+    legacy_folder = os.path.join(root, batch_id)
+    if os.path.isdir(legacy_folder):
+        return legacy_folder
+    return os.path.join(root, batch_shard(batch_id), batch_id)
+
+def get_batch_upload_folder(batch_id):
+    """批次上传文件目录 UPLOAD_FOLDER/<分片>/<batch_id>"""
+    return get_batch_folder(batch_id, UPLOAD_FOLDER)
+
+def get_batch_zip_path(batch_id):
+    """批次结果ZIP路径（与批次目录放在同一分片下）"""
+    return os.path.join(RESULTS_FOLDER, batch_shard(batch_id), f'blast_results_{batch_id}.zip')
+
+def iter_batch_ids(root=None):
+    """遍历目录下的所有批次ID（包括分片目录和旧版平铺目录）"""
+    root = root or RESULTS_FOLDER
+    if not os.path.isdir(root):
+        return
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        if is_valid_batch_id(entry.name):
+            yield entry.name
+        elif len(entry.name) == 2:
+            for sub_entry in os.scandir(entry.path):
+                if sub_entry.is_dir() and is_valid_batch_id(sub_entry.name):
+                    yield sub_entry.name
+
+def file_sha256(path):
+    """计算文件内容的SHA-256"""
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_json_atomic(path, data):
+    """原子写入JSON文件（先写临时文件再替换，避免中断时留下半个文件）"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+def load_batch_manifest(batch_folder):
+    """读取批次清单，不存在时返回None"""
+    manifest_file = os.path.join(batch_folder, BATCH_MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_batch_manifest(batch_folder, manifest):
+    """保存批次清单"""
+    manifest['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    write_json_atomic(os.path.join(batch_folder, BATCH_MANIFEST_FILE), manifest)
+
+def load_batch_progress(output_dir):
+    """读取已处理文件的进度记录：{文件名: 记录}，同一文件以最后一条为准"""
+    progress = {}
+    progress_file = os.path.join(output_dir, BATCH_PROGRESS_FILE)
+    if not os.path.exists(progress_file):
+        return progress
+    with open(progress_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 进程中断时最后一行可能不完整
+                continue
+            progress[record['file']] = record
+    return progress
+
+def append_batch_progress(output_dir, record):
+    """追加一条进度记录"""
+    progress_file = os.path.join(output_dir, BATCH_PROGRESS_FILE)
+    with open(progress_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+
+def is_batch_file_done(record, sha256):
+    """进度记录是否表示该文件（按内容哈希）已完成"""
+    return (bool(record) and record.get('status') == 'done'
+            and record.get('sha256') == sha256 and ('records' in record or 'record' in record))
+
+def progress_summary_records(record):
+    """进度记录中该文件的全部汇总记录（兼容旧版单记录格式）"""
+    if 'records' in record:
+        return record['records']
+    return [record['record']]
+
+def _process_seq_chunk(chunk, output_dir, timings=None, context=None, result_cache=None, cancel_event=None,
+                       output_stems=None):
+    """批量处理的工作线程：从磁盘读取一组文件，所有记录在一次比对调用中完成
+    
+    耗时计入所属请求的timings，日志沿用所属请求/批次的上下文；cancel_event置位时终止本组的比对进程。
+    返回(与chunk一一对应的process_seq_contents结果, 耗时秒数)；读取失败的文件记为错误。
+    """
+    previous = set_stage_timings(timings)
+    previous_class = set_job_class('batch')
+    previous_cancel = set_cancel_event(cancel_event)
+    started = time.perf_counter()
+    try:
+        with log_context(**(context or {})):
+            files = []
+            for filename, path, sha256 in chunk:
+                with timed_stage('read_input'):
+                    try:
+                        files.append((filename, read_seq_path(path)))
+                    except OSError as e:
+                        logger.warning(f"读取文件失败 {filename}: {str(e)}", extra={'file': filename})
+                        files.append((filename, ''))
+            # 配置了工作节点时优先交给空闲的工作节点处理
+            if WORKER_POOL is not None:
+                outcomes = process_chunk_distributed(files, output_dir, output_stems, result_cache)
+                if outcomes is not None:
+                    return outcomes, time.perf_counter() - started
+            return (process_seq_contents(files, output_dir, result_cache, output_stems),
+                    time.perf_counter() - started)
+    finally:
+        set_stage_timings(previous)
+        set_job_class(previous_class)
+        set_cancel_event(previous_cancel)
+
+def read_seq_path(path):
+    """读取.seq文件文本内容"""
+    with open(path, 'rb') as f:
+        return f.read().decode('utf-8', errors='ignore')
+
+def scan_batch_duplicates(pending):
+    """预扫描待处理文件，统计每个去重键的记录数，并把含相同序列的文件归为一组
+    
+    同一组的文件分在同一个比对分组中，避免并行的两个分组同时比对同一序列。
+    文件组按序列总长度从短到长排列（短作业优先），批次中的小文件先出结果。
+    
+    Returns:
+        (文件组列表, {去重键: 记录数})：每组为pending中的若干项，不含重复序列的文件单独成组
+    """
+    counts = {}
+    file_keys = []
+    file_lengths = {}
+    for filename, path, sha256 in pending:
+        try:
+            queries, _ = seq_content_queries(filename, read_seq_path(path))
+        except OSError:
+            queries = []
+        keys = [key for _, _, _, key in queries]
+        file_lengths[filename] = sum(len(sequence) for _, sequence, _, _ in queries)
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        file_keys.append(keys)
+    
+    groups = []
+    group_of_key = {}
+    for item, keys in zip(pending, file_keys):
+        group = next((group_of_key[key] for key in keys if key in group_of_key), None)
+        if group is None:
+            group = []
+            groups.append(group)
+        group.append(item)
+        for key in keys:
+            if counts[key] > 1:
+                group_of_key.setdefault(key, group)
+    groups.sort(key=lambda group: sum(file_lengths[filename] for filename, _, _ in group))
+    return groups, counts
+
+def iter_batch_chunks(groups, chunk_size):
+    """将文件组依次装入不超过chunk_size个文件的分组，文件组不拆开（超过chunk_size的文件组单独成为一个分组）"""
+    chunk = []
+    for group in groups:
+        if chunk and len(chunk) + len(group) > chunk_size:
+            yield chunk
+            chunk = []
+        chunk.extend(group)
+    if chunk:
+        yield chunk
+
+def iter_completed_bounded(executor, fn, items, max_in_flight):
+    """按完成顺序返回(item, future)，同时最多只有max_in_flight个任务在执行
+    
+    一次性提交成千上万个任务会让所有结果堆积在内存中；这里边完成边提交，
+    使内存占用与批次大小无关。
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    items = iter(items)
+    in_flight = {}
+    
+    def submit_next():
+        for item in items:
+            in_flight[executor.submit(fn, *item)] = item
+            return
+    
+    for _ in range(max(1, max_in_flight)):
+        submit_next()
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = in_flight.pop(future)
+            submit_next()
+            yield item, future
+
+def worker_request(url, path, payload=None, timeout=10):
+    """向工作节点发送请求（payload为None时GET，否则POST JSON），返回解析后的JSON
+    
+    网络错误和HTTP错误状态抛出OSError（urllib.error.URLError/HTTPError），响应不是JSON时抛出ValueError。
+    """
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(f"{url}{path}", data=data, headers={'Content-Type': 'application/json'})
+    if WORKER_TOKEN:
+        req.add_header('X-LocalBlast-Token', WORKER_TOKEN)
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+class WorkerNode:
+    """协调节点记录的一个工作节点的状态"""
+    
+    def __init__(self, url):
+        self.url = url
+        self.healthy = False
+        self.in_flight = 0
+        self.checked_at = None
+        self.reason = '尚未检查'
+
+class WorkerPool:
+    """协调节点使用的工作节点池：健康检查、按空闲名额选择节点、失败后暂时停用
+    
+    节点可用的条件是健康检查接口可访问、BLAST+已安装且参比库哈希与本机REFERENCE_HASH一致；
+    不可用的节点在WORKER_HEALTH_INTERVAL秒后选择节点时重新检查。
+    """
+    
+    def __init__(self, urls, slots):
+        self.nodes = [WorkerNode(url) for url in urls]
+        self.slots = max(1, slots)
+        self._lock = threading.Lock()
+    
+    def check(self, node):
+        """检查单个节点，返回是否可用"""
+        try:
+            info = worker_request(node.url, '/api/worker/health', timeout=5)
+            if info.get('reference_hash') != REFERENCE_HASH:
+                reason = f"参比库版本不一致（{str(info.get('reference_hash'))[:12]}，本机 {REFERENCE_HASH[:12]}）"
+            elif not info.get('blast_installed'):
+                reason = 'BLAST+未安装'
+            else:
+                reason = None
+        except (OSError, ValueError) as e:
+            reason = str(e)
+        with self._lock:
+            was_healthy = node.healthy
+            node.healthy = reason is None
+            node.reason = reason
+            node.checked_at = time.monotonic()
+        METRICS.set('localblast_worker_healthy', int(reason is None), worker=node.url)
+        if reason:
+            logger.warning(f"工作节点不可用 {node.url}: {reason}")
+        elif not was_healthy:
+            logger.info(f"工作节点可用: {node.url}")
+        return reason is None
+    
+    def refresh(self):
+        """并行检查所有节点，返回可用节点数"""
+        threads = [threading.Thread(target=self.check, args=(node,), daemon=True) for node in self.nodes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(node.healthy for node in self.nodes)
+    
+    def acquire(self, exclude=()):
+        """选择一个可用、有空闲名额且不在exclude中的节点（处理中分组最少的优先），没有时返回None"""
+        now = time.monotonic()
+        with self._lock:
+            recheck = [node for node in self.nodes
+                       if not node.healthy and node not in exclude
+                       and (node.checked_at is None or now - node.checked_at > WORKER_HEALTH_INTERVAL)]
+            # 先更新检查时间，避免多个线程同时检查同一节点
+            for node in recheck:
+                node.checked_at = now
+        for node in recheck:
+            self.check(node)
+        
+        with self._lock:
+            candidates = [node for node in self.nodes
+                          if node.healthy and node.in_flight < self.slots and node not in exclude]
+            if not candidates:
+                return None
+            node = min(candidates, key=lambda node: node.in_flight)
+            node.in_flight += 1
+            return node
+    
+    def release(self, node, failure=None):
+        """归还节点名额；failure不为None时停用该节点，等待下次健康检查"""
+        with self._lock:
+            node.in_flight -= 1
+            if failure is not None:
+                node.healthy = False
+                node.reason = failure
+                node.checked_at = time.monotonic()
+        if failure is not None:
+            METRICS.set('localblast_worker_healthy', 0, worker=node.url)
+
+WORKER_POOL = WorkerPool(WORKER_URLS, WORKER_SLOTS) if WORKER_URLS else None
+if WORKER_POOL is not None and not WORKER_TOKEN:
+    logger.warning("未设置LOCALBLAST_WORKER_TOKEN，其他主机上的工作节点会拒绝分组请求")
+
+def call_worker_chunk(node, payload, cancel_event=None):
+    """提交分组请求并等待结果；cancel_event置位时通知工作节点取消并抛出ToolCancelled"""
+    if cancel_event is None:
+        return worker_request(node.url, '/api/worker/chunks', payload, timeout=WORKER_TIMEOUT)
+    
+    outcome = {}
+    done = threading.Event()
+    
+    def call():
+        try:
+            outcome['response'] = worker_request(node.url, '/api/worker/chunks', payload, timeout=WORKER_TIMEOUT)
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+    
+    threading.Thread(target=call, name='worker-call', daemon=True).start()
+    while not done.wait(ToolRunner.POLL_SECONDS):
+        if cancel_event.is_set():
+            try:
+                worker_request(node.url, f"/api/worker/chunks/{payload['chunk_id']}/cancel", {}, timeout=5)
+            except (OSError, ValueError) as e:
+                logger.warning(f"通知工作节点取消分组失败 {node.url}: {str(e)}")
+            raise ToolCancelled(f"分组 {payload['chunk_id']} 已取消")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['response']
+
+def process_chunk_remote(node, files, output_dir, output_stems):
+    """在工作节点上比对一组文件，HTML写入本机output_dir，返回与process_seq_contents相同格式的结果
+    
+    结果文件名由协调节点在批次范围内分配。
+    """
+    payload = {
+        'chunk_id': uuid.uuid4().hex,
+        'reference_hash': REFERENCE_HASH,
+        'files': [{'file': filename, 'content': content} for filename, content in files],
+    }
+    with timed_stage('remote_chunk'):
+        response = call_worker_chunk(node, payload, get_cancel_event())
+    if len(response.get('outcomes', [])) != len(files):
+        raise ValueError('工作节点返回的结果数与文件数不一致')
+    
+    outcomes = []
+    for item in response['outcomes']:
+        results = []
+        for result in item['results']:
+            record = result['record']
+            stem = output_stems.reserve(record['file'], record.get('record_id'))
+            record['report'] = stem
+            with timed_stage('write_html'):
+                with open(os.path.join(output_dir, f"{stem}.html"), 'w', encoding='utf-8') as f:
+                    f.write(result['html'])
+            results.append((record, result['html'], os.path.join(output_dir, f"{stem}.png")))
+        outcomes.append((results, item['errors']))
+    return outcomes
+
+def process_chunk_distributed(files, output_dir, output_stems, result_cache=None):
+    """依次尝试把分组交给可用的工作节点处理，失败时换节点重试
+    
+    没有空闲节点或重试WORKER_RETRIES次后仍失败时返回None，由调用方在本机处理。
+    成功时从result_cache中扣减本组记录的去重计数，缓存的结果不会因此一直保留到批次结束。
+    """
+    tried = []
+    for _ in range(WORKER_RETRIES + 1):
+        node = WORKER_POOL.acquire(exclude=tried)
+        if node is None:
+            return None
+        tried.append(node)
+        failure = None
+        try:
+            outcomes = process_chunk_remote(node, files, output_dir, output_stems)
+            METRICS.inc('localblast_worker_chunks_total', worker=node.url, outcome='done')
+            if result_cache is not None:
+                for filename, content in files:
+                    for _, _, _, key in seq_content_queries(filename, content)[0]:
+                        result_cache.release(key, 1)
+            return outcomes
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                # 节点繁忙但正常，不停用
+                METRICS.inc('localblast_worker_chunks_total', worker=node.url, outcome='busy')
+                continue
+            try:
+                failure = f"HTTP {e.code}: {json.loads(e.read().decode('utf-8')).get('error')}"
+            except (OSError, ValueError, AttributeError):
+                failure = f"HTTP {e.code}"
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            failure = str(e)
+        finally:
+            WORKER_POOL.release(node, failure)
+        METRICS.inc('localblast_worker_chunks_total', worker=node.url, outcome='failed')
+        logger.warning(f"工作节点处理分组失败 {node.url}: {failure}，改用其他节点")
+    return None
+
+def process_batch(entries, output_dir, workers=None, render_png=True, defer_png=False, cancel_event=None):
+    """批量比对磁盘上的.seq文件（Web批量、断点续跑和命令行批量共用）
+    
+    已完成且内容哈希未变化的文件直接复用进度记录中的结果，只处理未完成的文件；
+    处理结束（或取消）后根据进度记录重建batch_summary.csv。
+    
+    Args:
+        entries: [(文件名, 文件路径)] 列表，按此顺序输出汇总表
+        output_dir: 结果输出目录
+        workers: 并行比对线程数
+        render_png: 是否生成PNG图片
+        defer_png: PNG交给后台渲染线程生成，批次完成不等待图片
+        cancel_event: 置位后不再分派新的分组并终止正在运行的比对进程；
+            被取消的文件不写进度记录，续跑时重新处理
+    
+    Returns:
+        (summary_records, errors) 元组：所有已完成文件的汇总记录和本次处理的错误信息
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    os.makedirs(output_dir, exist_ok=True)
+    progress = load_batch_progress(output_dir)
+    
+    # 跳过已完成且内容未变化的文件
+    pending = []
+    hashes = {}
+    for filename, path in entries:
+        hashes[filename] = sha256 = file_sha256(path)
+        record = progress.get(filename)
+        if is_batch_file_done(record, sha256):
+            continue
+        pending.append((filename, path, sha256))
+    
+    logger.info(f"共 {len(entries)} 个文件，已完成 {len(entries) - len(pending)} 个，待处理 {len(pending)} 个")
+    
+    # 批次内序列相同的记录只比对一次，结果分发给每个文件
+    with timed_stage('dedup_scan'):
+        groups, key_counts = scan_batch_duplicates(pending)
+    result_cache = BatchResultCache(key_counts)
+    # 结果文件名在整个批次内分配，已完成文件的结果文件名不再使用
+    output_stems = OutputStems()
+    for filename, path in entries:
+        record = progress.get(filename)
+        if is_batch_file_done(record, hashes[filename]):
+            for summary_record in progress_summary_records(record):
+                output_stems.add(summary_record.get('report')
+                                 or record_output_stem(filename, summary_record.get('record_id'), set()))
+    duplicates = sum(count - 1 for count in key_counts.values() if count > 1)
+    if duplicates:
+        logger.info(f"批次内有 {duplicates} 条记录与其他记录序列相同，将复用比对结果")
+    # HTML内容 -> 已生成的PNG路径，内容相同的记录直接复制图片
+    rendered_pngs = {}
+    
+    errors = []
+    workers = max(1, workers or BATCH_WORKERS)
+    if WORKER_POOL is not None and pending:
+        # 工作节点的名额计入并行分组数，分组优先交给工作节点，没有空闲节点时在本机处理
+        healthy = WORKER_POOL.refresh()
+        workers += healthy * WORKER_POOL.slots
+        logger.info(f"可用工作节点 {healthy}/{len(WORKER_POOL.nodes)} 个")
+    # 文件较少时缩小分组，保证每个线程都有任务
+    chunk_size = max(1, min(BATCH_CHUNK_SIZE, -(-len(pending) // workers)))
+    timings = get_stage_timings()
+    context = get_log_context()
+    remaining = len(pending)
+    cancel_event = cancel_event or threading.Event()
+    METRICS.inc('localblast_batches_running')
+    METRICS.inc('localblast_batch_queue_depth', remaining)
+    # 批量处理时，复用同一个ChromeDriver实例（提升性能）
+    shared_driver = start_shared_chromedriver() if render_png and not defer_png and pending else None
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            completed = iter_completed_bounded(
+                executor, _process_seq_chunk,
+                ((chunk, output_dir, timings, context, result_cache, cancel_event, output_stems)
+                 for chunk in iter_batch_chunks(groups, chunk_size)
+                 if not cancel_event.is_set()),
+                max_in_flight=workers * 2
+            )
+            done_count = 0
+            for item, future in completed:
+                chunk = item[0]
+                remaining -= len(chunk)
+                METRICS.dec('localblast_batch_queue_depth', len(chunk))
+                try:
+                    outcomes, elapsed = future.result()
+                except ToolCancelled:
+                    # 批次已取消：本组文件保持未完成状态
+                    METRICS.inc('localblast_batch_files_total', len(chunk), status='cancelled')
+                    logger.info(f"批次已取消，跳过比对分组中的 {len(chunk)} 个文件")
+                    continue
+                except Exception as e:
+                    # 整组比对失败，组内文件全部记为错误
+                    outcomes, elapsed = [([], [str(e)]) for _ in chunk], None
+                
+                for (filename, path, sha256), (results, file_errors) in zip(chunk, outcomes):
+                    done_count += 1
+                    errors.extend(f"{filename}: {message}" for message in file_errors)
+                    if not results:
+                        METRICS.inc('localblast_batch_files_total', status='error')
+                        error = '; '.join(file_errors)
+                        logger.warning(f"[{done_count}/{len(pending)}] {filename}: {error}", extra={'file': filename})
+                        record = {'file': filename, 'sha256': sha256, 'status': 'error', 'error': error}
+                        append_batch_progress(output_dir, record)
+                        progress[filename] = record
+                        continue
+                    
+                    # ChromeDriver实例不是线程安全的，PNG统一在主线程生成（已取消时不再生成）
+                    if shared_driver and not cancel_event.is_set():
+                        for summary_record, html_result, png_path in results:
+                            render_result_png(html_result, png_path, shared_driver, rendered_pngs)
+                    elif render_png and defer_png and png_rendering_available():
+                        for summary_record, html_result, png_path in results:
+                            PNG_RENDERER.submit(png_path)
+                    
+                    summary_records = [summary_record for summary_record, _, _ in results]
+                    record = {'file': filename, 'sha256': sha256, 'status': 'done', 'records': summary_records}
+                    append_batch_progress(output_dir, record)
+                    for summary_record in summary_records:
+                        append_summary_jsonl(output_dir, summary_record)
+                    progress[filename] = record
+                    METRICS.inc('localblast_batch_files_total', status='done')
+                    logger.info(f"[{done_count}/{len(pending)}] {filename}: 完成 {len(results)} 条记录",
+                                extra={'file': filename, 'records': len(results)})
+                if elapsed is not None:
+                    logger.info(f"比对分组完成：{len(chunk)} 个文件，耗时 {elapsed:.2f}s",
+                                extra={'elapsed_seconds': round(elapsed, 3)})
+    finally:
+        METRICS.dec('localblast_batch_queue_depth', remaining)
+        METRICS.dec('localblast_batches_running')
+        # 关闭共享的ChromeDriver实例
+        if shared_driver:
+            try:
+                close_chromedriver()
+                logger.info("已关闭共享ChromeDriver")
+            except Exception as e:
+                logger.warning(f"关闭ChromeDriver时出错: {str(e)}")
+    
+    # 按输入顺序根据进度记录重建汇总表（包括此前运行已完成的文件）
+    summary_records = []
+    for filename, path in entries:
+        record = progress.get(filename)
+        if is_batch_file_done(record, hashes[filename]):
+            summary_records.extend(progress_summary_records(record))
+    if summary_records:
+        with timed_stage('write_summary'):
+            write_batch_summary(output_dir, summary_records)
+    return summary_records, errors
+
+class UploadLimitError(Exception):
+    """上传文件数量或大小超过限制"""
+
+def spool_to_disk(stream, dest_path, max_size):
+    """将上传流分块写入磁盘并计算SHA-256，超过大小限制时抛出ValueError"""
+    import hashlib
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, 'wb') as out:
+            for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError(f"文件超过大小限制（{max_size // 1024} KB）")
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return digest.hexdigest()
+
+def archive_member_name(name):
+    """压缩包成员在批次中的文件名：压缩包内的相对路径（统一为/分隔，去掉开头的/和.、..）"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts)
+
+def iter_archive_members(archive_path):
+    """逐个返回压缩包中的.seq文件(相对路径, 文件对象)，不将整个压缩包解压到内存
+    
+    不同目录下的同名文件（如plateA/s1.seq和plateB/s1.seq）按相对路径区分，各自作为一个文件处理。
+    """
+    def is_seq_member(name):
+        basename = os.path.basename(name)
+        # 跳过macOS生成的资源文件（__MACOSX/._xxx.seq）
+        return basename.endswith('.seq') and not basename.startswith('._')
+    
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not is_seq_member(info.filename):
+                    continue
+                with zf.open(info) as member:
+                    yield archive_member_name(info.filename), member
+    else:
+        # 流式模式顺序读取，.tar.gz无需随机访问
+        with tarfile.open(archive_path, 'r|*') as tf:
+            for info in tf:
+                if not info.isfile() or not is_seq_member(info.name):
+                    continue
+                yield archive_member_name(info.name), tf.extractfile(info)
+
+def spool_batch_uploads(files, upload_folder, manifest, cancel_event=None):
+    """将上传的.seq文件和压缩包逐个保存到批次上传目录并登记到批次清单
+    
+    文件在磁盘上以随机名称保存（原始文件名只记录在清单中），不同文件名不会因字符过滤而互相覆盖；
+    重新提交已有批次时同名文件替换原文件，同一次提交中重复的文件名跳过并记为错误。
+    cancel_event置位后不再保存后续文件（批次在上传过程中被取消）。
+    
+    Returns:
+        (本次提交的.seq文件数, 错误信息列表)
+    
+    Raises:
+        UploadLimitError: 文件数量超过MAX_BATCH_FILES
+    """
+    known_files = {item['file']: item for item in manifest['files']}
+    # 旧版清单按过滤后的文件名保存，可能有多个条目共用一个磁盘文件
+    stored_refs = {}
+    for item in manifest['files']:
+        stored_refs[item['stored_name']] = stored_refs.get(item['stored_name'], 0) + 1
+    submitted = set()
+    errors = []
+    count = 0
+    
+    def add_file(filename, stream):
+        nonlocal count
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        if filename in submitted:
+            errors.append(f"{filename}: 文件名重复，已跳过")
+            return
+        submitted.add(filename)
+        count += 1
+        if count > MAX_BATCH_FILES:
+            raise UploadLimitError(f"文件数量超过上限（{MAX_BATCH_FILES}个）")
+        stored_name = f"{uuid.uuid4().hex}.seq"
+        try:
+            sha256 = spool_to_disk(stream, os.path.join(upload_folder, stored_name), MAX_SEQ_FILE_SIZE)
+        except ValueError as e:
+            errors.append(f"{filename}: {str(e)}")
+            return
+        item = known_files.get(filename)
+        if item is None:
+            item = {'file': filename}
+            manifest['files'].append(item)
+            known_files[filename] = item
+        else:
+            # 替换同名文件：旧文件不再被其他条目引用时删除
+            previous = item['stored_name']
+            stored_refs[previous] -= 1
+            if not stored_refs[previous]:
+                try:
+                    os.remove(os.path.join(upload_folder, previous))
+                except OSError:
+                    pass
+        item['stored_name'] = stored_name
+        stored_refs[stored_name] = 1
+        item['sha256'] = sha256
+    
+    for file in files:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        if file.filename.lower().endswith(ARCHIVE_EXTENSIONS):
+            archive_path = os.path.join(upload_folder, f"_archive_{uuid.uuid4().hex}")
+            file.save(archive_path)
+            try:
+                for member_name, member in iter_archive_members(archive_path):
+                    add_file(member_name, member)
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                errors.append(f"{file.filename}: 无法读取压缩包（{str(e)}）")
+            finally:
+                os.remove(archive_path)
+        elif file.filename.endswith('.seq'):
+            add_file(file.filename, file.stream)
+        else:
+            errors.append(f"{file.filename}: 不是.seq格式文件或支持的压缩包")
+    
+    return count, errors
+
+# 正在本进程中运行的Web批次：batch_id -> (取消事件, 运行结束事件)
+RUNNING_BATCHES = {}
+_running_batches_lock = threading.Lock()
+# 取消批次时等待其停止的最长时间（秒），超时后接口先返回，批次在后台继续停止
+CANCEL_WAIT_SECONDS = 10
+
+class BatchAlreadyRunning(Exception):
+    """批次已在本进程中运行（重复提交或续跑），接口返回409"""
+
+def claim_web_batch(batch_id):
+    """将批次登记为运行中，返回(取消事件, 运行结束事件)
+    
+    Raises:
+        BatchAlreadyRunning: 批次已在运行，不能在同一目录上再启动一次
+    """
+    state = (threading.Event(), threading.Event())
+    with _running_batches_lock:
+        if batch_id in RUNNING_BATCHES:
+            raise BatchAlreadyRunning(batch_id)
+        RUNNING_BATCHES[batch_id] = state
+    return state
+
+def release_web_batch(batch_id, state):
+    """取消claim_web_batch的登记，并通知等待批次停止的取消请求"""
+    with _running_batches_lock:
+        if RUNNING_BATCHES.get(batch_id) is state:
+            del RUNNING_BATCHES[batch_id]
+    state[1].set()
+
+def run_web_batch(batch_id, manifest, state=None):
+    """执行（或续跑）一个Web批次：输入文件保存在批次上传目录中
+    
+    运行期间可通过cancel_web_batch取消，取消后清单状态为cancelled，汇总表只包含已完成的文件。
+    state为调用方已通过claim_web_batch登记的状态（由调用方负责释放），未指定时在此登记。
+    
+    Raises:
+        BatchAlreadyRunning: 未指定state且批次已在运行
+    """
+    batch_folder = get_batch_folder(batch_id)
+    upload_folder = get_batch_upload_folder(batch_id)
+    entries = [(item['file'], os.path.join(upload_folder, item['stored_name']))
+               for item in manifest['files']]
+    
+    owned = state is None
+    if owned:
+        state = claim_web_batch(batch_id)
+    cancel_event = state[0]
+    try:
+        manifest['status'] = 'running'
+        save_batch_manifest(batch_folder, manifest)
+        with log_context(batch_id=batch_id):
+            summary_records, errors = process_batch(entries, batch_folder,
+                                                    render_png=PNG_RENDER_MODE != 'off',
+                                                    defer_png=PNG_RENDER_MODE == 'deferred',
+                                                    cancel_event=cancel_event)
+            if cancel_event.is_set():
+                dropped = PNG_RENDERER.cancel(batch_folder)
+                logger.info(f"批次已取消：完成 {len(summary_records)} 条记录，放弃 {dropped} 张待生成的PNG")
+        manifest['status'] = 'cancelled' if cancel_event.is_set() else 'completed'
+        manifest['processed'] = len(summary_records)
+        save_batch_manifest(batch_folder, manifest)
+        return summary_records, errors
+    finally:
+        if owned:
+            release_web_batch(batch_id, state)
+
+def cancel_web_batch(batch_id, timeout=CANCEL_WAIT_SECONDS):
+    """取消本进程中正在运行的批次并等待其停止
+    
+    Returns:
+        None表示批次不在运行；否则为批次是否已在timeout内停止
+    """
+    with _running_batches_lock:
+        state = RUNNING_BATCHES.get(batch_id)
+    if state is None:
+        return None
+    cancel_event, finished = state
+    cancel_event.set()
+    return finished.wait(timeout)
+
+def resume_interrupted_batches():
+    """服务启动时续跑上次中断（清单状态仍为running）的批次"""
+    for batch_id in list(iter_batch_ids()):
+        batch_folder = get_batch_folder(batch_id)
+        try:
+            manifest = load_batch_manifest(batch_folder)
+            if manifest and manifest.get('status') == 'running':
+                logger.info(f"续跑中断的批次: {batch_id}")
+                run_web_batch(batch_id, manifest)
+        except BatchAlreadyRunning:
+            logger.info(f"批次 {batch_id} 已在运行，跳过续跑")
+        except Exception as e:
+            logger.exception(f"续跑批次 {batch_id} 失败: {str(e)}")
+
+@app.route('/api/batch-blast', methods=['POST'])
+@admitted(BATCH_GATE)
+def batch_blast():
+    """批量处理序列文件
+    
+    可选表单字段batch_id：重新提交已有批次时，只处理新增、内容变化或上次未完成的文件。
+    """
+    if 'files' not in request.files:
+        return jsonify({'error': '没有上传文件'}), 400
+    
+    files = request.files.getlist('files')
+    
+    if not files or files[0].filename == '':
+        return jsonify({'error': '请至少选择一个文件'}), 400
+    
+    # 检查BLAST是否安装
+    if not check_blast_installed():
+        return jsonify({'error': 'BLAST+未安装，请先安装BLAST+工具'}), 500
+    
+    # 创建批次ID（重新提交时沿用已有批次）
+    batch_id = request.form.get('batch_id') or str(uuid.uuid4())
+    if not is_valid_batch_id(batch_id):
+        return jsonify({'error': '无效的batch_id'}), 400
+    bind_log_context(batch_id=batch_id)
+    # 先登记为运行中：同一批次正在运行时不能再写入上传目录或重复比对
+    try:
+        state = claim_web_batch(batch_id)
+    except BatchAlreadyRunning:
+        return jsonify({'error': '批次正在运行', 'batch_id': batch_id, 'status': 'running'}), 409
+    
+    try:
+        batch_folder = get_batch_folder(batch_id)
+        upload_folder = get_batch_upload_folder(batch_id)
+        os.makedirs(batch_folder, exist_ok=True)
+        os.makedirs(upload_folder, exist_ok=True)
+        
+        manifest = load_batch_manifest(batch_folder) or {
+            'batch_id': batch_id,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'files': []
+        }
+        
+        # 将上传文件和压缩包中的.seq文件逐个保存到磁盘，服务重启后可据此续跑
+        total, errors = spool_batch_uploads(files, upload_folder, manifest, state[0])
+        if state[0].is_set():
+            # 保存上传文件期间被取消：已保存的文件登记在清单中，可通过resume接口续跑
+            manifest['status'] = 'cancelled'
+            save_batch_manifest(batch_folder, manifest)
+            return jsonify({
+                'error': '批次已取消',
+                'batch_id': batch_id,
+                'status': 'cancelled',
+                'processed': 0,
+                'total': total
+            }), 409
+        if total == 0:
+            return jsonify({'error': '没有找到.seq文件', 'errors': errors}), 400
+        
+        summary_records, batch_errors = run_web_batch(batch_id, manifest, state)
+        errors.extend(batch_errors)
+        
+        if manifest['status'] == 'cancelled':
+            return jsonify({
+                'error': '批次已取消',
+                'batch_id': batch_id,
+                'status': 'cancelled',
+                'processed': len(summary_records),
+                'total': total
+            }), 409
+        
+        if not summary_records:
+            return jsonify({'error': '没有成功处理任何文件', 'errors': errors}), 400
+        
+        return jsonify(with_timings({
+            'success': True,
+            'batch_id': batch_id,
+            'processed': len(summary_records),
+            'total': total,
+            'errors': errors
+        }))
+    
+    except UploadLimitError as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        logger.exception(f"批量处理失败: {str(e)}")
+        return jsonify({'error': f'批量处理失败: {str(e)}'}), 500
+    finally:
+        release_web_batch(batch_id, state)
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_upload_too_large(e):
+    """上传内容超过MAX_CONTENT_LENGTH"""
+    return jsonify({'error': f'上传内容超过大小限制（{MAX_UPLOAD_SIZE // (1024 * 1024)} MB）'}), 413
+
+@app.route('/api/batch-blast/<batch_id>/resume', methods=['POST'])
+@admitted(BATCH_GATE)
+def resume_batch(batch_id):
+    """续跑已有批次中未完成的文件，并根据已保存结果重建汇总表"""
+    if not is_valid_batch_id(batch_id):
+        return jsonify({'error': '无效的batch_id'}), 400
+    
+    bind_log_context(batch_id=batch_id)
+    if not check_blast_installed():
+        return jsonify({'error': 'BLAST+未安装，请先安装BLAST+工具'}), 500
+    
+    try:
+        state = claim_web_batch(batch_id)
+    except BatchAlreadyRunning:
+        return jsonify({'error': '批次正在运行', 'batch_id': batch_id, 'status': 'running'}), 409
+    
+    try:
+        manifest = load_batch_manifest(get_batch_folder(batch_id))
+        if not manifest:
+            return jsonify({'error': '批次不存在'}), 404
+        
+        summary_records, errors = run_web_batch(batch_id, manifest, state)
+        return jsonify(with_timings({
+            'success': True,
+            'batch_id': batch_id,
+            'status': manifest['status'],
+            'processed': len(summary_records),
+            'total': len(manifest['files']),
+            'errors': errors
+        }))
+    except Exception as e:
+        logger.exception(f"批量处理失败: {str(e)}")
+        return jsonify({'error': f'批量处理失败: {str(e)}'}), 500
+    finally:
+        release_web_batch(batch_id, state)
+
+@app.route('/api/batch-blast/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    """取消正在运行的批次：不再分派新文件，终止正在运行的比对进程和待生成的PNG
+    
+    已完成的文件保留结果，batch_summary.csv只包含这些文件；之后可通过resume接口续跑剩余文件。
+    """
+    if not is_valid_batch_id(batch_id):
+        return jsonify({'error': '无效的batch_id'}), 400
+    
+    bind_log_context(batch_id=batch_id)
+    batch_folder = get_batch_folder(batch_id)
+    stopped = cancel_web_batch(batch_id)
+    manifest = load_batch_manifest(batch_folder)
+    if stopped is None:
+        if not manifest:
+            return jsonify({'error': '批次不存在'}), 404
+        return jsonify({'error': '批次未在运行', 'status': manifest.get('status')}), 409
+    
+    logger.info("已请求取消批次")
+    if not stopped or not manifest:
+        return jsonify({'success': True, 'batch_id': batch_id, 'status': 'cancelling'}), 202
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'status': manifest.get('status'),
+        'processed': manifest.get('processed', 0),
+        'total': len(manifest['files'])
+    })
+
+WORKER_GATE = AdmissionGate('worker', WORKER_MAX_CHUNKS, WORKER_MAX_CHUNKS, 30)
+# 工作节点上正在处理的分组：chunk_id -> 取消事件
+WORKER_CHUNKS = {}
+_worker_chunks_lock = threading.Lock()
+
+def worker_authorized():
+    """工作节点接口的令牌校验（未设置LOCALBLAST_WORKER_TOKEN时只接受来自本机的请求）"""
+    if not WORKER_TOKEN:
+        return request.remote_addr in ('127.0.0.1', '::1')
+    return hmac.compare_digest(request.headers.get('X-LocalBlast-Token', ''), WORKER_TOKEN)
+
+@app.route('/api/worker/health', methods=['GET'])
+def worker_health():
+    """工作节点健康检查：返回参比库哈希和BLAST+是否可用，供协调节点判断能否分发任务"""
+    if not worker_authorized():
+        return jsonify({'error': '令牌无效'}), 403
+    return jsonify({
+        'status': 'ok',
+        'reference_hash': REFERENCE_HASH,
+        'species_count': len(SPECIES_DB),
+        'blast_installed': check_blast_installed(),
+        'max_chunks': WORKER_MAX_CHUNKS
+    })
+
+@app.route('/api/worker/chunks', methods=['POST'])
+@admitted(WORKER_GATE)
+def worker_process_chunk():
+    """工作节点：比对协调节点发来的一组文件，返回每条记录的汇总记录、结果文件名和HTML
+    
+    参比库哈希与本机不一致时返回409，协调节点会停用本节点并把分组交给其他节点。
+    """
+    if not worker_authorized():
+        return jsonify({'error': '令牌无效'}), 403
+    data = request.get_json(silent=True) or {}
+    if data.get('reference_hash') != REFERENCE_HASH:
+        return jsonify({'error': '参比库版本不一致', 'reference_hash': REFERENCE_HASH}), 409
+    try:
+        files = [(item['file'], item['content']) for item in data['files']]
+    except (KeyError, TypeError):
+        return jsonify({'error': '无效的分组请求'}), 400
+    
+    chunk_id = str(data.get('chunk_id', ''))
+    cancel_event = threading.Event()
+    with _worker_chunks_lock:
+        WORKER_CHUNKS[chunk_id] = cancel_event
+    # 工作节点上的比对进程按批量任务排队，可被协调节点取消
+    previous_class = set_job_class('batch')
+    previous_cancel = set_cancel_event(cancel_event)
+    try:
+        with log_context(chunk_id=chunk_id), SCRATCH.directory() as output_dir:
+            outcomes = process_seq_contents(files, output_dir)
+    except ToolCancelled:
+        return jsonify({'error': '分组已取消'}), 409
+    except Exception as e:
+        logger.exception(f"处理分组失败: {str(e)}")
+        return jsonify({'error': f'处理分组失败: {str(e)}'}), 500
+    finally:
+        set_job_class(previous_class)
+        set_cancel_event(previous_cancel)
+        with _worker_chunks_lock:
+            WORKER_CHUNKS.pop(chunk_id, None)
+    
+    return jsonify({'outcomes': [
+        {
+            'results': [{'record': summary_record, 'html': html_result}
+                        for summary_record, html_result, _ in results],
+            'errors': errors
+        }
+        for results, errors in outcomes
+    ]})
+
+@app.route('/api/worker/chunks/<chunk_id>/cancel', methods=['POST'])
+def worker_cancel_chunk(chunk_id):
+    """工作节点：取消正在处理的分组（终止其比对进程）"""
+    if not worker_authorized():
+        return jsonify({'error': '令牌无效'}), 403
+    with _worker_chunks_lock:
+        cancel_event = WORKER_CHUNKS.get(chunk_id)
+    if cancel_event is None:
+        return jsonify({'error': '分组不在处理中'}), 404
+    cancel_event.set()
+    return jsonify({'success': True})
+
+@app.route('/api/download-results', methods=['GET'])
+def download_results():
+    """下载批量处理结果"""
+    batch_id = request.args.get('batch_id')
+    
+    if not batch_id:
+        return jsonify({'error': '缺少batch_id参数'}), 400
+    
+    if not is_valid_batch_id(batch_id):
+        return jsonify({'error': '无效的batch_id'}), 400
+    
+    batch_folder = get_batch_folder(batch_id)
+    
+    if not os.path.exists(batch_folder):
+        return jsonify({'error': '结果文件不存在'}), 404
+    
+    # 只等待尚未生成的PNG（下载时优先渲染），超时则打包已有的文件
+    pending = pending_batch_pngs(batch_folder)
+    if pending and not PNG_RENDERER.wait(pending, PNG_WAIT_SECONDS):
+        logger.warning(f"等待PNG生成超时，结果包中缺少部分图片: {batch_id}")
+    
+    # 创建ZIP文件（先写临时文件，避免并发下载读到不完整的ZIP）
+    zip_filename = f'blast_results_{batch_id}.zip'
+    zip_path = get_batch_zip_path(batch_id)
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+    temp_zip_path = f"{zip_path}.{uuid.uuid4().hex}.tmp"
+    
+    with zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for root, dirs, files in os.walk(batch_folder):
+            for file in files:
+                if file in BATCH_INTERNAL_FILES:
+                    continue
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, batch_folder)
+                zipf.write(file_path, arcname)
+    os.replace(temp_zip_path, zip_path)
+    
+    return send_file(zip_path, as_attachment=True, download_name=zip_filename)
+
+@app.route('/api/batch-blast/<batch_id>/artifacts/<name>', methods=['GET'])
+def get_batch_artifact(batch_id, name):
+    """获取批次中的单个结果文件（HTML/PNG/汇总表），PNG尚未生成时优先渲染并等待"""
+    if not is_valid_batch_id(batch_id):
+        return jsonify({'error': '无效的batch_id'}), 400
+    if secure_filename(name) != name or name in BATCH_INTERNAL_FILES:
+        return jsonify({'error': '无效的文件名'}), 400
+    
+    batch_folder = get_batch_folder(batch_id)
+    path = os.path.join(batch_folder, name)
+    if name.endswith('.png') and png_needs_rendering(path):
+        if not PNG_RENDERER.wait([path], PNG_WAIT_SECONDS):
+            return jsonify({'error': 'PNG图片仍在生成中，请稍后重试'}), 503
+    
+    if not os.path.isfile(path):
+        return jsonify({'error': '结果文件不存在'}), 404
+    return send_file(path)
+
+# 结果保留策略（可通过环境变量调整，0表示不限制）
+RESULT_TTL_HOURS = float(os.environ.get('LOCALBLAST_RESULT_TTL_HOURS', 168))
+ZIP_TTL_HOURS = float(os.environ.get('LOCALBLAST_ZIP_TTL_HOURS', 24))
+STORAGE_QUOTA_MB = float(os.environ.get('LOCALBLAST_STORAGE_QUOTA_MB', 0))
+JANITOR_INTERVAL_SECONDS = int(os.environ.get('LOCALBLAST_JANITOR_INTERVAL_SECONDS', 600))
+# 还没有清单的批次（可能正在其他进程中保存上传文件）在最后活动后至少保留的时间（秒）
+JANITOR_GRACE_SECONDS = int(os.environ.get('LOCALBLAST_JANITOR_GRACE_SECONDS', 3600))
+
+# 最近一次清理的统计信息（/api/storage-stats）
+JANITOR_STATS = {
+    'last_run': None,
+    'evicted_batches': 0,
+    'evicted_zip_files': 0,
+    'freed_bytes': 0
+}
+
+def get_dir_usage(path):
+    """返回目录的(总字节数, 最近修改时间)，一次遍历完成"""
+    total_size = 0
+    latest_mtime = 0.0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    stat = entry.stat(follow_symlinks=False)
+                    total_size += stat.st_size
+                    latest_mtime = max(latest_mtime, stat.st_mtime)
+            except OSError:
+                continue
+    return total_size, latest_mtime
+
+def iter_zip_files():
+    """遍历RESULTS_FOLDER中的结果ZIP（分片目录和旧版根目录）"""
+    if not os.path.isdir(RESULTS_FOLDER):
+        return
+    for entry in os.scandir(RESULTS_FOLDER):
+        if entry.is_file() and entry.name.startswith('blast_results_') and entry.name.endswith('.zip'):
+            yield entry
+        elif entry.is_dir() and len(entry.name) == 2:
+            for sub_entry in os.scandir(entry.path):
+                if sub_entry.is_file() and sub_entry.name.startswith('blast_results_') and sub_entry.name.endswith('.zip'):
+                    yield sub_entry
+
+def collect_batch_usage():
+    """统计每个批次（结果目录+上传目录+ZIP）的占用空间、最后活动时间和状态"""
+    batches = {}
+    for root in (RESULTS_FOLDER, UPLOAD_FOLDER):
+        for batch_id in iter_batch_ids(root):
+            size, mtime = get_dir_usage(get_batch_folder(batch_id, root))
+            info = batches.setdefault(batch_id, {'size': 0, 'last_activity': 0.0, 'status': None})
+            info['size'] += size
+            info['last_activity'] = max(info['last_activity'], mtime)
+    
+    for batch_id, info in batches.items():
+        zip_path = get_batch_zip_path(batch_id)
+        if os.path.exists(zip_path):
+            stat = os.stat(zip_path)
+            info['size'] += stat.st_size
+            info['last_activity'] = max(info['last_activity'], stat.st_mtime)
+        try:
+            manifest = load_batch_manifest(get_batch_folder(batch_id))
+        except (OSError, ValueError):
+            manifest = None
+        if manifest:
+            info['status'] = manifest.get('status')
+    return batches
+
+def delete_batch(batch_id):
+    """删除批次的结果目录、上传目录和结果ZIP"""
+    PNG_RENDERER.forget(get_batch_folder(batch_id))
+    shutil.rmtree(get_batch_folder(batch_id), ignore_errors=True)
+    shutil.rmtree(get_batch_upload_folder(batch_id), ignore_errors=True)
+    zip_path = get_batch_zip_path(batch_id)
+    if os.path.exists(zip_path):
+        os.remove(zip_path)
+
+def run_storage_janitor(now=None):
+    """执行一次清理：过期ZIP、超过保留期的批次，以及超出磁盘配额时最久未使用的批次
+    
+    正在运行（包括正在保存上传文件）的批次不会被清理；没有清单的批次在最后活动JANITOR_GRACE_SECONDS内也不清理。
+    """
+    now = now or time.time()
+    evicted_batches = 0
+    evicted_zip_files = 0
+    freed_bytes = 0
+    
+    # ZIP只是下载缓存，可随时重新生成
+    if ZIP_TTL_HOURS > 0:
+        for entry in list(iter_zip_files()):
+            stat = entry.stat()
+            if now - stat.st_mtime > ZIP_TTL_HOURS * 3600:
+                try:
+                    os.remove(entry.path)
+                    evicted_zip_files += 1
+                    freed_bytes += stat.st_size
+                except OSError:
+                    pass
+    
+    batches = collect_batch_usage()
+    with _running_batches_lock:
+        running = set(RUNNING_BATCHES)
+    removable = sorted(
+        ((info['last_activity'], batch_id, info) for batch_id, info in batches.items()
+         if info['status'] != 'running' and batch_id not in running
+         and not (info['status'] is None and now - info['last_activity'] < JANITOR_GRACE_SECONDS)),
+        key=lambda item: item[0]
+    )
+    total_size = sum(info['size'] for info in batches.values())
+    quota_bytes = STORAGE_QUOTA_MB * 1024 * 1024
+    
+    for last_activity, batch_id, info in removable:
+        expired = RESULT_TTL_HOURS > 0 and now - last_activity > RESULT_TTL_HOURS * 3600
+        over_quota = quota_bytes > 0 and total_size > quota_bytes
+        if not (expired or over_quota):
+            # 按最后活动时间从旧到新排列，之后的批次更新，也无需再为配额腾出空间
+            break
+        delete_batch(batch_id)
+        logger.info(f"已清理批次 {batch_id}（{'超过保留期' if expired else '超出磁盘配额'}，{info['size'] // 1024} KB）")
+        evicted_batches += 1
+        freed_bytes += info['size']
+        total_size -= info['size']
+    
+    JANITOR_STATS['last_run'] = datetime.fromtimestamp(now).isoformat(timespec='seconds')
+    JANITOR_STATS['evicted_batches'] += evicted_batches
+    JANITOR_STATS['evicted_zip_files'] += evicted_zip_files
+    JANITOR_STATS['freed_bytes'] += freed_bytes
+    return evicted_batches, evicted_zip_files, freed_bytes
+
+def start_storage_janitor():
+    """启动后台清理线程"""
+    import threading
+    
+    def janitor_loop():
+        while True:
+            try:
+                run_storage_janitor()
+            except Exception as e:
+                logger.exception(f"清理结果目录失败: {str(e)}")
+            time.sleep(JANITOR_INTERVAL_SECONDS)
+    
+    threading.Thread(target=janitor_loop, name='storage-janitor', daemon=True).start()
+
+_background_services_started = False
+_background_services_lock = threading.Lock()
+
+def start_background_services():
+    """启动续跑中断批次和结果目录清理的后台线程（每个进程只启动一次）"""
+    global _background_services_started
+    with _background_services_lock:
+        if _background_services_started:
+            return
+        _background_services_started = True
+    threading.Thread(target=resume_interrupted_batches, name='batch-resume', daemon=True).start()
+    start_storage_janitor()
+
+def create_app():
+    """WSGI服务器入口（如 gunicorn "blast_app:create_app()"）：加载参比库、清理临时目录并启动后台任务"""
+    load_species_db()
+    SCRATCH.cleanup_stale(keep_reference=REFERENCE_HASH[:20])
+    start_background_services()
+    return app
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus格式的性能指标"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/storage-stats', methods=['GET'])
+def storage_stats():
+    """结果目录和上传目录的磁盘占用统计"""
+    results_batches = list(iter_batch_ids(RESULTS_FOLDER))
+    upload_batches = list(iter_batch_ids(UPLOAD_FOLDER))
+    zip_files = list(iter_zip_files())
+    disk = shutil.disk_usage(RESULTS_FOLDER)
+    
+    return jsonify({
+        'results': {
+            'batches': len(results_batches),
+            'bytes': sum(get_dir_usage(get_batch_folder(batch_id))[0] for batch_id in results_batches),
+            'zip_files': len(zip_files),
+            'zip_bytes': sum(entry.stat().st_size for entry in zip_files)
+        },
+        'uploads': {
+            'batches': len(upload_batches),
+            'bytes': sum(get_dir_usage(get_batch_upload_folder(batch_id))[0] for batch_id in upload_batches)
+        },
+        'disk': {
+            'total': disk.total,
+            'used': disk.used,
+            'free': disk.free
+        },
+        'policy': {
+            'result_ttl_hours': RESULT_TTL_HOURS,
+            'zip_ttl_hours': ZIP_TTL_HOURS,
+            'storage_quota_mb': STORAGE_QUOTA_MB,
+            'janitor_interval_seconds': JANITOR_INTERVAL_SECONDS
+        },
+        'janitor': JANITOR_STATS
+    })
+
+@app.route('/api/download-template', methods=['GET'])
+def download_template():
+    """下载序列文件模板"""
+    if getattr(sys, 'frozen', False):
+        # PyInstaller打包后，模板在exe同目录
+        template_path = os.path.join(BASE_PATH, 'templates', 'sequence_template.seq')
+    else:
         # 开发环境
         template_path = os.path.join('templates', 'sequence_template.seq')
     
@@ -1348,15 +4810,119 @@ def download_template():
     
     return send_file(template_path, as_attachment=True, download_name='sequence_template.seq')
 
-if __name__ == '__main__':
+# 命令行批量处理
+def expand_batch_inputs(inputs):
+    """展开命令行输入（.seq文件、目录或通配符），返回按文件名排序并去重的[(文件名, 文件路径)]
+    
+    文件名为相对于输入目录（通配符取不含通配符的目录部分）的路径，与压缩包成员一样以/分隔，
+    不同子目录下的同名文件（如plateA/s1.seq和plateB/s1.seq）各自作为一个文件处理。
+    多个输入得到相同文件名时改用相对于当前目录的路径（仍重复时用绝对路径）区分。
+    """
+    import glob
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                for name in files:
+                    if name.endswith('.seq'):
+                        found.append((item, os.path.join(root, name)))
+        elif os.path.isfile(item):
+            found.append((os.path.dirname(item), item))
+        else:
+            base = item
+            while glob.has_magic(base):
+                base = os.path.dirname(base)
+            found.extend((base, p) for p in glob.glob(item, recursive=True)
+                         if os.path.isfile(p) and p.endswith('.seq'))
+    
+    paths = {}
+    for base, path in found:
+        paths.setdefault(os.path.abspath(path), (base, path))
+    
+    namings = (lambda base, path: os.path.relpath(path, base or '.'),
+               lambda base, path: os.path.relpath(path),
+               lambda base, path: os.path.abspath(path))
+    names = {}
+    for key, (base, path) in paths.items():
+        names[key] = archive_member_name(namings[0](base, path))
+    for naming in namings[1:]:
+        counts = {}
+        for name in names.values():
+            counts[name] = counts.get(name, 0) + 1
+        for key, name in names.items():
+            if counts[name] > 1:
+                names[key] = archive_member_name(naming(*paths[key]))
+    return sorted(((names[key], path) for key, (_, path) in paths.items()), key=lambda entry: entry[0])
+
+def run_batch_cli(inputs, output_dir, workers=None, render_png=True, restart=False):
+    """命令行批量处理：与Web批量共用比对、HTML、PNG和汇总表逻辑
+    
+    已完成且内容未变化的文件会被跳过（断点续跑），有文件失败时返回1。
+    """
+    entries = expand_batch_inputs(inputs)
+    if not entries:
+        logger.error("未找到任何.seq文件")
+        return 1
+    
+    if not check_blast_installed():
+        logger.error("BLAST+未安装，请先安装BLAST+工具")
+        return 1
+    
+    os.makedirs(output_dir, exist_ok=True)
+    progress_file = os.path.join(output_dir, BATCH_PROGRESS_FILE)
+    if restart and os.path.exists(progress_file):
+        os.remove(progress_file)
+    
+    summary_records, errors = process_batch(entries, output_dir, workers=workers, render_png=render_png)
+    print(f"批量处理完成: 成功 {len(summary_records)} 条记录，失败 {len(errors)} 个")
+    print(f"结果目录: {os.path.abspath(output_dir)}")
+    return 1 if errors else 0
+
+def main(argv=None):
+    """命令行入口：默认启动Web服务，batch子命令执行命令行批量比对"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='localblast', description='LocalBlast - 本地化BLAST序列比对工具')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    serve_parser = subparsers.add_parser('serve', help='启动Web服务（默认）')
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=5001)
+    
+    batch_parser = subparsers.add_parser('batch', help='命令行批量比对.seq文件')
+    batch_parser.add_argument('inputs', nargs='+', help='.seq文件、目录或通配符（如 "data/*.seq"）')
+    batch_parser.add_argument('-o', '--output', required=True, help='结果输出目录')
+    batch_parser.add_argument('-j', '--workers', type=int, default=None,
+                              help='并行比对线程数（默认为CPU核数）')
+    batch_parser.add_argument('--no-png', action='store_true', help='不生成PNG图片')
+    batch_parser.add_argument('--restart', action='store_true', help='忽略已有进度，全部重新处理')
+    
+    args = parser.parse_args(argv)
+    if args.command == 'batch' and 'LOCALBLAST_LOG_FORMAT' not in os.environ:
+        # 命令行批量默认使用便于阅读的文本日志
+        setup_logging('text')
     load_species_db()
+    # 清理上次运行残留的临时目录和旧版本参比库副本
+    SCRATCH.cleanup_stale(keep_reference=REFERENCE_HASH[:20])
+    
+    if args.command == 'batch':
+        return run_batch_cli(args.inputs, args.output, workers=args.workers,
+                             render_png=not args.no_png, restart=args.restart)
+    
+    # 续跑上次服务中断的批次并启动结果清理（启用重载器时会有两个进程，只在实际提供服务的子进程中执行）
+    use_reloader = os.environ.get('LOCALBLAST_RELOADER', '1') == '1'
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    
+    host = getattr(args, 'host', '0.0.0.0')
+    port = getattr(args, 'port', 5001)
     print("=" * 50)
     print("LocalBlast - 本地化BLAST序列比对工具")
     print("=" * 50)
-    print("服务已启动，访问 http://localhost:5001 使用BLAST工具")
+    print(f"服务已启动，访问 http://localhost:{port} 使用BLAST工具")
     print("按 Ctrl+C 停止服务")
     print("=" * 50)
-    app.run(debug=True, host='0.0.0.0', port=5001)
-
-
+    app.run(debug=True, host=host, port=port, use_reloader=use_reloader)
+    return 0
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,6 +23,7 @@ echo 正在复制文件...
 
 REM 复制核心文件
 copy blast_app.py %PACKAGE_DIR%\ >nul
+copy species_ref.py %PACKAGE_DIR%\ >nul
 copy species_db.json %PACKAGE_DIR%\ >nul
 copy requirements.txt %PACKAGE_DIR%\ >nul
 copy README.md %PACKAGE_DIR%\ >nul
@@ -30,6 +30,7 @@ echo "检查必需文件..."
 REQUIRED_FILES=(
     "Dockerfile"
     "blast_app.py"
+    "species_ref.py"
     "species_db.json"
     "requirements.txt"
     "chromedriver-linux64.zip"
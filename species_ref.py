@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+编译后的参比序列库（species_db.ref）
+
+species_db.json 仍是人工编辑的数据源，update_species_db.py 在更新后将其编译为二进制文件：
+序列按2-bit压缩存放，附带偏移表、元数据和预筛选用的规范k-mer索引。
+服务进程以只读内存映射方式加载，多个进程共享同一份页面缓存，序列在使用时才解码。
+编译结果写入带版本号的文件（species_db.<版本>.ref），species_db.ref只记录当前版本的文件名，
+更新时不覆盖仍被其他进程映射的文件（Windows下无法替换已映射的文件）。
+
+文件布局（小端序/本机字节序由byteorder字段标记，各段按8字节对齐）：
+    header    HEADER_STRUCT
+    metadata  UTF-8 JSON：物种元数据（不含序列）、非ACGT字符、来源文件哈希、参比库版本哈希
+    table     每个物种一项 (压缩数据字节偏移 uint64, 序列长度 uint64)
+    packed    2-bit压缩序列（A=0 C=1 G=2 T=3，每字节4个碱基，高位在前）
+    kmers     有序uint64数组：(规范k-mer编码 << 32) | (物种下标 << 1) | 方向位
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import sys
+from array import array
+
+MAGIC = b'LBSPREF1'
+FORMAT_VERSION = 1
+DEFAULT_K = 16
+# BLAST数据库分片：按物种ID每SHARD_SIZE个一组，只重建内容变化的分片
+SHARD_SIZE = 1000
+BLAST_DB_ALIAS = 'reference'
+# magic, 格式版本, k, 字节序(0小端/1大端), 物种数,
+# 元数据偏移/长度, 偏移表偏移, 压缩序列偏移/长度, k-mer索引偏移/条数
+HEADER_STRUCT = struct.Struct('<8sHBBIQQQQQQQ')
+
+_BASE_CODES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+_COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+# 每个字节解码为4个碱基
+_DECODE_TABLE = [''.join('ACGT'[(byte >> shift) & 3] for shift in (6, 4, 2, 0)) for byte in range(256)]
+
+def reverse_complement(sequence):
+    """返回序列的反向互补序列"""
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+def iter_canonical_kmers(sequence, k):
+    """依次返回每个k-mer的规范编码（正向与反向互补编码中较小者）及方向位
+    
+    方向位为0表示k-mer本身即规范形式，为1表示其反向互补为规范形式。
+    正反两条链的编码在同一次遍历中滚动计算，无需另外生成反向互补序列。
+    跳过含非ACGT字符的k-mer。
+    """
+    mask = (1 << (2 * k)) - 1
+    shift = 2 * (k - 1)
+    forward = reverse = 0
+    valid = 0
+    for base in sequence:
+        value = _BASE_CODES.get(base)
+        if value is None:
+            forward = reverse = 0
+            valid = 0
+            continue
+        forward = ((forward << 2) | value) & mask
+        reverse = (reverse >> 2) | ((3 - value) << shift)
+        valid += 1
+        if valid >= k:
+            if forward <= reverse:
+                yield forward, 0
+            else:
+                yield reverse, 1
+
+def build_kmer_postings(sequences, k=DEFAULT_K):
+    """为序列列表建立有序的规范k-mer倒排表（array('Q')）"""
+    if k > 16:
+        raise ValueError("k-mer长度不能超过16")
+    entries = set()
+    for index, sequence in enumerate(sequences):
+        for code, orientation in iter_canonical_kmers(sequence, k):
+            entries.add((code << 32) | (index << 1) | orientation)
+    return array('Q', sorted(entries))
+
+def reference_hash(species_list):
+    """参比库版本哈希（由ID、名称、编号和序列决定，与JSON排版无关）"""
+    digest = hashlib.sha256()
+    for species in species_list:
+        entry = [species['id'], species.get('name', ''), species.get('code', ''), species['sequence']]
+        digest.update(json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+def pack_sequence(sequence):
+    """2-bit压缩序列，返回(压缩字节, 非ACGT字符列表[(位置, 连续字符)])
+    
+    非ACGT字符在压缩数据中记为A，解码时按列表还原。
+    """
+    packed = bytearray((len(sequence) + 3) // 4)
+    exceptions = []
+    run_start = None
+    for position, base in enumerate(sequence):
+        value = _BASE_CODES.get(base)
+        if value is None:
+            if run_start is None:
+                run_start = position
+            continue
+        if run_start is not None:
+            exceptions.append((run_start, sequence[run_start:position]))
+            run_start = None
+        if value:
+            packed[position >> 2] |= value << (6 - 2 * (position & 3))
+    if run_start is not None:
+        exceptions.append((run_start, sequence[run_start:]))
+    return bytes(packed), exceptions
+
+def unpack_sequence(data, length, exceptions=()):
+    """pack_sequence的逆操作"""
+    sequence = ''.join(map(_DECODE_TABLE.__getitem__, data))[:length]
+    for position, run in exceptions:
+        sequence = sequence[:position] + run + sequence[position + len(run):]
+    return sequence
+
+def _align8(offset):
+    return (offset + 7) & ~7
+
+def versioned_ref_file(ref_file, name):
+    """ref_file对应的带版本号的参比库文件路径（species_db.ref -> species_db.<name>.ref）"""
+    stem, ext = os.path.splitext(ref_file)
+    return f"{stem}.{name}{ext}"
+
+def resolve_ref_file(ref_file):
+    """读取ref_file记录的当前版本参比库文件路径；ref_file本身即为参比库（旧格式）时直接返回"""
+    with open(ref_file, 'rb') as f:
+        head = f.read(256)
+    if head.startswith(MAGIC):
+        return ref_file
+    name = os.path.basename(head.decode('utf-8').strip())
+    return os.path.join(os.path.dirname(ref_file), name)
+
+def compile_reference(species_list, ref_file, source_sha256=None, k=DEFAULT_K):
+    """将物种列表编译为带版本号的二进制参比库文件，再原子替换ref_file中记录的文件名
+    
+    已映射的旧版本文件不会被覆盖；不再使用的旧版本在能删除时（POSIX，或Windows下已无进程映射）删除。
+    
+    Args:
+        species_list: species_db.json格式的物种列表
+        ref_file: 记录当前版本的文件路径
+        source_sha256: 数据源species_db.json的SHA-256，加载时据此判断编译结果是否过期
+        k: 预筛选k-mer长度
+    
+    Returns:
+        参比库版本哈希
+    """
+    species_meta = []
+    exceptions = {}
+    table = array('Q')
+    packed_parts = []
+    packed_length = 0
+    for index, species in enumerate(species_list):
+        sequence = species['sequence']
+        packed, sequence_exceptions = pack_sequence(sequence)
+        meta = {key: value for key, value in species.items() if key != 'sequence'}
+        meta['length'] = len(sequence)
+        species_meta.append(meta)
+        if sequence_exceptions:
+            exceptions[str(index)] = sequence_exceptions
+        table.extend((packed_length, len(sequence)))
+        packed_parts.append(packed)
+        packed_length += len(packed)
+    
+    version = reference_hash(species_list)
+    metadata = json.dumps({
+        'reference_hash': version,
+        'source_sha256': source_sha256,
+        'species': species_meta,
+        'exceptions': exceptions
+    }, ensure_ascii=False).encode('utf-8')
+    postings = build_kmer_postings([species['sequence'] for species in species_list], k)
+    
+    meta_offset = _align8(HEADER_STRUCT.size)
+    table_offset = _align8(meta_offset + len(metadata))
+    packed_offset = _align8(table_offset + len(table) * table.itemsize)
+    kmer_offset = _align8(packed_offset + packed_length)
+    header = HEADER_STRUCT.pack(
+        MAGIC, FORMAT_VERSION, k, 0 if sys.byteorder == 'little' else 1, len(species_list),
+        meta_offset, len(metadata), table_offset, packed_offset, packed_length,
+        kmer_offset, len(postings))
+    
+    # 文件内容由参比库、数据源哈希和k决定，内容相同时复用已有文件
+    name = hashlib.sha256(f"{version}\n{source_sha256}\n{k}".encode('utf-8')).hexdigest()[:16]
+    data_file = versioned_ref_file(ref_file, name)
+    if not os.path.exists(data_file):
+        temp_file = f"{data_file}.tmp{os.getpid()}"
+        with open(temp_file, 'wb') as f:
+            for offset, chunk in ((0, header), (meta_offset, metadata), (table_offset, table.tobytes()),
+                                  (packed_offset, b''.join(packed_parts)), (kmer_offset, postings.tobytes())):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(chunk)
+        os.replace(temp_file, data_file)
+    
+    with open(f"{ref_file}.tmp{os.getpid()}", 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(data_file) + "\n")
+    os.replace(f"{ref_file}.tmp{os.getpid()}", ref_file)
+    
+    stem, ext = os.path.splitext(os.path.basename(ref_file))
+    directory = os.path.dirname(ref_file) or '.'
+    for entry in os.listdir(directory):
+        if (entry.startswith(f"{stem}.") and entry.endswith(ext) and entry != os.path.basename(data_file)
+                and entry != os.path.basename(ref_file)):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError:
+                # Windows下仍被其他进程映射，下次编译时再删除
+                pass
+    return version
+
+class SpeciesRecord(dict):
+    """物种元数据；'sequence'在访问时才从内存映射的参比库解码，不常驻内存
+    
+    record['sequence']、record.get('sequence')和'sequence' in record与普通字典一致，
+    但遍历、len和dict(record)不包含序列。
+    """
+    __slots__ = ('_reference', '_index')
+    
+    def __missing__(self, key):
+        if key == 'sequence':
+            return self._reference.sequence(self._index)
+        raise KeyError(key)
+    
+    def __contains__(self, key):
+        return key == 'sequence' or dict.__contains__(self, key)
+    
+    def get(self, key, default=None):
+        if key == 'sequence':
+            return self[key]
+        return dict.get(self, key, default)
+
+class CompiledReference:
+    """以只读内存映射方式打开的编译参比库"""
+    
+    def __init__(self, ref_file):
+        self.path = ref_file
+        with open(ref_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+    
+    def _load(self):
+        buffer = self._mmap
+        if len(buffer) < HEADER_STRUCT.size:
+            raise ValueError("参比库文件不完整")
+        (magic, version, self.k, byteorder, count, meta_offset, meta_length, table_offset,
+         self._packed_offset, packed_length, kmer_offset, kmer_count) = HEADER_STRUCT.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("参比库文件格式不兼容")
+        if byteorder != (0 if sys.byteorder == 'little' else 1):
+            raise ValueError("参比库文件字节序与本机不一致")
+        if kmer_offset + kmer_count * 8 > len(buffer):
+            raise ValueError("参比库文件不完整")
+        
+        metadata = json.loads(bytes(buffer[meta_offset:meta_offset + meta_length]).decode('utf-8'))
+        self.reference_hash = metadata['reference_hash']
+        self.source_sha256 = metadata.get('source_sha256')
+        self._exceptions = {int(index): runs for index, runs in metadata.get('exceptions', {}).items()}
+        
+        self._view = view = memoryview(buffer)
+        self._table = view[table_offset:table_offset + count * 16].cast('Q')
+        self._packed = view[self._packed_offset:self._packed_offset + packed_length]
+        # 有序k-mer倒排表，可直接用bisect查找
+        self.postings = view[kmer_offset:kmer_offset + kmer_count * 8].cast('Q')
+        
+        self.species = []
+        for index, meta in enumerate(metadata['species']):
+            record = SpeciesRecord(meta)
+            record._reference = self
+            record._index = index
+            self.species.append(record)
+    
+    def sequence(self, index):
+        """解码第index个物种的序列"""
+        offset = self._table[2 * index]
+        length = self._table[2 * index + 1]
+        data = self._packed[offset:offset + (length + 3) // 4]
+        return unpack_sequence(data, length, self._exceptions.get(index, ()))
+    
+    def close(self):
+        for name in ('_table', '_packed', 'postings', '_view'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+
+def open_reference(ref_file, source_sha256=None):
+    """打开ref_file记录的当前版本编译参比库；文件不存在或与数据源不一致（source_sha256不同）时返回None"""
+    if not os.path.exists(ref_file):
+        return None
+    data_file = resolve_ref_file(ref_file)
+    if not os.path.exists(data_file):
+        return None
+    reference = CompiledReference(data_file)
+    if source_sha256 and reference.source_sha256 != source_sha256:
+        reference.close()
+        return None
+    return reference
+
+def compile_species_db(json_file, ref_file, k=DEFAULT_K):
+    """编译species_db.json，返回(物种数, 参比库版本哈希)"""
+    with open(json_file, 'rb') as f:
+        raw = f.read()
+    species_list = json.loads(raw.decode('utf-8'))
+    version = compile_reference(species_list, ref_file, hashlib.sha256(raw).hexdigest(), k)
+    return len(species_list), version
+
+def blast_subject_id(species):
+    """BLAST数据库中的序列ID（species_id|species_name），比对结果据此识别物种"""
+    return f"{species['id']}|{species['name']}"
+
+def sync_blast_db(species_list, db_dir, runner=subprocess.run, shard_size=SHARD_SIZE, prune=False):
+    """增量更新按内容哈希分片的BLAST数据库，并生成汇总所有分片的别名数据库
+    
+    分片目录以分片内容哈希命名，内容未变化的分片直接复用，只对新增或变化的分片执行makeblastdb。
+    别名数据库同样按分片列表的哈希命名（reference_<哈希>.nal），不改写其他进程正在使用的别名，
+    调用方拿到新路径即完成切换。
+    
+    Args:
+        species_list: 物种列表
+        db_dir: 数据库目录
+        runner: 执行makeblastdb的函数（与subprocess.run签名一致）
+        shard_size: 每个分片的物种ID范围
+        prune: 是否删除不再使用的分片和别名（其他进程可能仍在使用旧版本时不要删除）
+    
+    Returns:
+        (别名数据库路径（传给blastn -db）, 新建分片数, 复用分片数)
+    """
+    shards = {}
+    for species in species_list:
+        shards.setdefault(species['id'] // shard_size, []).append(species)
+    
+    shard_dir = os.path.join(db_dir, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+    names = []
+    built = 0
+    for key in sorted(shards):
+        name = reference_hash(shards[key])[:20]
+        names.append(name)
+        target = os.path.join(shard_dir, name)
+        if os.path.isdir(target):
+            continue
+        
+        temp_dir = f"{target}.tmp{os.getpid()}"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        try:
+            fasta_file = os.path.join(temp_dir, 'shard.fasta')
+            with open(fasta_file, 'w') as f:
+                for species in shards[key]:
+                    f.write(f">{blast_subject_id(species)}\n{species['sequence']}\n")
+            runner(['makeblastdb', '-in', fasta_file, '-dbtype', 'nucl',
+                    '-out', os.path.join(temp_dir, 'db')], check=True, capture_output=True)
+            os.remove(fasta_file)
+            os.rename(temp_dir, target)
+        except OSError:
+            # 其他进程已生成相同分片
+            if not os.path.isdir(target):
+                raise
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        built += 1
+    
+    alias_name = f"{BLAST_DB_ALIAS}_{hashlib.sha256(' '.join(names).encode('utf-8')).hexdigest()[:16]}"
+    alias_file = os.path.join(db_dir, f"{alias_name}.nal")
+    if not os.path.exists(alias_file):
+        temp_file = f"{alias_file}.tmp{os.getpid()}"
+        with open(temp_file, 'w') as f:
+            f.write("TITLE LocalBlast reference\n")
+            f.write("DBLIST " + ' '.join(f'"shards/{name}/db"' for name in names) + "\n")
+        os.replace(temp_file, alias_file)
+    
+    if prune:
+        current = set(names)
+        for entry in os.listdir(shard_dir):
+            if entry not in current and '.tmp' not in entry:
+                shutil.rmtree(os.path.join(shard_dir, entry), ignore_errors=True)
+        for entry in os.listdir(db_dir):
+            if (entry.startswith(f"{BLAST_DB_ALIAS}_") and entry.endswith('.nal')
+                    and entry != f"{alias_name}.nal"):
+                os.remove(os.path.join(db_dir, entry))
+    
+    return os.path.join(db_dir, alias_name), built, len(names) - built
@@ -23,6 +23,7 @@ REQUIRED_FILES=(
     "Dockerfile"
     "docker-compose.yml"
     "blast_app.py"
+    "species_ref.py"
     "species_db.json"
     "requirements.txt"
     "chromedriver-linux64.zip"
@@ -102,6 +103,9 @@ sshpass -p "$SERVER_PASSWORD" scp -o StrictHostKeyChecking=no docker-compose.yml
 echo "上传 blast_app.py..."
 sshpass -p "$SERVER_PASSWORD" scp -o StrictHostKeyChecking=no blast_app.py "$SERVER_USER@$SERVER_IP:$REMOTE_DIR/"
 
+echo "上传 species_ref.py..."
+sshpass -p "$SERVER_PASSWORD" scp -o StrictHostKeyChecking=no species_ref.py "$SERVER_USER@$SERVER_IP:$REMOTE_DIR/"
+
 echo "上传 species_db.json..."
 sshpass -p "$SERVER_PASSWORD" scp -o StrictHostKeyChecking=no species_db.json "$SERVER_USER@$SERVER_IP:$REMOTE_DIR/"
 
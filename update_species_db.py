@@ -2,20 +2,24 @@
 # -*- coding: utf-8 -*-
 """
 更新参比序列数据库
-从Excel文件读取数据并更新species_db.json
+从Excel（所有工作表）、CSV或FASTA文件读取数据并更新species_db.json，
+与现有数据库比较差异，只在内容变化时重写JSON、重新编译参比库并增量更新BLAST数据库分片
 """
 
+import argparse
+import csv
+import hashlib
 import json
 import re
+import shutil
 import sys
 import os
 
-try:
-    import openpyxl
-except ImportError:
-    print("错误: 需要安装openpyxl库")
-    print("请运行: pip3 install openpyxl")
-    sys.exit(1)
+from species_ref import compile_species_db, open_reference, sync_blast_db
+
+DEFAULT_INPUT = '参比序列-20260114.xlsx'
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+FASTA_EXTENSIONS = ('.fasta', '.fa', '.fas', '.fna')
 
 def clean_sequence(seq):
     """清理序列，只保留ATCG字符"""
@@ -29,170 +33,334 @@ def clean_sequence(seq):
     seq = re.sub(r'[^ATCG]', '', seq)
     return seq
 
-def read_excel_to_species_db(excel_file):
-    """从Excel文件读取数据并转换为species_db格式"""
-    print(f"正在读取Excel文件: {excel_file}")
+def detect_columns(headers):
+    """根据表头识别ID、名称、编号和序列列（支持多种可能的列名），返回列下标（从0开始）"""
+    columns = {'id': None, 'name': None, 'code': None, 'sequence': None}
+    for i, header in enumerate(headers):
+        header_lower = header.lower()
+        if '名称' in header or 'name' in header_lower or '物种' in header or '靶点' in header:
+            columns['name'] = i
+        elif '编号' in header or 'code' in header_lower or '代码' in header:
+            columns['code'] = i
+        elif ('参比序列' in header or 'sequence' in header_lower or ('seq' in header_lower and '大小' not in header)):
+            columns['sequence'] = i
+        elif 'id' in header_lower or '序号' in header or '流水号' in header:
+            columns['id'] = i
+    return columns
+
+def new_reader_state(verbose=False):
+    """多个输入文件共用的读取状态（自动递增ID、已使用的ID）"""
+    return {'max_id': 0, 'ids': set(), 'verbose': verbose}
+
+def add_species(species_list, state, name, sequence, code, id_value, location):
+    """校验一条记录并加入species_list，location用于提示信息"""
+    # 跳过空行
+    if not name or not sequence:
+        return
+    
+    name = str(name).strip()
+    sequence = clean_sequence(sequence)
+    code = str(code).strip() if code else ""
+    
+    if not sequence or len(sequence) < 10:
+        print(f"警告: {location}的序列太短或无效，已跳过")
+        return
+    
+    # 处理ID
+    species_id = None
+    if id_value:
+        try:
+            species_id = int(id_value)
+        except (ValueError, TypeError):
+            species_id = None
+    
+    # 如果没有ID，使用自动递增
+    if species_id is None:
+        species_id = state['max_id'] + 1
+        while species_id in state['ids']:
+            species_id += 1
+    elif species_id in state['ids']:
+        print(f"警告: {location}的ID {species_id} 重复，已跳过")
+        return
+    state['max_id'] = max(species_id, state['max_id'])
+    state['ids'].add(species_id)
+    
+    species_list.append({
+        "id": species_id,
+        "name": name,
+        "code": code,
+        "sequence": sequence,
+        "length": len(sequence)
+    })
+    if state['verbose']:
+        print(f"已读取: ID={species_id}, 名称={name}, 编号={code}, 序列长度={len(sequence)}")
+
+def read_table_rows(rows, source, species_list, state):
+    """读取表格行（第一行为表头），返回是否识别到必要的列"""
+    rows = iter(rows)
+    header_row = next(rows, None)
+    if not header_row:
+        print(f"{source}: 空表，已跳过")
+        return False
+    
+    headers = [str(value).strip() if value else f"列{i + 1}" for i, value in enumerate(header_row)]
+    columns = detect_columns(headers)
+    if columns['name'] is None or columns['sequence'] is None:
+        print(f"{source}: 无法识别必要的列（名称和序列），已跳过。表头: {headers}")
+        return False
+    
+    print(f"{source}: 识别到的列: " + ", ".join(
+        f"{key}={headers[index] if index is not None else '未找到'}" for key, index in columns.items()))
     
+    def cell(row, key):
+        index = columns[key]
+        return row[index] if index is not None and index < len(row) else None
+    
+    before = len(species_list)
+    for row_number, row in enumerate(rows, 2):  # 从第2行开始（跳过表头）
+        add_species(species_list, state, cell(row, 'name'), cell(row, 'sequence'),
+                    cell(row, 'code'), cell(row, 'id'), f"{source} 第{row_number}行")
+    print(f"{source}: 读取 {len(species_list) - before} 条参比序列")
+    return True
+
+def read_excel_to_species_db(excel_file, species_list, state, sheets=None):
+    """以只读流式方式读取Excel文件的工作表（默认全部工作表）"""
     try:
-        wb = openpyxl.load_workbook(excel_file, data_only=True)
-        ws = wb.active
-        
-        print(f"工作表名称: {ws.title}")
-        print(f"总行数: {ws.max_row}")
-        print(f"总列数: {ws.max_column}")
-        
-        # 读取表头
-        headers = []
-        header_row = 1
-        for col in range(1, ws.max_column + 1):
-            cell_value = ws.cell(row=header_row, column=col).value
-            if cell_value:
-                headers.append(str(cell_value).strip())
-            else:
-                headers.append(f"列{col}")
-        
-        print(f"表头: {headers}")
-        
-        # 尝试识别列名（支持多种可能的列名）
-        name_col = None
-        code_col = None
-        sequence_col = None
-        id_col = None
-        
-        for i, header in enumerate(headers):
-            header_lower = header.lower()
-            if '名称' in header or 'name' in header_lower or '物种' in header or '靶点' in header:
-                name_col = i + 1
-            elif '编号' in header or 'code' in header_lower or '代码' in header:
-                code_col = i + 1
-            elif ('参比序列' in header or 'sequence' in header_lower or ('seq' in header_lower and '大小' not in header)):
-                sequence_col = i + 1
-            elif 'id' in header_lower or '序号' in header or '流水号' in header:
-                id_col = i + 1
-        
-        print(f"识别到的列位置:")
-        print(f"  ID列: {id_col} ({headers[id_col-1] if id_col else '未找到'})")
-        print(f"  名称列: {name_col} ({headers[name_col-1] if name_col else '未找到'})")
-        print(f"  编号列: {code_col} ({headers[code_col-1] if code_col else '未找到'})")
-        print(f"  序列列: {sequence_col} ({headers[sequence_col-1] if sequence_col else '未找到'})")
-        
-        if not name_col or not sequence_col:
-            print("错误: 无法识别必要的列（名称和序列）")
-            print("请确保Excel文件包含以下列之一:")
-            print("  - 名称/Name/物种")
-            print("  - 序列/Sequence/Seq")
-            return None
-        
-        # 读取数据
-        species_list = []
-        max_id = 0
-        
-        for row in range(2, ws.max_row + 1):  # 从第2行开始（跳过表头）
-            name = ws.cell(row=row, column=name_col).value
-            sequence = ws.cell(row=row, column=sequence_col).value if sequence_col else None
-            code = ws.cell(row=row, column=code_col).value if code_col else ""
-            id_value = ws.cell(row=row, column=id_col).value if id_col else None
-            
-            # 跳过空行
-            if not name or not sequence:
-                continue
-            
-            name = str(name).strip()
-            sequence = clean_sequence(sequence)
-            code = str(code).strip() if code else ""
-            
-            if not sequence or len(sequence) < 10:
-                print(f"警告: 第{row}行的序列太短或无效，已跳过")
+        import openpyxl
+    except ImportError:
+        print("错误: 读取Excel文件需要安装openpyxl库")
+        print("请运行: pip3 install openpyxl")
+        return False
+    
+    print(f"正在读取Excel文件: {excel_file}")
+    wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        found = False
+        for ws in wb.worksheets:
+            if sheets and ws.title not in sheets:
                 continue
-            
-            # 处理ID
-            if id_value:
-                try:
-                    species_id = int(id_value)
-                except (ValueError, TypeError):
-                    species_id = None
-            else:
-                species_id = None
-            
-            # 如果没有ID，使用自动递增
-            if species_id is None:
-                max_id += 1
-                species_id = max_id
+            if read_table_rows(ws.iter_rows(values_only=True), f"{excel_file}[{ws.title}]", species_list, state):
+                found = True
+        return found
+    finally:
+        wb.close()
+
+def read_csv_to_species_db(csv_file, species_list, state):
+    """读取CSV文件（UTF-8，可带BOM）"""
+    print(f"正在读取CSV文件: {csv_file}")
+    with open(csv_file, 'r', encoding='utf-8-sig', newline='') as f:
+        return read_table_rows(csv.reader(f), csv_file, species_list, state)
+
+def read_fasta_to_species_db(fasta_file, species_list, state):
+    """读取FASTA文件，标题行格式为 >ID|名称|编号（ID和编号可省略）或 >名称"""
+    print(f"正在读取FASTA文件: {fasta_file}")
+    before = len(species_list)
+    
+    def flush(header, chunks, line_number):
+        if header is None:
+            return
+        parts = [part.strip() for part in header.split('|')]
+        if len(parts) > 1 and parts[0].isdigit():
+            id_value, name = parts[0], parts[1]
+            code = parts[2] if len(parts) > 2 else ""
+        else:
+            id_value, name, code = None, header.strip(), ""
+        add_species(species_list, state, name, ''.join(chunks), code, id_value,
+                    f"{fasta_file} 第{line_number}行")
+    
+    header = None
+    header_line = 0
+    chunks = []
+    with open(fasta_file, 'r', encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line.startswith('>'):
+                flush(header, chunks, header_line)
+                header, header_line, chunks = line[1:], line_number, []
+            elif line:
+                chunks.append(line)
+    flush(header, chunks, header_line)
+    print(f"{fasta_file}: 读取 {len(species_list) - before} 条参比序列")
+    return True
+
+def read_species_sources(input_files, sheets=None, verbose=False):
+    """按顺序读取所有输入文件，返回物种列表；没有读取到任何数据时返回None"""
+    species_list = []
+    state = new_reader_state(verbose)
+    for input_file in input_files:
+        extension = os.path.splitext(input_file)[1].lower()
+        try:
+            if extension in EXCEL_EXTENSIONS:
+                read_excel_to_species_db(input_file, species_list, state, sheets)
+            elif extension == '.csv':
+                read_csv_to_species_db(input_file, species_list, state)
+            elif extension in FASTA_EXTENSIONS:
+                read_fasta_to_species_db(input_file, species_list, state)
             else:
-                max_id = max(species_id, max_id)
-            
-            species = {
-                "id": species_id,
-                "name": name,
-                "code": code,
-                "sequence": sequence,
-                "length": len(sequence)
-            }
-            
-            species_list.append(species)
-            print(f"已读取: ID={species_id}, 名称={name}, 编号={code}, 序列长度={len(sequence)}")
-        
-        print(f"\n成功读取 {len(species_list)} 条参比序列")
-        return species_list
-        
-    except Exception as e:
-        print(f"读取Excel文件时出错: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
+                print(f"错误: 不支持的文件类型 {input_file}（支持Excel、CSV和FASTA）")
+                return None
+        except Exception as e:
+            print(f"读取文件 {input_file} 时出错: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    print(f"\n成功读取 {len(species_list)} 条参比序列")
+    return species_list or None
+
+def sequence_digest(sequence):
+    return hashlib.sha256(sequence.encode('ascii')).hexdigest()
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def diff_species_db(old_list, new_list):
+    """按ID和序列哈希比较新旧数据库，返回新增、变更（序列、名称或编号变化）和删除的ID列表"""
+    old = {species['id']: species for species in old_list}
+    new = {species['id']: species for species in new_list}
+    changed = []
+    for species_id, species in new.items():
+        previous = old.get(species_id)
+        if previous is None:
+            continue
+        if (sequence_digest(previous['sequence']) != sequence_digest(species['sequence'])
+                or previous.get('name') != species.get('name') or previous.get('code') != species.get('code')):
+            changed.append(species_id)
+    return {
+        'added': sorted(set(new) - set(old)),
+        'changed': sorted(changed),
+        'removed': sorted(set(old) - set(new))
+    }
+
+def print_diff(diff, old_list, new_list, limit=20):
+    """输出差异摘要"""
+    names = {species['id']: species.get('name', '') for species in old_list}
+    names.update((species['id'], species.get('name', '')) for species in new_list)
+    for key, label in (('added', '新增'), ('changed', '变更'), ('removed', '删除')):
+        ids = diff[key]
+        print(f"   {label}: {len(ids)} 条")
+        for species_id in ids[:limit]:
+            print(f"      ID={species_id} {names.get(species_id, '')}")
+        if len(ids) > limit:
+            print(f"      ...（另有 {len(ids) - limit} 条）")
 
-def update_species_db(excel_file, output_file='species_db.json', backup=True):
+def load_current_db(output_file):
+    if not os.path.exists(output_file):
+        return []
+    with open(output_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def update_species_db(input_files, output_file='species_db.json', backup=True, sheets=None,
+                      dry_run=False, blast_db_dir=None, prune_blast_db=False, verbose=False):
     """更新参比序列数据库"""
+    if isinstance(input_files, str):
+        input_files = [input_files]
     
-    # 备份原文件
-    if backup and os.path.exists(output_file):
-        backup_file = output_file + '.backup'
-        import shutil
-        shutil.copy2(output_file, backup_file)
-        print(f"已备份原文件到: {backup_file}")
-    
-    # 读取Excel
-    species_list = read_excel_to_species_db(excel_file)
+    # 读取输入文件
+    species_list = read_species_sources(input_files, sheets, verbose)
     
     if not species_list:
-        print("错误: 无法从Excel文件读取数据")
+        print("错误: 无法从输入文件读取数据")
         return False
     
     # 按ID排序
     species_list.sort(key=lambda x: x['id'])
     
-    # 保存到JSON文件
-    try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(species_list, f, ensure_ascii=False, indent=2)
-        
-        print(f"\n✅ 成功更新参比序列数据库!")
-        print(f"   文件: {output_file}")
-        print(f"   共 {len(species_list)} 条参比序列")
-        print(f"   ID范围: {species_list[0]['id']} - {species_list[-1]['id']}")
+    # 与现有数据库比较
+    current_list = load_current_db(output_file)
+    diff = diff_species_db(current_list, species_list)
+    unchanged = not any(diff.values()) and len(current_list) == len(species_list)
+    print(f"\n与现有数据库 {output_file} 的差异:")
+    print_diff(diff, current_list, species_list)
+    
+    if dry_run:
+        print("\n仅比较差异（--dry-run），未修改任何文件")
         return True
+    
+    ref_file = os.path.splitext(output_file)[0] + '.ref'
+    if unchanged and open_reference(ref_file, file_sha256(output_file)) is not None:
+        print("\n参比序列没有变化，无需更新")
+        return True
+    
+    if not unchanged:
+        # 备份原文件
+        if backup and os.path.exists(output_file):
+            backup_file = output_file + '.backup'
+            shutil.copy2(output_file, backup_file)
+            print(f"已备份原文件到: {backup_file}")
         
+        # 保存到JSON文件
+        try:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(species_list, f, ensure_ascii=False, indent=2)
+            
+            print(f"\n✅ 成功更新参比序列数据库!")
+            print(f"   文件: {output_file}")
+            print(f"   共 {len(species_list)} 条参比序列")
+            print(f"   ID范围: {species_list[0]['id']} - {species_list[-1]['id']}")
+        
+        except Exception as e:
+            print(f"保存JSON文件时出错: {str(e)}")
+            return False
+    
+    # 编译二进制参比库（服务启动时以内存映射方式加载）
+    try:
+        count, version = compile_species_db(output_file, ref_file)
+        print(f"   编译参比库: {ref_file}（{count} 条，版本 {version[:12]}）")
     except Exception as e:
-        print(f"保存JSON文件时出错: {str(e)}")
-        return False
+        # 编译失败不影响JSON更新，服务启动时会自动重新编译
+        print(f"警告: 编译参比库失败: {str(e)}")
+    
+    # 增量更新BLAST数据库分片（只重建内容变化的分片）
+    if shutil.which('makeblastdb'):
+        blast_db_dir = blast_db_dir or os.path.join(os.path.dirname(os.path.abspath(output_file)), 'blast_db')
+        try:
+            path, built, reused = sync_blast_db(species_list, blast_db_dir, prune=prune_blast_db)
+            print(f"   BLAST数据库: {path}（新建 {built} 个分片，复用 {reused} 个）")
+        except Exception as e:
+            print(f"警告: 更新BLAST数据库失败（服务首次比对时会自动建立）: {str(e)}")
+    return True
 
-if __name__ == '__main__':
-    excel_file = '参比序列-20260114.xlsx'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='参比序列数据库更新工具')
+    parser.add_argument('inputs', nargs='*', default=[DEFAULT_INPUT],
+                        help=f'Excel/CSV/FASTA文件，可指定多个（默认 {DEFAULT_INPUT}）')
+    parser.add_argument('-o', '--output', default='species_db.json', help='输出的数据库文件')
+    parser.add_argument('--sheet', action='append', dest='sheets',
+                        help='只读取指定的Excel工作表（可重复指定，默认读取全部工作表）')
+    parser.add_argument('--dry-run', action='store_true', help='只显示与现有数据库的差异，不修改文件')
+    parser.add_argument('--no-backup', action='store_true', help='不备份原数据库文件')
+    parser.add_argument('--blast-db-dir', help='BLAST数据库分片目录（默认为输出文件所在目录下的blast_db）')
+    parser.add_argument('--prune-blast-db', action='store_true',
+                        help='删除不再使用的BLAST数据库分片（请先停止正在运行的服务）')
+    parser.add_argument('-v', '--verbose', action='store_true', help='逐条显示读取的参比序列')
+    args = parser.parse_args(argv)
     
-    if not os.path.exists(excel_file):
-        print(f"错误: 找不到文件 {excel_file}")
-        print("请确保Excel文件在当前目录下")
-        sys.exit(1)
+    missing = [path for path in args.inputs if not os.path.exists(path)]
+    if missing:
+        for path in missing:
+            print(f"错误: 找不到文件 {path}")
+        print("请确保输入文件在当前目录下")
+        return 1
     
     print("=" * 60)
     print("参比序列数据库更新工具")
     print("=" * 60)
     print()
     
-    success = update_species_db(excel_file)
+    success = update_species_db(args.inputs, args.output, backup=not args.no_backup, sheets=args.sheets,
+                                dry_run=args.dry_run, blast_db_dir=args.blast_db_dir,
+                                prune_blast_db=args.prune_blast_db, verbose=args.verbose)
     
     if success:
         print("\n更新完成！")
-    else:
-        print("\n更新失败！")
-        sys.exit(1)
+        return 0
+    print("\n更新失败！")
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())